@@ -1,127 +1,612 @@
 import os
 import json
 import time
+import calendar
+import threading
 import redis
-import pandas as pd
 from datetime import datetime
-from flask import Flask, jsonify, render_template, request, send_file
-from apscheduler.schedulers.background import BackgroundScheduler
-from data_parser import parse_exchange_data
+from flask import Flask, Response, g, jsonify, render_template, request, send_file, stream_with_context
+from data_parser import RECENT_EXCHANGES, ROLLUP_RESOLUTIONS, TIME_SERIES_RESOLUTIONS, generate_time_series
 from data_exporter import DataExporter
+from export_jobs import ExcelExportJobs
+from ingest import IngestWorker
+import archive
+import data_store
+import metrics
 
 app = Flask(__name__)
 
 # Redis configuration
 redis_host = os.environ.get('REDIS_HOST', 'localhost')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
-redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
 
-# Update interval (default: 6 hours)
-UPDATE_INTERVAL = int(os.environ.get('UPDATE_INTERVAL', 21600))
+# Connections shared by all threads of a process; requests wait for a free
+# connection rather than opening one each (event streams hold one while open)
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = int(os.environ.get('REDIS_POOL_TIMEOUT', 20))
 
-def update_database():
-    """Parse the exchange data and update Redis database"""
-    try:
-        app.logger.info(f"Starting database update at {datetime.now()}")
-        
-        # Parse data from exchange_results directory
-        exchange_data = parse_exchange_data('/app/exchange_results')
-        
-        # Update last refresh timestamp
-        redis_client.set('last_update', int(time.time()))
-        
-        # Store parsed data in Redis
-        redis_client.set('exchange_data', json.dumps(exchange_data))
-        
-        # Store individual server data
-        for server, data in exchange_data['servers'].items():
-            redis_client.set(f'server:{server}', json.dumps(data))
-        
-        app.logger.info(f"Database update completed at {datetime.now()}")
-        return True
-    except Exception as e:
-        app.logger.error(f"Error updating database: {str(e)}")
-        return False
+redis_pool = redis.BlockingConnectionPool(host=redis_host, port=redis_port, decode_responses=True,
+                                          max_connections=REDIS_MAX_CONNECTIONS,
+                                          timeout=REDIS_POOL_TIMEOUT)
+redis_client = redis.Redis(connection_pool=redis_pool)
+# Client returning raw bytes, used to serve pre-serialized and compressed payloads
+redis_binary_pool = redis.BlockingConnectionPool(host=redis_host, port=redis_port,
+                                                 max_connections=REDIS_MAX_CONNECTIONS,
+                                                 timeout=REDIS_POOL_TIMEOUT)
+redis_binary = redis.Redis(connection_pool=redis_binary_pool)
+
+# Excel exports: output directory, concurrent jobs and cache limits
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '/app/exports')
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 1))
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', 500 * 1024 * 1024))
+EXPORT_MAX_AGE = int(os.environ.get('EXPORT_MAX_AGE', 7 * 86400))
+
+excel_jobs = ExcelExportJobs(redis_client, redis_binary, EXPORT_DIR, EXPORT_WORKERS, EXPORT_MAX_BYTES, EXPORT_MAX_AGE)
+
+# Background ingestion (scheduler and watcher) runs in the process holding the
+# ingest lease; disable it when ingest.py --watch runs as a separate worker
+INGEST_ENABLED = os.environ.get('INGEST_ENABLED', 'True').lower() == 'true'
+
+# Seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE = int(os.environ.get('SSE_KEEPALIVE', 15))
+
+# Event streams open at once in this process; each holds a worker thread and
+# a Redis connection, so keep it below WEB_THREADS to leave threads for
+# requests. Clients turned away poll for updates instead
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+SSE_RETRY_AFTER = 30
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Largest page the history API returns
+MAX_PAGE_SIZE = 1000
+
+# Default and largest number of links the matrix API returns
+MATRIX_TOP_LINKS = 50
+MAX_MATRIX_LINKS = 5000
+
+# Database updates, configured from the environment (see ingest.py); the
+# scheduler, watcher and API triggers coalesce onto one refresh at a time
+ingest_worker = IngestWorker(redis_client, redis_binary)
+refresh_jobs = ingest_worker.refresh_jobs
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started, for the request metrics"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the latency and response size of a request"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(
+            time.perf_counter() - started)
+        if not response.is_streamed and response.content_length is not None:
+            metrics.RESPONSE_BYTES.labels(endpoint).observe(response.content_length)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Expose the Prometheus metrics of this process (or all workers in multiprocess mode)"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 @app.route('/')
 def index():
     """Render the main dashboard page"""
     return render_template('index.html')
 
+def payload_response(version, generation, fetch):
+    """
+    Serve a stored JSON payload without decoding it
+    
+    Picks the best stored content encoding the client accepts and answers
+    conditional requests for an unchanged snapshot generation with 304.
+    
+    Args:
+        version: Snapshot version the payload belongs to
+        generation: Generation id of the snapshot, so that a version reused
+                    after Redis lost its data never matches an old ETag
+        fetch: Function taking a content encoding (None for plain JSON) and
+               returning the stored bytes or None
+        
+    Returns:
+        Response: The payload, a 304 response, or None if the payload is missing
+    """
+    etag = f'{version}-{generation}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        encoding = request.accept_encodings.best_match(data_store.ENCODINGS)
+        body = fetch(encoding)
+        if body is None:
+            return None
+        
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    
+    # The same generation in any encoding is the same document, hence a weak ETag
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/api/data')
 def get_data():
-    """Get all exchange data"""
-    data = redis_client.get('exchange_data')
-    if data:
-        return jsonify(json.loads(data))
-    else:
-        # Initial load if data doesn't exist
-        update_database()
-        data = redis_client.get('exchange_data')
-        return jsonify(json.loads(data) if data else {"error": "No data available"})
+    """
+    Get all exchange data
+    
+    With ?since_version=N&since_generation=G only what changed after
+    version N of generation G is returned, flagged with "delta": true; when
+    N is no longer in the changelog, or was published with another
+    generation id (Redis lost its data since), the full document is returned
+    instead. Both carry the version and generation they bring the client to
+    in the X-Snapshot-Version and X-Snapshot-Generation headers.
+    """
+    try:
+        since_version = request.args.get('since_version')
+        since_version = int(since_version) if since_version is not None else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    version, generation = data_store.get_current_generation(redis_client)
+    if version is None:
+        # Initial load if data doesn't exist, without holding up the request
+        job = request_refresh()
+        return jsonify({"error": "No data available yet", "refresh": refresh_job_status(job)}), 503
+    
+    response = None
+    since_generation = request.args.get('since_generation')
+    if since_version is not None and since_generation:
+        delta = data_store.get_changes_since(redis_client, since_version, since_generation, version)
+        if delta is not None:
+            response = jsonify({"delta": True, **delta})
+            response.headers['Cache-Control'] = 'no-cache'
+    if response is None:
+        response = payload_response(version, generation, lambda encoding: data_store.get_snapshot_payload(
+            redis_binary, version, encoding))
+    if response is None:
+        return jsonify({"error": "No data available"})
+    
+    response.headers['X-Snapshot-Version'] = str(version)
+    if generation:
+        response.headers['X-Snapshot-Generation'] = generation
+    return response
 
 @app.route('/api/server/<server_name>')
 def get_server_data(server_name):
     """Get data for a specific server"""
-    data = redis_client.get(f'server:{server_name}')
-    if data:
-        return jsonify(json.loads(data))
-    else:
-        return jsonify({"error": f"No data found for server {server_name}"})
+    version, generation = data_store.get_current_generation(redis_client)
+    
+    response = None
+    if version is not None:
+        response = payload_response(version, generation, lambda encoding: data_store.get_server_payload(
+            redis_binary, server_name, version, encoding))
+    return response or jsonify({"error": f"No data found for server {server_name}"})
+
+def parse_time_param(value):
+    """
+    Parse a time query parameter into a history score
+    
+    Args:
+        value: Epoch seconds, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'
+        
+    Returns:
+        int: Seconds since the epoch, or None if value is empty
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if len(value) == 10:
+        value += ' 00:00:00'
+    return calendar.timegm(time.strptime(value, data_store.TIMESTAMP_FORMAT))
+
+@app.route('/api/server/<server_name>/history')
+def get_server_history(server_name):
+    """Get a page of a server's exchange history"""
+    try:
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        if cursor:
+            score, skip = cursor.split(':')
+            cursor = (int(score), int(skip))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    rows, next_cursor = data_store.get_history_page(
+        redis_binary, server_name, since, until, limit, cursor,
+        reverse=request.args.get('order') == 'desc',
+        archive=archive.open_history(ingest_worker.archive_dir, server_name)
+    )
+    
+    return jsonify({
+        "server": server_name,
+        "history": rows,
+        "next_cursor": f"{next_cursor[0]}:{next_cursor[1]}" if next_cursor else None
+    })
+
+@app.route('/api/exchanges')
+def query_exchanges():
+    """Query the history rows of all or some servers by status, target, file and time"""
+    try:
+        since = parse_time_param(request.args.get('from'))
+        until = parse_time_param(request.args.get('to'))
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        if cursor:
+            score, skip = cursor.split(':')
+            cursor = (int(score), int(skip))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    servers = data_store.get_server_names(redis_client)
+    sources = request.args.getlist('source')
+    if sources:
+        servers = [server for server in servers if server in sources]
+    
+    rows, next_cursor = data_store.query_history(
+        redis_binary, servers,
+        status=request.args.get('status'),
+        target=request.args.get('target'),
+        file=request.args.get('file'),
+        start=since, end=until, limit=limit, cursor=cursor,
+        reverse=request.args.get('order') == 'desc',
+        archives={server: archive.open_history(ingest_worker.archive_dir, server) for server in servers}
+    )
+    
+    return jsonify({
+        "exchanges": rows,
+        "next_cursor": f"{next_cursor[0]}:{next_cursor[1]}" if next_cursor else None
+    })
+
+def format_sse(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/api/events')
+def stream_events():
+    """Push the changes of every published snapshot (see data_store.build_change_entry)"""
+    if not sse_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many event streams, poll /api/status instead"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_RETRY_AFTER)
+        return response
+
+    def generate():
+        events = data_store.listen_snapshot_events(redis_client, SSE_KEEPALIVE)
+        # Tell the client which version is live so it can detect missed updates
+        yield format_sse('hello', {"version": data_store.get_current_version(redis_client)})
+        for event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse('snapshot', event, event['version'])
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Free the slot when the stream ends, including streams never started
+    response.call_on_close(sse_slots.release)
+    return response
+
+@app.route('/api/summary')
+def get_summary():
+    """Get the global and per-server totals from the rollup counters"""
+    return jsonify(data_store.get_rollup_summary(redis_client))
+
+@app.route('/api/time-series')
+def get_time_series():
+    """
+    Get sent/received counts per server at the requested resolution
+    
+    Hour, day and week buckets come from the rollup counters, which keep
+    the rows archived out of Redis; minute buckets are built from the
+    history retained in Redis only. The "source" field of the response
+    tells which ("rollup" or "history").
+    """
+    resolution = request.args.get('resolution', 'day')
+    if resolution not in TIME_SERIES_RESOLUTIONS:
+        return jsonify({"error": f"Unsupported resolution: {resolution}",
+                        "resolutions": list(TIME_SERIES_RESOLUTIONS)}), 400
+    
+    # Resolutions kept as rollup counters are read straight from them
+    if resolution in ROLLUP_RESOLUTIONS or resolution == 'week':
+        return jsonify({
+            "resolution": resolution,
+            "source": "rollup",
+            **data_store.get_rollup_time_series(redis_client, resolution)
+        })
+    
+    version = data_store.get_current_version(redis_client)
+    if version is None:
+        return jsonify({"error": "No data available"})
+    
+    # Finer resolutions are built once per snapshot version
+    view = f'time_series:{resolution}'
+    payload = data_store.get_cached_view(redis_client, version, view)
+    if payload is None:
+        data = data_store.get_snapshot_data(redis_binary, version)
+        payload = json.dumps({
+            "resolution": resolution,
+            "source": "history",
+            **generate_time_series(data['servers'], resolution)
+        })
+        data_store.set_cached_view(redis_client, version, view, payload)
+    
+    return Response(payload, mimetype='application/json')
+
+@app.route('/api/matrix')
+def get_matrix():
+    """Get the heaviest links, or one server's row and column, of the connection matrix"""
+    server = request.args.get('server')
+    try:
+        top = request.args.get('top')
+        top = min(max(int(top), 1), MAX_MATRIX_LINKS) if top else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    if server:
+        return jsonify({"server": server, **data_store.get_server_links(redis_client, server, top)})
+    
+    links = data_store.get_top_links(redis_client, top or MATRIX_TOP_LINKS)
+    return jsonify({
+        "links": [{"source": source, "target": target, "count": count}
+                  for source, target, count in links]
+    })
+
+@app.route('/api/volume')
+def get_volume():
+    """Get bytes sent and received per server and link, with throughput in bytes per hour"""
+    resolution = request.args.get('resolution', 'day')
+    if resolution not in ROLLUP_RESOLUTIONS and resolution != 'week':
+        return jsonify({"error": f"Unsupported resolution: {resolution}",
+                        "resolutions": [*ROLLUP_RESOLUTIONS, 'week']}), 400
+    try:
+        top = request.args.get('top')
+        top = min(max(int(top), 1), MAX_MATRIX_LINKS) if top else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    server = request.args.get('server')
+    volume = data_store.get_rollup_volume(redis_client, resolution, server,
+                                          top or (None if server else MATRIX_TOP_LINKS))
+    return jsonify({
+        "resolution": resolution,
+        "servers": volume["servers"],
+        "links": [{"source": source, "target": target, "bytes": size}
+                  for source, target, size in volume["links"]],
+        "throughput": volume["throughput"]
+    })
+
+def request_refresh():
+    """
+    Request a full refresh: run by this process when it ingests, otherwise
+    only recorded for the ingest leader to run
+    """
+    if INGEST_ENABLED:
+        return refresh_jobs.submit()
+    return refresh_jobs.request()
+
+def refresh_job_status(job):
+    """Add the status URL to a refresh job"""
+    return {**job, "status_url": f"/api/update/{job['job_id']}"}
 
 @app.route('/api/update', methods=['POST'])
 def trigger_update():
-    """Manually trigger a database update"""
-    success = update_database()
-    return jsonify({"success": success, "timestamp": int(time.time())})
+    """Manually trigger a database update, joining one that is already queued"""
+    job = request_refresh()
+    return jsonify(refresh_job_status(job)), 202
+
+@app.route('/api/update/<job_id>')
+def get_update(job_id):
+    """Get the status of a database update"""
+    job = refresh_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"Unknown update job {job_id}"}), 404
+    return jsonify(refresh_job_status(job))
 
 @app.route('/api/status')
 def get_status():
     """Get the current status including last update time"""
-    last_update = redis_client.get('last_update')
+    version = data_store.get_current_version(redis_client)
+    last_update = data_store.get_last_update(redis_client, version)
     
     return jsonify({
+        "version": version,
+        "refreshing": refresh_jobs.running(),
         "last_update": int(last_update) if last_update else None,
         "last_update_formatted": datetime.fromtimestamp(int(last_update)).strftime('%Y-%m-%d %H:%M:%S') if last_update else "Never"
     })
 
+def iter_full_export_rows(version, servers, since=None, until=None):
+    """
+    Yield the history and received-file rows of the full CSV export
+    
+    History rows are paged out of the history sorted sets, and out of the
+    archive where the range reaches past the retention window; each server's
+    received files are loaded one server at a time, so memory stays bounded.
+    
+    Args:
+        version: Snapshot version to read received files from
+        servers: Server names to export
+        since: Optional minimum timestamp score (inclusive)
+        until: Optional maximum timestamp score (inclusive)
+    """
+    for server in servers:
+        history = data_store.iter_history(redis_binary, server, since, until, version=version,
+                                          archive=archive.open_history(ingest_worker.archive_dir, server))
+        for row in history:
+            yield {
+                'record_type': 'history',
+                'server': server,
+                'timestamp': row.get('timestamp'),
+                'action': row.get('action'),
+                'source': row.get('hostname'),
+                'target': row.get('target_servers'),
+                'file': row.get('file'),
+                'status': row.get('status')
+            }
+        
+        for received in data_store.get_received_files(redis_binary, server, version) or []:
+            timestamp = (received.get('date') or '')[:19]
+            score = data_store.timestamp_score(timestamp)
+            if (since is not None and score < since) or (until is not None and score > until):
+                continue
+            yield {
+                'record_type': 'received',
+                'server': server,
+                'timestamp': timestamp,
+                'action': 'received',
+                'source': received.get('source'),
+                'target': server,
+                'file': received.get('filename'),
+                'size': received.get('size')
+            }
+
+@app.route('/api/export/csv/full')
+def export_full_csv():
+    """Stream every history and received-file row as CSV, optionally filtered"""
+    try:
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
+    version = data_store.get_current_version(redis_client)
+    if version is None:
+        return jsonify({"error": "No data available for export"})
+    
+    servers = data_store.get_server_names(redis_client, version)
+    selected = request.args.getlist('server')
+    if selected:
+        servers = [server for server in servers if server in selected]
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    rows = iter_full_export_rows(version, servers, since, until)
+    return Response(
+        stream_with_context(DataExporter.stream_csv(rows, DataExporter.FULL_CSV_FIELDS)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=exchange_history_{timestamp}.csv'}
+    )
+
+def excel_job_status(job):
+    """Add the status and download URLs to an Excel export job"""
+    status = dict(job)
+    status['status_url'] = f"/api/export/excel/jobs/{job['job_id']}"
+    if job['status'] == 'done':
+        status['download_url'] = f"/api/export/excel/jobs/{job['job_id']}/download"
+    return status
+
+def send_excel_job(job):
+    """Send the workbook produced by a finished Excel export job"""
+    return send_file(
+        excel_jobs.artifact_path(job['generation']),
+        as_attachment=True,
+        download_name=f"exchange_data_v{job['version']}.xlsx"
+    )
+
+@app.route('/api/export/excel/jobs', methods=['POST'])
+def submit_excel_export():
+    """Start a background Excel export of the current snapshot"""
+    version = data_store.get_current_version(redis_client)
+    if version is None:
+        return jsonify({"error": "No data available for export"})
+    
+    job = excel_jobs.submit(version)
+    return jsonify(excel_job_status(job)), 202
+
+@app.route('/api/export/excel/jobs/<job_id>')
+def get_excel_export(job_id):
+    """Get the status of a background Excel export"""
+    job = excel_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"Unknown export job {job_id}"}), 404
+    return jsonify(excel_job_status(job))
+
+@app.route('/api/export/excel/jobs/<job_id>/download')
+def download_excel_export(job_id):
+    """Download the workbook of a finished Excel export"""
+    job = excel_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"Unknown export job {job_id}"}), 404
+    if job['status'] != 'done' or not os.path.exists(excel_jobs.artifact_path(job['generation'])):
+        return jsonify(excel_job_status(job)), 409
+    return send_excel_job(job)
+
 @app.route('/api/export/<format>')
 def export_data(format):
     """Export data in the specified format"""
-    # Get the data
-    data_json = redis_client.get('exchange_data')
-    if not data_json:
+    version = data_store.get_current_version(redis_client)
+    if version is None:
         return jsonify({"error": "No data available for export"})
     
-    data = json.loads(data_json)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
+    # Rows of the HTML report, checked up front so a bad value is a 400 rather than an export error
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_PAGE_SIZE) if format == 'html' else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+    
     try:
+        if format == 'excel':
+            # Export as Excel: serve the cached workbook or start a background job
+            job = excel_jobs.submit(version)
+            if job['status'] == 'done':
+                return send_excel_job(job)
+            return jsonify(excel_job_status(job)), 202
+        
+        elif format == 'html':
+            # Export as HTML report, rendered once per snapshot version and limit
+            view = f'report:html:{limit}'
+            html = data_store.get_cached_view(redis_client, version, view)
+            if html is None:
+                if limit <= RECENT_EXCHANGES:
+                    # The exchanges kept with the snapshot document are enough
+                    data_json = data_store.get_snapshot_json(redis_client, version)
+                    if not data_json:
+                        return jsonify({"error": "No data available for export"})
+                    volume = data_store.get_rollup_volume(redis_client, 'day')
+                    html = DataExporter.export_html_report(json.loads(data_json), limit=limit, bytes_sent={
+                        server: totals['bytes_sent'] for server, totals in volume['servers'].items()
+                    })
+                else:
+                    data = data_store.get_snapshot_data(redis_binary, version)
+                    html = DataExporter.export_html_report(data, limit=limit)
+                data_store.set_cached_view(redis_client, version, view, html)
+            return html, 200, {'Content-Type': 'text/html'}
+        
         if format == 'csv':
-            # Export as CSV
-            output = DataExporter.export_csv(data)
+            # Export as CSV: the server summaries only need the snapshot document
+            data_json = data_store.get_snapshot_json(redis_client, version)
+            if not data_json:
+                return jsonify({"error": "No data available for export"})
+            # Bytes sent add up the other servers' received files, kept in the rollups
+            volume = data_store.get_rollup_volume(redis_client, 'day')
+            output = DataExporter.export_csv(json.loads(data_json), bytes_sent={
+                server: totals['bytes_sent'] for server, totals in volume['servers'].items()
+            })
             return output, 200, {
                 'Content-Type': 'text/csv',
                 'Content-Disposition': f'attachment; filename=exchange_data_{timestamp}.csv'
             }
         
         elif format == 'json':
-            # Export as JSON
-            return jsonify(data)
-        
-        elif format == 'excel':
-            # Export as Excel
-            export_dir = '/app/exports'
-            os.makedirs(export_dir, exist_ok=True)
-            filename = f"{export_dir}/exchange_data_{timestamp}.xlsx"
-            
-            file_path = DataExporter.export_excel(data, filename)
-            return send_file(file_path, as_attachment=True)
-        
-        elif format == 'html':
-            # Export as HTML report
-            html = DataExporter.export_html_report(data)
-            return html, 200, {'Content-Type': 'text/html'}
+            # Export as JSON, with the per-server rows rebuilt from their columns
+            with metrics.EXPORT_SECONDS.labels('json').time():
+                data = data_store.get_snapshot_data(redis_binary, version)
+                if not data:
+                    return jsonify({"error": "No data available for export"})
+                return jsonify(data)
         
         else:
             return jsonify({"error": f"Unsupported export format: {format}"})
@@ -130,15 +615,29 @@ def export_data(format):
         app.logger.error(f"Export error: {str(e)}")
         return jsonify({"error": f"Export failed: {str(e)}"})
 
-if __name__ == '__main__':
-    # Initialize scheduler for periodic updates
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(update_database, 'interval', seconds=UPDATE_INTERVAL)
-    scheduler.start()
+# Ingest lease election of this process, started by create_app
+leader_election = None
+
+def create_app():
+    """
+    Prepare the application for serving and return the WSGI app
     
-    # Initial data load
-    if not redis_client.exists('exchange_data'):
-        update_database()
+    Every web process calls this once; the processes elect a single leader
+    through Redis that runs the scheduled and watcher-driven ingestion, so
+    adding workers scales reads without duplicating ingest.
     
-    # Run the Flask app
+    Returns:
+        Flask: The application
+    """
+    global leader_election
+    if INGEST_ENABLED and leader_election is None:
+        leader_election = ingest_worker.elect()
+    
+    seconds, resident = metrics.record_startup('web')
+    app.logger.info(f"Web process ready in {seconds:.2f} s using {resident / 2 ** 20:.1f} MiB")
+    return app
+
+if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn (see gunicorn.conf.py)
+    create_app()
     app.run(host='0.0.0.0', port=5000, debug=os.environ.get('DEBUG', 'False').lower() == 'true')
@@ -0,0 +1,406 @@
+import os
+import gzip
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import msgpack
+
+from columnar import decode_rows, encode_columns
+from data_parser import (HISTORY_FILE, ROLLUP_RESOLUTIONS, add_rollup_rows, new_rollup_delta,
+                         read_fingerprint, sent_file_entry)
+from data_store import history_index_values, timestamp_score
+
+logger = logging.getLogger(__name__)
+
+# Per-server file describing the archived rows and their segments
+MANIFEST_FILE = 'manifest.json'
+
+# Segment files: gzip compressed msgpack'd columns of one day's rows
+SEGMENT_SUFFIX = '.msgpack.gz'
+
+# Readers of the opened archives, keyed by manifest path, with the manifest
+# mtime and size they were built from
+_open_histories = {}
+_open_histories_lock = threading.Lock()
+
+def new_manifest():
+    """
+    Create the manifest of a server without archived rows
+
+    Returns:
+        dict: Byte offset and fingerprint of the archived prefix of
+              history.csv, archived totals, segments and the rollup counts of
+              the archived rows
+    """
+    return {
+        'offset': 0,
+        'fingerprint': '',
+        'rows': 0,
+        'sent': 0,
+        'last_exchange': None,
+        'segments': [],
+        'rollup': {**{resolution: {} for resolution in ROLLUP_RESOLUTIONS}, 'links': {}}
+    }
+
+def history_cutoff(retention_days, now=None):
+    """
+    Get the timestamp before which history rows are archived
+
+    The cutoff is the start of a day, so every archived day is complete.
+
+    Args:
+        retention_days: Number of days kept in full detail
+        now: Optional current time
+
+    Returns:
+        str: Timestamp in the history.csv format
+    """
+    day = (now or datetime.now()) - timedelta(days=retention_days)
+    return day.strftime('%Y-%m-%d 00:00:00')
+
+def load_manifest(archive_dir, server):
+    """
+    Load the archive manifest of a server
+
+    Args:
+        archive_dir: Directory holding the archive
+        server: Server name
+
+    Returns:
+        dict: Manifest (see new_manifest), empty if nothing was archived yet
+    """
+    try:
+        with open(os.path.join(archive_dir, server, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return new_manifest()
+
+def load_manifests(archive_dir):
+    """
+    Load the archive manifests of every server with archived rows
+
+    Args:
+        archive_dir: Directory holding the archive
+
+    Returns:
+        dict: Manifests keyed by server name
+    """
+    try:
+        servers = os.listdir(archive_dir)
+    except FileNotFoundError:
+        return {}
+    return {
+        server: load_manifest(archive_dir, server) for server in servers
+        if os.path.exists(os.path.join(archive_dir, server, MANIFEST_FILE))
+    }
+
+def _write_atomic(path, data, compress=False):
+    """Write a file under a temporary name and move it into place"""
+    temp_path = f'{path}.tmp'
+    with (gzip.open(temp_path, 'wb') if compress else open(temp_path, 'wb')) as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def compact_history(base_dir, archive_dir, exchange_data, checkpoints, changes, cutoff, archives):
+    """
+    Move the history rows older than cutoff from the parsed data to the archive
+
+    Only a leading run of old rows is archived, so the archived rows are
+    always a byte prefix of history.csv that later ingests can skip. The rows
+    are written as one immutable segment per day, then the manifest records
+    the new prefix together with the rollup counts of the archived rows.
+
+    Totals and aggregates are left untouched, they keep counting the archived
+    rows; the compacted servers are flagged as reset in changes so that their
+    history index is rebuilt over the remaining rows.
+
+    Args:
+        base_dir: Base directory containing exchange_results
+        archive_dir: Directory holding the archive
+        exchange_data: Parsed exchange data (modified in place)
+        checkpoints: File checkpoints matching exchange_data (modified in place)
+        changes: Per-server changes reported by ingest_exchange_data (modified in place)
+        cutoff: Rows with an earlier timestamp are archived (see history_cutoff)
+        archives: Archive manifests per server (modified in place)
+
+    Returns:
+        dict: Number of rows removed from the parsed data per server
+    """
+    # Segments archived before they carried value counts get them once
+    for server, manifest in archives.items():
+        if any('statuses' not in segment for segment in manifest['segments']):
+            try:
+                _summarize_segments(archive_dir, server, manifest)
+            except Exception as e:
+                logger.error(f"Error summarizing archive segments for {server}: {str(e)}")
+
+    compacted = {}
+    for server, server_data in exchange_data['servers'].items():
+        history = server_data['history']
+        checkpoint = checkpoints.get(server, {}).get(HISTORY_FILE)
+        if not history or not checkpoint or (history[0].get('timestamp') or '') >= cutoff:
+            continue
+
+        try:
+            manifest = archives.get(server) or new_manifest()
+            removed = _compact_server(base_dir, archive_dir, server, server_data, checkpoint,
+                                      manifest, cutoff)
+        except Exception as e:
+            logger.error(f"Error archiving history for {server}: {str(e)}")
+            continue
+
+        if removed:
+            archives[server] = manifest
+            compacted[server] = removed
+            changes[server]['history_reset'] = True
+
+    return compacted
+
+def _compact_server(base_dir, archive_dir, server, server_data, checkpoint, manifest, cutoff):
+    """
+    Archive the leading old rows of one server's history
+
+    Returns:
+        int: Number of rows removed from the server data
+    """
+    history = server_data['history']
+    count = 0
+    while count < len(history) and (history[count].get('timestamp') or '') < cutoff:
+        count += 1
+
+    path = os.path.join(base_dir, server, HISTORY_FILE)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = max(checkpoint.get('archived', 0), len(header))
+
+        # Rows up to the manifest offset were archived by an update that was
+        # not published; they are dropped without being archived twice
+        archived_end = start
+        if manifest['offset'] > start and read_fingerprint(path, manifest['offset']) == manifest['fingerprint']:
+            archived_end = manifest['offset']
+
+        # Find the byte offset past each row, blank lines belong to the row before
+        f.seek(start)
+        position = start
+        ends = []
+        while position < checkpoint['offset'] and (len(ends) < count or position < archived_end):
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                break
+            position += len(line)
+            if not line.strip():
+                if ends:
+                    ends[-1] = position
+                continue
+            row = history[len(ends)] if len(ends) < len(history) else None
+            if row is None or line.split(b',', 1)[0].decode('utf-8') != row.get('timestamp'):
+                raise ValueError("history.csv does not match the ingested rows")
+            ends.append(position)
+
+    already = sum(1 for end in ends if end <= archived_end)
+    count = len(ends)
+    if not count:
+        return 0
+
+    rows = history[already:count]
+    if rows:
+        _write_segments(archive_dir, server, manifest, rows)
+        manifest['rows'] += len(rows)
+        manifest['sent'] += sum(1 for row in rows if row.get('action') == 'sent')
+        last_exchange = max(row.get('timestamp') or '' for row in rows) or None
+        if last_exchange and (not manifest['last_exchange'] or last_exchange > manifest['last_exchange']):
+            manifest['last_exchange'] = last_exchange
+        _add_manifest_rollup(manifest, server, rows)
+    manifest['offset'] = ends[-1]
+    manifest['fingerprint'] = read_fingerprint(path, ends[-1])
+    _write_atomic(os.path.join(archive_dir, server, MANIFEST_FILE), json.dumps(manifest).encode('utf-8'))
+
+    # Drop the archived rows and the sent files derived from them
+    sent = sum(1 for row in history[:count] if row.get('action') == 'sent')
+    server_data['history'] = history[count:]
+    server_data['sent_files'] = server_data['sent_files'][sent:]
+    checkpoint['archived'] = ends[-1]
+    return count
+
+def _write_segments(archive_dir, server, manifest, rows):
+    """Write rows as one segment per day and list the segments in the manifest"""
+    days = {}
+    for row in rows:
+        days.setdefault((row.get('timestamp') or '')[:10], []).append(row)
+
+    os.makedirs(os.path.join(archive_dir, server), exist_ok=True)
+    for day, day_rows in sorted(days.items()):
+        timestamps = [row.get('timestamp') or '' for row in day_rows]
+        filename = f"{len(manifest['segments']):06d}-{day or 'undated'}{SEGMENT_SUFFIX}"
+        _write_atomic(os.path.join(archive_dir, server, filename),
+                      msgpack.packb(encode_columns(day_rows), use_bin_type=True), compress=True)
+        manifest['segments'].append({
+            'file': filename,
+            'day': day,
+            'rows': len(day_rows),
+            'first': min(timestamps),
+            'last': max(timestamps),
+            **_segment_values(day_rows)
+        })
+
+def _segment_values(rows):
+    """
+    Count the rows of a segment per indexed status and target value
+
+    Queries skip the segments without the value they filter on.
+
+    Returns:
+        dict: {'statuses': {status: rows}, 'targets': {target: rows}}
+    """
+    values = {'statuses': {}, 'targets': {}}
+    for row in rows:
+        for field, value in history_index_values(row):
+            counts = values['statuses' if field == 'status' else 'targets']
+            counts[value] = counts.get(value, 0) + 1
+    return values
+
+def _summarize_segments(archive_dir, server, manifest):
+    """Add the value counts to the segments of a manifest written without them"""
+    for segment in manifest['segments']:
+        if 'statuses' not in segment:
+            segment.update(_segment_values(read_segment(archive_dir, server, segment)))
+    _write_atomic(os.path.join(archive_dir, server, MANIFEST_FILE), json.dumps(manifest).encode('utf-8'))
+
+def _add_manifest_rollup(manifest, server, rows):
+    """Add the rollup counts of newly archived rows to a manifest"""
+    rollup = new_rollup_delta()
+    add_rollup_rows(rollup, server, [sent_file_entry(row) for row in rows if row.get('action') == 'sent'], [], 1)
+
+    counts = manifest['rollup']
+    for resolution in ROLLUP_RESOLUTIONS:
+        buckets = counts.setdefault(resolution, {})
+        for bucket, count in rollup['sent'][resolution][server].items():
+            buckets[bucket] = buckets.get(bucket, 0) + count
+    links = counts.setdefault('links', {})
+    for target, count in rollup['links'][server].items():
+        links[target] = links.get(target, 0) + count
+
+def read_segment(archive_dir, server, segment):
+    """
+    Read the rows of one archive segment
+
+    Args:
+        archive_dir: Directory holding the archive
+        server: Server name
+        segment: Segment entry of the server's manifest
+
+    Returns:
+        list: History rows in history.csv order
+    """
+    with gzip.open(os.path.join(archive_dir, server, segment['file']), 'rb') as f:
+        return decode_rows(msgpack.unpackb(f.read(), raw=False))
+
+def open_history(archive_dir, server):
+    """
+    Open the archived history of a server
+
+    Readers are cached until the manifest changes, so opening the archive of
+    every server on each request costs one stat per server.
+
+    Args:
+        archive_dir: Directory holding the archive
+        server: Server name
+
+    Returns:
+        ArchivedHistory: Reader, or None if the server has no archived rows
+    """
+    path = os.path.join(archive_dir, server, MANIFEST_FILE)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = _open_histories.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    manifest = load_manifest(archive_dir, server)
+    history = ArchivedHistory(archive_dir, server, manifest) if manifest['segments'] else None
+    with _open_histories_lock:
+        _open_histories[path] = (key, history)
+    return history
+
+class ArchivedHistory:
+    """
+    Time range reads over one server's archived history rows
+
+    Segments are only decompressed when they overlap the requested range, one
+    day at a time, so reads close to the retention window never touch the
+    older parts of the archive.
+    """
+
+    def __init__(self, archive_dir, server, manifest):
+        """
+        Args:
+            archive_dir: Directory holding the archive
+            server: Server name
+            manifest: Archive manifest of the server
+        """
+        self.archive_dir = archive_dir
+        self.server = server
+        self.days = {}
+        for segment in manifest['segments']:
+            self.days.setdefault(segment['day'], []).append({
+                **segment,
+                'first_score': timestamp_score(segment['first']),
+                'last_score': timestamp_score(segment['last'])
+            })
+
+        segments = [segment for day in self.days.values() for segment in day]
+        self.first = min(segment['first_score'] for segment in segments)
+        self.last = max(segment['last_score'] for segment in segments)
+
+    def may_match(self, segment, status=None, target=None):
+        """
+        Check whether a segment can hold rows with a status and a target
+
+        Segments archived without value counts always can.
+        """
+        if status is not None and 'statuses' in segment and status not in segment['statuses']:
+            return False
+        if target is not None and 'targets' in segment and target not in segment['targets']:
+            return False
+        return True
+
+    def iter_rows(self, start=None, end=None, reverse=False, status=None, target=None):
+        """
+        Iterate over the archived rows of a time range in timestamp order
+
+        Args:
+            start: Optional minimum timestamp score (inclusive)
+            end: Optional maximum timestamp score (inclusive)
+            reverse: Return the most recent rows first
+            status: Optional status; segments without such rows are skipped
+            target: Optional target server; segments without rows sent to it are skipped
+
+        Returns:
+            Generator yielding (score, row) pairs, including rows of the read
+            segments that do not match status or target
+        """
+        for day in sorted(self.days, reverse=reverse):
+            segments = [
+                segment for segment in self.days[day]
+                if (start is None or segment['last_score'] >= start)
+                and (end is None or segment['first_score'] <= end)
+                and self.may_match(segment, status, target)
+            ]
+            if not segments:
+                continue
+
+            rows = [
+                (timestamp_score(row.get('timestamp')), row)
+                for segment in segments
+                for row in read_segment(self.archive_dir, self.server, segment)
+            ]
+            rows.sort(key=lambda entry: entry[0], reverse=reverse)
+            for score, row in rows:
+                if (start is None or score >= start) and (end is None or score <= end):
+                    yield score, row
@@ -0,0 +1,127 @@
+"""
+Generate a synthetic exchange_results tree
+
+Mimics vm_random_exchange.sh from setup_vm_automation.sh: on every cron run
+each server sends its status report to one random peer or to all of them,
+appending one history.csv row per target, and every server rewrites its
+received_summary.txt listing all files received so far.
+
+Usage:
+    python -m benchmarks.fleet OUTPUT_DIR --servers 50 --rows 2000
+"""
+import os
+import random
+import argparse
+from datetime import datetime, timedelta
+
+HISTORY_HEADER = "timestamp,hostname,action,target_servers,file,status\n"
+
+def server_name(index):
+    """Name of the index-th synthetic server (1-based)"""
+    return f"ubuntu-server-{index}"
+
+def generate_fleet(base_dir, servers=3, rows=100, seed=0, start=datetime(2024, 5, 1), interval=600):
+    """
+    Write a synthetic exchange_results tree
+
+    Args:
+        base_dir: Directory to create the ubuntu-server-* directories in
+        servers: Number of servers
+        rows: Approximate number of history rows per server
+        seed: Random seed, so runs with the same arguments write the same tree
+        start: Time of the first cron run
+        interval: Seconds between cron runs
+
+    Returns:
+        dict: Number of history rows and received files written in total
+    """
+    rng = random.Random(seed)
+    names = [server_name(i) for i in range(1, servers + 1)]
+    history = {name: [HISTORY_HEADER] for name in names}
+    received = {name: [] for name in names}
+    counts = {name: 0 for name in names}
+
+    # Peers sent to per run: one random peer or all of them, as the cron script does
+    run = 0
+    while min(counts.values()) < rows and servers > 1:
+        moment = start + timedelta(seconds=run * interval)
+        for name in names:
+            if counts[name] >= rows:
+                continue
+            peers = [peer for peer in names if peer != name]
+            targets = [rng.choice(peers)] if len(peers) == 1 or rng.random() < 0.5 else peers
+
+            sent_at = moment + timedelta(seconds=rng.randrange(interval // 2))
+            stamp = sent_at.strftime("%Y%m%d_%H%M%S")
+            report = f"status_{name}_{stamp}.txt"
+            size = rng.randrange(900, 1400)
+            for target in targets[:rows - counts[name]]:
+                history[name].append(
+                    f"{sent_at:%Y-%m-%d %H:%M:%S},{name},sent,{target},{report},success\n")
+                arrived = sent_at + timedelta(seconds=1, microseconds=rng.randrange(10 ** 6))
+                received[target].append(
+                    (f"from_{name}_{stamp}.txt", size,
+                     f"{arrived:%Y-%m-%d %H:%M:%S}.{arrived.microsecond:06d}{rng.randrange(1000):03d} +0000"))
+                counts[name] += 1
+        run += 1
+
+    total_received = 0
+    for name in names:
+        server_dir = os.path.join(base_dir, name)
+        os.makedirs(server_dir, exist_ok=True)
+        with open(os.path.join(server_dir, "history.csv"), "w") as f:
+            f.writelines(history[name])
+
+        # ls lists the received directory in name order
+        files = sorted(received[name])
+        total_received += len(files)
+        generated = start + timedelta(seconds=run * interval)
+        with open(os.path.join(server_dir, "received_summary.txt"), "w") as f:
+            f.write(f"Received Files Summary for {name}\n")
+            f.write(f"Generated: {generated:%a %b %d %H:%M:%S UTC %Y}\n")
+            f.write("=======================================\n\n")
+            f.write("Files Received:\n")
+            if files:
+                for filename, size, date in files:
+                    f.write(f"- {filename} (Size: {size} bytes, Date: {date})\n")
+            else:
+                f.write("No files received yet.\n")
+            f.write(f"\nTotal Files: {len(files)}\n")
+
+    return {"history_rows": sum(counts.values()), "received_files": total_received}
+
+def append_runs(base_dir, rows, seed=1):
+    """
+    Append new history rows to every server, as later cron runs would
+
+    Args:
+        base_dir: Directory written by generate_fleet
+        rows: Number of rows to append per server
+        seed: Random seed
+
+    Returns:
+        int: Number of rows appended in total
+    """
+    rng = random.Random(seed)
+    names = sorted(name for name in os.listdir(base_dir) if name.startswith("ubuntu-server"))
+    start = datetime(2030, 1, 1)
+    for name in names:
+        peers = [peer for peer in names if peer != name] or [name]
+        with open(os.path.join(base_dir, name, "history.csv"), "a") as f:
+            for i in range(rows):
+                sent_at = start + timedelta(minutes=10 * i)
+                f.write(f"{sent_at:%Y-%m-%d %H:%M:%S},{name},sent,{rng.choice(peers)},"
+                        f"status_{name}_{sent_at:%Y%m%d_%H%M%S}.txt,success\n")
+    return rows * len(names)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic exchange_results tree")
+    parser.add_argument("output", help="Directory to write the server directories to")
+    parser.add_argument("--servers", type=int, default=3, help="Number of servers")
+    parser.add_argument("--rows", type=int, default=100, help="History rows per server")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    written = generate_fleet(args.output, args.servers, args.rows, args.seed)
+    print(f"Wrote {written['history_rows']} history rows and {written['received_files']} "
+          f"received files for {args.servers} servers to {args.output}")
@@ -0,0 +1,374 @@
+"""
+Benchmark the parser, aggregators, exporters and API on a synthetic fleet
+
+Generates a fleet with benchmarks.fleet, then times each stage and records
+its peak traced memory. The startup group times a fresh interpreter loading
+the web app, the ingest worker or the exporters, recording its resident
+memory.
+Results are written as JSON so that runs can be compared before and after a
+change.
+
+Usage:
+    python -m benchmarks.run --servers 50 --rows 2000 --output results.json
+    python -m benchmarks.run --servers 50 --rows 2000 --compare results.json
+
+Requires fakeredis (pip install -r benchmarks/requirements.txt); the API is
+benchmarked against an in-process fake Redis rather than a real server.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import fakeredis
+
+# Run from the repository root as python -m benchmarks.run
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIR)
+
+import data_parser
+from data_exporter import DataExporter
+from benchmarks.fleet import generate_fleet, append_runs
+
+# Benchmark groups, in run order
+GROUPS = ['parser', 'aggregators', 'exporters', 'api', 'startup']
+
+# Slowdown over the compared run reported as a regression
+REGRESSION_RATIO = 1.2
+
+def measure(func, repeat=3):
+    """
+    Time a function and measure its peak memory
+
+    The timed runs come first; one extra run under tracemalloc measures the
+    peak memory, as tracing slows the code down too much to time it.
+
+    Args:
+        func: Function taking no arguments
+        repeat: Number of timed runs
+
+    Returns:
+        dict: Median and fastest seconds, and peak traced bytes
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'repeat': repeat,
+        'peak_bytes': peak
+    }
+
+def measure_startup(statement, repeat=3):
+    """
+    Time a fresh Python process running a statement and measure its memory
+
+    The process reports its own resident memory from /proc once the statement
+    ran; the peak reported by the kernel would include the memory of this
+    process, which the child inherits until it starts Python.
+
+    Args:
+        statement: Python code run with -c from the repository root
+        repeat: Number of timed runs
+
+    Returns:
+        dict: Median and fastest seconds, and the largest resident bytes of the process
+    """
+    code = (f"{statement}\nimport os\nwith open('/proc/self/statm') as f:\n"
+            f"    print(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))")
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], cwd=REPOSITORY_DIR, capture_output=True,
+                                text=True, check=True).stdout
+        timings.append(time.perf_counter() - started)
+        peak = max(peak, int(output.split()[-1]))
+
+    return {
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'repeat': repeat,
+        'peak_bytes': peak
+    }
+
+def bench_startup():
+    """Benchmarks of the web app and ingest worker startup, as statements for measure_startup"""
+    return {
+        'startup[web]': 'import app',
+        'startup[ingest]': 'import ingest',
+        'startup[export]': 'import data_exporter; data_exporter.DataExporter.export_csv({"servers": {}})'
+    }
+
+def bench_parser(base_dir, workers):
+    """Benchmarks of the full parse and the parallel and incremental ingest"""
+    def incremental():
+        data, checkpoints, _, _ = data_parser.ingest_exchange_data(base_dir)
+        return lambda: data_parser.ingest_exchange_data(base_dir, data, checkpoints)
+
+    return {
+        'parse_exchange_data': lambda: data_parser.parse_exchange_data(base_dir),
+        f'ingest_exchange_data[workers={workers}]': lambda: data_parser.ingest_exchange_data(
+            base_dir, workers=workers),
+        'ingest_exchange_data[unchanged]': incremental()
+    }
+
+def bench_aggregators(data):
+    """Benchmarks of the time series, connection matrix and rollups"""
+    servers = data['servers']
+    benchmarks = {
+        f'generate_time_series[{resolution}]': (
+            lambda resolution=resolution: data_parser.generate_time_series(servers, resolution))
+        for resolution in data_parser.TIME_SERIES_RESOLUTIONS
+    }
+    benchmarks['generate_connection_matrix'] = lambda: data_parser.generate_connection_matrix(servers)
+    benchmarks['build_rollup'] = lambda: data_parser.build_rollup(servers)
+    return benchmarks
+
+def bench_exporters(data, output_dir):
+    """Benchmarks of every DataExporter method"""
+    rows = [
+        {'record_type': 'sent', 'server': server, **entry}
+        for server, server_info in data['servers'].items()
+        for entry in server_info['history']
+    ]
+    return {
+        'export_csv': lambda: DataExporter.export_csv(data),
+        'export_json': lambda: DataExporter.export_json(data),
+        'export_excel': lambda: DataExporter.export_excel(data, os.path.join(output_dir, 'bench.xlsx')),
+        'export_html_report': lambda: DataExporter.export_html_report(data),
+        'stream_csv': lambda: sum(len(chunk) for chunk in DataExporter.stream_csv(
+            rows, DataExporter.FULL_CSV_FIELDS))
+    }
+
+def setup_app(base_dir, output_dir):
+    """
+    Import the Flask app with its Redis clients replaced by fakeredis
+
+    Returns:
+        tuple: (app module, Flask test client)
+    """
+    import app as app_module
+
+    server = fakeredis.FakeServer()
+    app_module.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    app_module.redis_binary = fakeredis.FakeRedis(server=server)
+    app_module.ingest_worker.client = app_module.redis_client
+    app_module.ingest_worker.binary_client = app_module.redis_binary
+    app_module.ingest_worker.exchange_dir = base_dir
+    app_module.ingest_worker.archive_dir = os.path.join(output_dir, 'archive')
+    app_module.refresh_jobs.client = app_module.redis_client
+    app_module.excel_jobs.client = app_module.redis_client
+    app_module.excel_jobs.binary_client = app_module.redis_binary
+    app_module.excel_jobs.export_dir = output_dir
+    return app_module, app_module.app.test_client()
+
+def bench_api(base_dir, output_dir, append_rows):
+    """Benchmarks of the database update and the API endpoints"""
+    app_module, client = setup_app(base_dir, output_dir)
+    update_database = app_module.ingest_worker.update
+    if update_database() is None:
+        raise RuntimeError("The initial database update failed")
+
+    server = app_module.data_store.get_server_names(app_module.redis_client)[0]
+
+    def get(url, **headers):
+        def request():
+            response = client.get(url, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+            return response.get_data()
+        return request
+
+    def full_update():
+        # Discard the snapshot so that every run starts from an empty database
+        app_module.redis_client.flushall()
+        update_database()
+
+    def incremental_update():
+        append_runs(base_dir, append_rows, seed=time.perf_counter_ns())
+        update_database()
+
+    def data_since_previous():
+        # Delta of the last incremental update
+        version = app_module.data_store.get_current_version(app_module.redis_client)
+        generation = app_module.data_store.get_generation(app_module.redis_client, version - 1)
+        return get(f'/api/data?since_version={version - 1}&since_generation={generation}')()
+
+    return {
+        'update_database[full]': full_update,
+        f'update_database[+{append_rows} rows/server]': incremental_update,
+        'update_database[unchanged]': update_database,
+        'GET /api/data': get('/api/data'),
+        'GET /api/data[gzip]': get('/api/data', **{'Accept-Encoding': 'gzip'}),
+        'GET /api/data?since_version': data_since_previous,
+        'GET /api/server/<name>': get(f'/api/server/{server}'),
+        'GET /api/server/<name>/history': get(f'/api/server/{server}/history?limit=1000'),
+        'GET /api/summary': get('/api/summary'),
+        'GET /api/time-series[hour]': get('/api/time-series?resolution=hour'),
+        'GET /api/time-series[minute]': get('/api/time-series?resolution=minute'),
+        'GET /api/matrix': get('/api/matrix'),
+        'GET /api/volume[hour]': get('/api/volume?resolution=hour'),
+        'GET /api/status': get('/api/status'),
+        'GET /api/export/csv/full': get('/api/export/csv/full'),
+        'GET /api/export/json': get('/api/export/json'),
+        'GET /api/export/html': get('/api/export/html')
+    }
+
+def git_revision():
+    """Return the current git commit of the repository, if available"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(servers, rows, repeat=3, workers=None, groups=None, append_rows=10):
+    """
+    Generate a synthetic fleet and run the benchmark groups on it
+
+    Args:
+        servers: Number of servers in the fleet
+        rows: History rows per server
+        repeat: Number of timed runs per benchmark
+        workers: Parse workers for the parallel ingest benchmark
+        groups: Names of the groups to run (parser, aggregators, exporters, api, startup)
+        append_rows: Rows appended per server by the incremental update benchmark
+
+    Returns:
+        dict: Run metadata and the results of every benchmark
+    """
+    workers = workers or os.cpu_count() or 1
+    groups = groups or GROUPS
+    work_dir = tempfile.mkdtemp(prefix='sftp-bench-')
+    base_dir = os.path.join(work_dir, 'exchange_results')
+    output_dir = os.path.join(work_dir, 'exports')
+
+    try:
+        written = generate_fleet(base_dir, servers, rows)
+        data = data_parser.parse_exchange_data(base_dir)
+
+        results = {}
+        for group in groups:
+            if group == 'parser':
+                benchmarks = bench_parser(base_dir, workers)
+            elif group == 'aggregators':
+                benchmarks = bench_aggregators(data)
+            elif group == 'exporters':
+                benchmarks = bench_exporters(data, output_dir)
+            elif group == 'api':
+                benchmarks = bench_api(base_dir, output_dir, append_rows)
+            elif group == 'startup':
+                benchmarks = bench_startup()
+            else:
+                raise ValueError(f"Unknown benchmark group: {group}")
+
+            for name, func in benchmarks.items():
+                if group == 'startup':
+                    result = measure_startup(func, repeat)
+                else:
+                    result = measure(func, repeat)
+                results[name] = result
+                print(f"{name:<45} {result['seconds'] * 1000:>10.1f} ms "
+                      f"{result['peak_bytes'] / 2 ** 20:>9.1f} MiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'servers': servers,
+            'rows': rows,
+            'history_rows': written['history_rows'],
+            'received_files': written['received_files'],
+            'repeat': repeat,
+            'workers': workers
+        },
+        'results': results
+    }
+
+def compare_results(current, baseline):
+    """
+    Print the change of every benchmark against a previous run
+
+    Args:
+        current: Result of run_benchmarks
+        baseline: Result of an earlier run_benchmarks, loaded from its JSON file
+
+    Returns:
+        list: Names of the benchmarks that got slower by more than REGRESSION_RATIO
+    """
+    regressions = []
+    if (baseline['meta']['servers'], baseline['meta']['rows']) != (current['meta']['servers'], current['meta']['rows']):
+        print("Warning: the runs used different fleet sizes")
+
+    print(f"\nCompared with {baseline['meta'].get('revision')} ({baseline['meta']['created']}):")
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            print(f"{name:<45} {'new':>10}")
+            continue
+
+        ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+        memory = result['peak_bytes'] / previous['peak_bytes'] if previous['peak_bytes'] else float('inf')
+        flag = ''
+        if ratio > REGRESSION_RATIO:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<45} {ratio:>9.2f}x time {memory:>6.2f}x memory{flag}")
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exchange monitor on a synthetic fleet")
+    parser.add_argument("--servers", type=int, default=20, help="Number of servers")
+    parser.add_argument("--rows", type=int, default=1000, help="History rows per server")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--workers", type=int, help="Parse workers (default: CPU count)")
+    parser.add_argument("--group", action="append", dest="groups",
+                        choices=GROUPS,
+                        help="Benchmark group to run (repeatable, default: all)")
+    parser.add_argument("--output", help="File to save the results to as JSON")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.servers, args.rows, args.repeat, args.workers, args.groups)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare_results(current, baseline):
+            sys.exit(1)
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Columns with at most this share of distinct values are dictionary encoded
+DICTIONARY_MAX_RATIO = 0.5
+
+def encode_columns(rows):
+    """
+    Encode a list of row dictionaries as column arrays
+
+    Each column is stored once instead of repeating the field names per row.
+    Low-cardinality columns (hostnames, actions, statuses) are dictionary
+    encoded: the distinct values plus a packed array of small integer codes.
+
+    Fields are the union of the fields of all rows; rows without a field
+    decode with None for it.
+
+    Args:
+        rows: List of dictionaries with string field names
+
+    Returns:
+        dict: {'length': n, 'fields': [...], 'columns': {field: column}}, ready
+              to be serialized with msgpack
+    """
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    columns = {}
+
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        distinct = dict.fromkeys(values)
+
+        if len(distinct) > len(values) * DICTIONARY_MAX_RATIO:
+            columns[field] = {'values': values}
+            continue
+
+        dictionary = list(distinct)
+        index = {value: code for code, value in enumerate(dictionary)}
+        dtype = np.uint8 if len(dictionary) <= 0xFF else np.uint16 if len(dictionary) <= 0xFFFF else np.uint32
+        codes = np.fromiter((index[value] for value in values), dtype=dtype, count=len(values))
+        columns[field] = {
+            'dictionary': dictionary,
+            'dtype': codes.dtype.str,
+            'codes': codes.tobytes()
+        }
+
+    return {'length': len(rows), 'fields': fields, 'columns': columns}
+
+def decode_column(column, indexes=None):
+    """
+    Decode one column of encode_columns
+
+    Args:
+        column: Encoded column
+        indexes: Optional positions to decode instead of the whole column
+
+    Returns:
+        list: Column values
+    """
+    if 'values' in column:
+        values = column['values']
+        return values if indexes is None else [values[i] for i in indexes]
+
+    codes = np.frombuffer(column['codes'], dtype=np.dtype(column['dtype']))
+    if indexes is not None:
+        codes = codes[np.asarray(indexes, dtype=np.intp)]
+    return np.asarray(column['dictionary'], dtype=object)[codes].tolist()
+
+def decode_rows(encoded, indexes=None):
+    """
+    Rebuild row dictionaries from encode_columns
+
+    Args:
+        encoded: Result of encode_columns
+        indexes: Optional row positions to decode (in the order given)
+
+    Returns:
+        list: Row dictionaries
+
+    Raises:
+        IndexError: If a position is outside the encoded rows
+    """
+    if indexes is not None:
+        invalid = [i for i in indexes if not 0 <= i < encoded['length']]
+        if invalid:
+            raise IndexError(f"Row positions {invalid[:5]} out of range for {encoded['length']} rows")
+    if not encoded['fields']:
+        return [{} for _ in range(encoded['length'] if indexes is None else len(indexes))]
+
+    fields = encoded['fields']
+    columns = [decode_column(encoded['columns'][field], indexes) for field in fields]
+    return [dict(zip(fields, values)) for values in zip(*columns)]
@@ -0,0 +1,283 @@
+import os
+import glob
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+from data_parser import FINGERPRINT_BYTES, HISTORY_FILE, RECEIVED_SUMMARY_FILE
+
+logger = logging.getLogger(__name__)
+
+# Directory of the logs on the VMs, relative to the SSH user's home (~/exchange/logs)
+REMOTE_LOG_DIR = 'exchange/logs'
+
+# Bytes requested per SFTP read
+READ_CHUNK_SIZE = 256 * 1024
+
+class LogCollector:
+    """
+    Pull the exchange logs of every VM into the exchange_results tree over SFTP
+
+    All VMs are fetched concurrently from one asyncio event loop, at most
+    `max_connections` at a time. SSH sessions are kept open between
+    collections and reused, the least recently used one being closed when
+    the pool is full.
+
+    history.csv is append-only, so only the bytes past the local copy's size
+    are fetched and appended, after checking that the bytes before it still
+    match; a rotated or truncated remote file is downloaded again as a whole.
+    received_summary.txt is rewritten by every cron run and is downloaded
+    whenever its size or modification time differs from the local copy.
+    Whole-file downloads replace the local copy atomically.
+    """
+
+    def __init__(self, base_dir, hosts, username='vagrant', key_dir=None, port=22,
+                 max_connections=10, connect_timeout=15.0, remote_dir=REMOTE_LOG_DIR):
+        """
+        Args:
+            base_dir: Directory containing the ubuntu-server-* directories
+            hosts: Server names mapped to their addresses
+            username: SSH user on the VMs
+            key_dir: Directory with the '<server>_id_ed25519' private keys, as
+                     used by setup_vm_automation.sh (None for the SSH defaults)
+            port: SSH port of the VMs
+            max_connections: Maximum number of SSH sessions, open or in use
+            connect_timeout: Seconds to wait for a VM to accept the connection
+            remote_dir: Log directory on the VMs, relative to the home directory
+        """
+        self.base_dir = base_dir
+        self.hosts = dict(hosts)
+        self.username = username
+        self.key_dir = key_dir
+        self.port = port
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.remote_dir = remote_dir
+        self.sessions = OrderedDict()
+        self.busy = set()
+        self.connecting = 0
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """Return whether SFTP support (asyncssh) is installed"""
+        return asyncssh is not None
+
+    def collect(self, servers=None):
+        """
+        Fetch the logs of the VMs, blocking until every transfer finished
+
+        Safe to call from any thread; the transfers run on the collector's
+        own event loop so that the sessions outlive a single collection.
+
+        Args:
+            servers: Optional names of the servers to fetch (default: all hosts)
+
+        Returns:
+            dict: Names of the servers whose local files changed, mapped to
+                  the number of bytes fetched
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='log-collector', daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.collect_async(servers), self.loop).result()
+
+    def close(self):
+        """Close the SSH sessions and stop the event loop"""
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._close_sessions(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+
+    async def collect_async(self, servers=None):
+        """
+        Fetch the logs of the VMs concurrently (see collect)
+
+        A VM that cannot be reached is logged and skipped, the others are
+        still collected.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+
+        servers = sorted(self.hosts if servers is None else set(servers) & set(self.hosts))
+        results = await asyncio.gather(*(self._collect_server(server) for server in servers),
+                                       return_exceptions=True)
+
+        changed = {}
+        for server, result in zip(servers, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error collecting logs from {server}: {str(result)}")
+                await self._drop_session(server)
+            elif result:
+                changed[server] = result
+        return changed
+
+    async def _collect_server(self, server):
+        """Fetch one VM's log files; returns the number of bytes fetched"""
+        async with self.semaphore:
+            self.busy.add(server)
+            try:
+                sftp = await self._session(server)
+                local_dir = os.path.join(self.base_dir, server)
+                os.makedirs(local_dir, exist_ok=True)
+
+                fetched = await self._fetch_appended(sftp, f'{self.remote_dir}/{HISTORY_FILE}',
+                                                     os.path.join(local_dir, HISTORY_FILE))
+                fetched += await self._fetch_changed(sftp, f'{self.remote_dir}/{RECEIVED_SUMMARY_FILE}',
+                                                     os.path.join(local_dir, RECEIVED_SUMMARY_FILE))
+                return fetched
+            finally:
+                self.busy.discard(server)
+
+    async def _fetch_appended(self, sftp, remote_path, local_path):
+        """Bring a local copy of an append-only file up to date with the remote one"""
+        try:
+            remote_size = (await sftp.stat(remote_path)).size
+        except asyncssh.SFTPNoSuchFile:
+            return 0
+        local_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        if remote_size == local_size:
+            return 0
+
+        async with sftp.open(remote_path, 'rb') as remote:
+            if 0 < local_size < remote_size:
+                # Only append when the remote file still starts with the local copy
+                start = max(0, local_size - FINGERPRINT_BYTES)
+                with open(local_path, 'rb') as f:
+                    f.seek(start)
+                    local_tail = f.read()
+                await remote.seek(start)
+                if await remote.read(local_size - start) == local_tail:
+                    with open(local_path, 'ab') as f:
+                        return await self._copy(remote, f, remote_size - local_size)
+
+            # New, rotated or truncated file
+            await remote.seek(0)
+            return await self._download(remote, local_path, remote_size)
+
+    async def _fetch_changed(self, sftp, remote_path, local_path):
+        """Download a file that is rewritten in place when its size or mtime changed"""
+        try:
+            attrs = await sftp.stat(remote_path)
+        except asyncssh.SFTPNoSuchFile:
+            return 0
+        if os.path.exists(local_path):
+            stat = os.stat(local_path)
+            if stat.st_size == attrs.size and int(stat.st_mtime) == attrs.mtime:
+                return 0
+
+        async with sftp.open(remote_path, 'rb') as remote:
+            fetched = await self._download(remote, local_path, attrs.size)
+        # Keep the remote mtime, which is what the next collection compares with
+        os.utime(local_path, (attrs.atime or attrs.mtime, attrs.mtime))
+        return fetched
+
+    async def _download(self, remote, local_path, size):
+        """Replace a local file with the content of an open remote file"""
+        directory, name = os.path.split(local_path)
+        temp_path = os.path.join(directory, f'.{name}.part')
+        with open(temp_path, 'wb') as f:
+            fetched = await self._copy(remote, f, size)
+        os.replace(temp_path, local_path)
+        return fetched
+
+    @staticmethod
+    async def _copy(remote, local_file, size):
+        """Copy up to size bytes from the current position of a remote file"""
+        copied = 0
+        while copied < size:
+            chunk = await remote.read(min(READ_CHUNK_SIZE, size - copied))
+            if not chunk:
+                break
+            local_file.write(chunk)
+            copied += len(chunk)
+        return copied
+
+    async def _session(self, server):
+        """Get an SFTP session to a VM, reusing the open one if there is any"""
+        session = self.sessions.get(server)
+        if session:
+            self.sessions.move_to_end(server)
+            return session[1]
+
+        # Make room for the new session by closing the least recently used idle
+        # one; the semaphore guarantees there is one
+        while len(self.sessions) + self.connecting >= self.max_connections:
+            idle = next(name for name in self.sessions if name not in self.busy)
+            await self._drop_session(idle)
+
+        # Like the setup script, hosts are not checked against known_hosts
+        options = {'username': self.username, 'port': self.port, 'known_hosts': None}
+        key_file = self._key_file(server)
+        if key_file:
+            options['client_keys'] = [key_file]
+
+        self.connecting += 1
+        try:
+            connection = await asyncio.wait_for(asyncssh.connect(self.hosts[server], **options),
+                                                self.connect_timeout)
+            try:
+                sftp = await connection.start_sftp_client()
+            except Exception:
+                connection.close()
+                raise
+        finally:
+            self.connecting -= 1
+        self.sessions[server] = (connection, sftp)
+        return sftp
+
+    def _key_file(self, server):
+        """Find the private key of a server, falling back to the first available key"""
+        if not self.key_dir:
+            return None
+        key_file = os.path.join(self.key_dir, f'{server}_id_ed25519')
+        if os.path.exists(key_file):
+            return key_file
+        keys = sorted(path for path in glob.glob(os.path.join(self.key_dir, '*id_ed25519'))
+                      if not path.endswith('.pub'))
+        return keys[0] if keys else None
+
+    async def _drop_session(self, server):
+        """Close the session to a VM, if open"""
+        session = self.sessions.pop(server, None)
+        if session:
+            connection, sftp = session
+            sftp.exit()
+            connection.close()
+            await connection.wait_closed()
+
+    async def _close_sessions(self):
+        """Close every open session"""
+        for server in list(self.sessions):
+            await self._drop_session(server)
+
+if __name__ == "__main__":
+    import argparse
+    from data_parser import DEFAULT_SERVER_IPS
+
+    parser = argparse.ArgumentParser(description="Collect the exchange logs of the VMs over SFTP")
+    parser.add_argument("output", help="exchange_results directory to update")
+    parser.add_argument("--key-dir", default="./ssh_keys_for_host", help="Directory of the SSH keys")
+    parser.add_argument("--user", default="vagrant", help="SSH user on the VMs")
+    parser.add_argument("--connections", type=int, default=10, help="Concurrent SSH sessions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    collector = LogCollector(args.output, DEFAULT_SERVER_IPS, args.user, args.key_dir,
+                             max_connections=args.connections)
+    try:
+        for server, fetched in sorted(collector.collect().items()):
+            print(f"{server}: fetched {fetched} bytes")
+    finally:
+        collector.close()
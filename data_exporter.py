@@ -1,39 +1,48 @@
+import io
 import os
+import heapq
+import time
 import csv
 import json
-import pandas as pd
+from collections import Counter
 from datetime import datetime
 from flask import send_file, Response
+from jinja2 import Environment
+
+from data_parser import RECENT_EXCHANGES
+from metrics import EXPORT_SECONDS
 
 class DataExporter:
     """
     Utility class for exporting exchange data to various formats
     """
     
+    # Columns of the full-detail CSV export
+    FULL_CSV_FIELDS = ['record_type', 'server', 'timestamp', 'action', 'source', 'target', 'file', 'size', 'status']
+    
+    # Rows rendered per chunk when streaming CSV
+    STREAM_BATCH_SIZE = 500
+    
     @staticmethod
-    def export_csv(data, filename=None):
+    @EXPORT_SECONDS.labels('csv').time()
+    def export_csv(data, filename=None, bytes_sent=None):
         """
         Export exchange data to CSV format
         
         Args:
             data: Dictionary of exchange data
             filename: Optional filename to save to
+            bytes_sent: Optional bytes sent per server, required when data
+                        holds the summaries without the received files
             
         Returns:
             File path if saved, or Response object if sent directly
         """
-        # Create a pandas DataFrame for server summary
-        server_data = []
-        for server_name, server_info in data['servers'].items():
-            server_data.append({
-                'hostname': server_name,
-                'ip_address': server_info['ip'],
-                'files_sent': server_info['summary']['total_sent'],
-                'files_received': server_info['summary']['total_received'],
-                'last_exchange': server_info['summary']['last_exchange']
-            })
+        # pandas is only loaded by the processes that export
+        import pandas as pd
         
-        df = pd.DataFrame(server_data)
+        # Create a pandas DataFrame for server summary
+        df = pd.DataFrame(list(DataExporter._server_summary_rows(data, bytes_sent)))
         
         if filename:
             # Make sure the directory exists
@@ -45,6 +54,95 @@ class DataExporter:
             return df.to_csv(index=False)
     
     @staticmethod
+    def _server_summary_rows(data, bytes_sent=None):
+        """
+        Build the server summary rows of the CSV and Excel exports
+        
+        Bytes sent are the sizes of the files each server's peers list as
+        received from it, so unless given they are summed across every server
+        first.
+        
+        Args:
+            data: Dictionary of exchange data
+            bytes_sent: Optional bytes sent per server
+            
+        Returns:
+            Generator yielding one dictionary per server
+        """
+        if bytes_sent is None:
+            bytes_sent = DataExporter.bytes_sent(data['servers'])
+        for server_name, server_info in data['servers'].items():
+            yield {
+                'hostname': server_name,
+                'ip_address': server_info['ip'],
+                'files_sent': server_info['summary']['total_sent'],
+                'files_received': server_info['summary']['total_received'],
+                'bytes_sent': bytes_sent.get(server_name, 0),
+                'bytes_received': server_info['summary']['bytes_received'],
+                'last_exchange': server_info['summary']['last_exchange']
+            }
+    
+    @staticmethod
+    def bytes_sent(servers_data):
+        """
+        Sum the sizes of the received files per source server
+        
+        Args:
+            servers_data: Dictionary of server data
+            
+        Returns:
+            Counter: Bytes per source server
+        """
+        totals = Counter()
+        for server_info in servers_data.values():
+            for file in server_info['received_files']:
+                totals[file['source']] += file.get('size') or 0
+        return totals
+    
+    @staticmethod
+    def stream_csv(rows, fieldnames):
+        """
+        Render rows as CSV text chunks without building the whole document
+        
+        Args:
+            rows: Iterable of dictionaries
+            fieldnames: Column names, in output order
+            
+        Returns:
+            Generator yielding CSV text chunks, starting with the header
+        """
+        started = time.perf_counter()
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+        
+        # Send the header straight away so the download starts immediately
+        writer.writeheader()
+        yield DataExporter._drain(buffer)
+        
+        pending = 0
+        for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= DataExporter.STREAM_BATCH_SIZE:
+                yield DataExporter._drain(buffer)
+                pending = 0
+        
+        if pending:
+            yield DataExporter._drain(buffer)
+        
+        # Only completed downloads are timed
+        EXPORT_SECONDS.labels('csv_stream').observe(time.perf_counter() - started)
+    
+    @staticmethod
+    def _drain(buffer):
+        """Return the text written to a StringIO buffer and empty it"""
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+    
+    @staticmethod
+    @EXPORT_SECONDS.labels('json').time()
     def export_json(data, filename=None):
         """
         Export exchange data to JSON format
@@ -66,10 +164,15 @@ class DataExporter:
             return json.dumps(data, indent=2)
     
     @staticmethod
+    @EXPORT_SECONDS.labels('excel').time()
     def export_excel(data, filename=None):
         """
         Export exchange data to Excel format
         
+        The workbook is written with xlsxwriter's constant_memory mode, which
+        flushes every row to disk as soon as the next one starts, so memory use
+        does not grow with the number of rows.
+        
         Args:
             data: Dictionary of exchange data
             filename: Filename to save to (required for Excel)
@@ -77,158 +180,170 @@ class DataExporter:
         Returns:
             File path of saved Excel file
         """
+        import xlsxwriter
+        
         if not filename:
             filename = f"exchange_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         
         # Make sure the directory exists
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
         
-        # Create Excel writer
-        writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-        
-        # Create a DataFrame for server summary
-        server_data = []
-        for server_name, server_info in data['servers'].items():
-            server_data.append({
-                'hostname': server_name,
-                'ip_address': server_info['ip'],
-                'files_sent': server_info['summary']['total_sent'],
-                'files_received': server_info['summary']['total_received'],
-                'last_exchange': server_info['summary']['last_exchange']
-            })
-        
-        server_df = pd.DataFrame(server_data)
-        server_df.to_excel(writer, sheet_name='Server Summary', index=False)
-        
-        # Create sheets for each server's sent and received files
-        for server_name, server_info in data['servers'].items():
-            # Sent files
-            sent_data = pd.DataFrame(server_info['sent_files'])
-            if not sent_data.empty:
-                sent_data.to_excel(writer, sheet_name=f'{server_name}_sent', index=False)
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        try:
+            # Server summary sheet
+            DataExporter._write_sheet(workbook, 'Server Summary', DataExporter._server_summary_rows(data))
             
-            # Received files
-            received_data = pd.DataFrame(server_info['received_files'])
-            if not received_data.empty:
-                received_data.to_excel(writer, sheet_name=f'{server_name}_received', index=False)
-        
-        # Create a history sheet with all exchanges
-        all_history = []
-        for server_name, server_info in data['servers'].items():
-            for entry in server_info.get('history', []):
-                all_history.append({
-                    'server': server_name,
-                    **entry
-                })
+            # Create sheets for each server's sent and received files
+            for server_name, server_info in data['servers'].items():
+                DataExporter._write_sheet(workbook, f'{server_name}_sent', server_info['sent_files'])
+                DataExporter._write_sheet(workbook, f'{server_name}_received', server_info['received_files'])
+            
+            # Create a history sheet with all exchanges
+            all_history = (
+                {'server': server_name, **entry}
+                for server_name, server_info in data['servers'].items()
+                for entry in server_info.get('history', [])
+            )
+            DataExporter._write_sheet(workbook, 'Exchange History', all_history)
+        finally:
+            workbook.close()
         
-        history_df = pd.DataFrame(all_history)
-        if not history_df.empty:
-            history_df.to_excel(writer, sheet_name='Exchange History', index=False)
+        return filename
+    
+    @staticmethod
+    def _write_sheet(workbook, name, rows):
+        """
+        Write rows to a new worksheet in row order, skipping empty sheets
         
-        # Save the Excel file
-        writer.save()
+        Args:
+            workbook: xlsxwriter Workbook
+            name: Sheet name (truncated to Excel's 31 character limit)
+            rows: Iterable of dictionaries; the first row defines the columns
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return
         
-        return filename
+        worksheet = workbook.add_worksheet(name[:31])
+        columns = list(first)
+        worksheet.write_row(0, 0, columns)
+        worksheet.write_row(1, 0, [first.get(column) for column in columns])
+        for row_number, row in enumerate(rows, start=2):
+            worksheet.write_row(row_number, 0, [row.get(column) for column in columns])
     
     @staticmethod
-    def export_html_report(data, filename=None):
+    @EXPORT_SECONDS.labels('html').time()
+    def export_html_report(data, filename=None, limit=20, bytes_sent=None):
         """
         Export exchange data to a standalone HTML report
         
+        The most recent exchanges come from the ones kept with the snapshot
+        when there are enough of them, so the per-server history is only
+        needed for longer lists.
+        
         Args:
             data: Dictionary of exchange data
             filename: Optional filename to save to
+            limit: Number of most recent exchanges to list
+            bytes_sent: Optional bytes sent per server
             
         Returns:
             File path if saved, or HTML string if no filename
         """
-        # Create HTML table for server summary
-        server_table = '<table border="1" class="dataframe">\n'
-        server_table += '<thead><tr><th>Hostname</th><th>IP Address</th><th>Files Sent</th><th>Files Received</th><th>Last Exchange</th></tr></thead>\n'
-        server_table += '<tbody>\n'
-        
-        for server_name, server_info in data['servers'].items():
-            server_table += f'<tr><td>{server_name}</td><td>{server_info["ip"]}</td><td>{server_info["summary"]["total_sent"]}</td><td>{server_info["summary"]["total_received"]}</td><td>{server_info["summary"]["last_exchange"] or "N/A"}</td></tr>\n'
-        
-        server_table += '</tbody></table>\n'
-        
-        # Create HTML table for recent exchanges
-        all_history = []
-        for server_name, server_info in data['servers'].items():
-            for entry in server_info.get('history', []):
-                all_history.append({
-                    'server': server_name,
-                    **entry
-                })
-        
-        # Sort by timestamp, most recent first
-        all_history.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
-        history_table = '<table border="1" class="dataframe">\n'
-        history_table += '<thead><tr><th>Timestamp</th><th>Source</th><th>Action</th><th>Target</th><th>File</th><th>Status</th></tr></thead>\n'
-        history_table += '<tbody>\n'
-        
-        for entry in all_history[:20]:  # Show only the 20 most recent
-            history_table += f'<tr><td>{entry.get("timestamp", "")}</td><td>{entry.get("server", "")}</td><td>{entry.get("action", "")}</td><td>{entry.get("target_servers", "")}</td><td>{entry.get("file", "")}</td><td>{entry.get("status", "")}</td></tr>\n'
+        if limit <= RECENT_EXCHANGES and 'recent_exchanges' in data:
+            recent = [(entry['source'], entry) for entry in data['recent_exchanges'][:limit]]
+        else:
+            # Select the most recent exchanges without sorting the whole history
+            all_history = (
+                (server_name, entry)
+                for server_name, server_info in data['servers'].items()
+                for entry in server_info.get('history', [])
+            )
+            recent = heapq.nlargest(limit, all_history, key=lambda item: item[1].get('timestamp') or '')
+        if bytes_sent is None:
+            bytes_sent = DataExporter.bytes_sent(data['servers'])
         
-        history_table += '</tbody></table>\n'
+        html = REPORT_TEMPLATE.render(
+            generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            summary=data['summary'],
+            servers=data['servers'],
+            bytes_sent=bytes_sent,
+            recent=recent
+        )
         
-        # Build the complete HTML report
-        html = f'''
+        if filename:
+            # Make sure the directory exists
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(html)
+            return filename
+        else:
+            return html
+
+# HTML report template, compiled once at import
+REPORT_TEMPLATE = Environment(autoescape=True).from_string('''
         <!DOCTYPE html>
         <html>
         <head>
             <title>VM File Exchange Report</title>
             <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                h1, h2 {{ color: #2c5282; }}
-                table {{ border-collapse: collapse; width: 100%; margin-bottom: 20px; }}
-                th {{ background-color: #edf2f7; padding: 8px; text-align: left; }}
-                td {{ padding: 8px; }}
-                tr:nth-child(even) {{ background-color: #f7fafc; }}
-                .summary {{ display: flex; margin-bottom: 20px; }}
-                .summary-card {{ background-color: #f7fafc; border-radius: 5px; padding: 15px; margin-right: 15px; width: 200px; }}
-                .summary-card h3 {{ margin-top: 0; color: #4a5568; }}
-                .summary-card p {{ font-size: 24px; font-weight: bold; color: #2b6cb0; }}
-                .timestamp {{ color: #718096; font-style: italic; margin-bottom: 20px; }}
+                body { font-family: Arial, sans-serif; margin: 20px; }
+                h1, h2 { color: #2c5282; }
+                table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
+                th { background-color: #edf2f7; padding: 8px; text-align: left; }
+                td { padding: 8px; }
+                tr:nth-child(even) { background-color: #f7fafc; }
+                .summary { display: flex; margin-bottom: 20px; }
+                .summary-card { background-color: #f7fafc; border-radius: 5px; padding: 15px; margin-right: 15px; width: 200px; }
+                .summary-card h3 { margin-top: 0; color: #4a5568; }
+                .summary-card p { font-size: 24px; font-weight: bold; color: #2b6cb0; }
+                .timestamp { color: #718096; font-style: italic; margin-bottom: 20px; }
             </style>
         </head>
         <body>
             <h1>VM File Exchange Report</h1>
-            <p class="timestamp">Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+            <p class="timestamp">Generated: {{ generated }}</p>
             
             <div class="summary">
                 <div class="summary-card">
                     <h3>Total Files Sent</h3>
-                    <p>{data['summary']['total_files_sent']}</p>
+                    <p>{{ summary.total_files_sent }}</p>
                 </div>
                 <div class="summary-card">
                     <h3>Total Files Received</h3>
-                    <p>{data['summary']['total_files_received']}</p>
+                    <p>{{ summary.total_files_received }}</p>
+                </div>
+                <div class="summary-card">
+                    <h3>Total Bytes Received</h3>
+                    <p>{{ summary.total_bytes_received }}</p>
                 </div>
                 <div class="summary-card">
                     <h3>Server Count</h3>
-                    <p>{len(data['servers'])}</p>
+                    <p>{{ servers|length }}</p>
                 </div>
             </div>
             
             <h2>Server Summary</h2>
-            {server_table}
+            <table border="1" class="dataframe">
+            <thead><tr><th>Hostname</th><th>IP Address</th><th>Files Sent</th><th>Files Received</th><th>Bytes Sent</th><th>Bytes Received</th><th>Last Exchange</th></tr></thead>
+            <tbody>
+            {% for server_name, server_info in servers.items() %}
+            <tr><td>{{ server_name }}</td><td>{{ server_info.ip }}</td><td>{{ server_info.summary.total_sent }}</td><td>{{ server_info.summary.total_received }}</td><td>{{ bytes_sent[server_name] }}</td><td>{{ server_info.summary.bytes_received }}</td><td>{{ server_info.summary.last_exchange or "N/A" }}</td></tr>
+            {% endfor %}
+            </tbody></table>
             
             <h2>Recent Exchanges</h2>
-            {history_table}
+            <table border="1" class="dataframe">
+            <thead><tr><th>Timestamp</th><th>Source</th><th>Action</th><th>Target</th><th>File</th><th>Status</th></tr></thead>
+            <tbody>
+            {% for server_name, entry in recent %}
+            <tr><td>{{ entry.timestamp }}</td><td>{{ server_name }}</td><td>{{ entry.action }}</td><td>{{ entry.target_servers }}</td><td>{{ entry.file }}</td><td>{{ entry.status }}</td></tr>
+            {% endfor %}
+            </tbody></table>
             
             <h2>About This Report</h2>
             <p>This report was generated by the VM File Exchange Monitor.</p>
         </body>
         </html>
-        '''
-        
-        if filename:
-            # Make sure the directory exists
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            with open(filename, 'w') as f:
-                f.write(html)
-            return filename
-        else:
-            return html
+        ''')
@@ -1,62 +1,68 @@
-def generate_time_series(servers_data):
-    """
-    Generate time series data for visualization
-    
-    Args:
-        servers_data: Dictionary of server data
-        
-    Returns:
-        dict: Time series data for sent and received files
-    """
-    time_series = {
-        "sent": {},
-        "received": {}
-    }
-    
-    # Process sent files time series
-    for server, data in servers_data.items():
-        sent_by_day = defaultdict(int)
-        
-        for file in data["sent_files"]:
-            try:
-                # Parse the timestamp (format: %Y-%m-%d %H:%M:%S)
-                dt = datetime.strptime(file["timestamp"], "%Y-%m-%d %H:%M:%S")
-                day = dt.strftime("%Y-%m-%d")
-                sent_by_day[day] += 1
-            except (ValueError, KeyError):
-                continue
-        
-        time_series["sent"][server] = dict(sent_by_day)
-    
-    # Process received files time series (estimated from received_files)
-    for server, data in servers_data.items():
-        received_by_day = defaultdict(int)
-        
-        for file in data["received_files"]:
-            try:
-                # Try to parse the date from the file info
-                # This is less precise than sent data but gives an approximation
-                if "date" in file:
-                    # Try to parse the date (varies by format)
-                    try:
-                        dt = datetime.strptime(file["date"], "%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        # Try alternative format
-                        dt = datetime.strptime(file["date"], "%Y-%m-%d")
-                    
-                    day = dt.strftime("%Y-%m-%d")
-                    received_by_day[day] += 1
-            except (ValueError, KeyError):
-                continue
-        
-        time_series["received"][server] = dict(received_by_day)
-    
-    return time_seriesimport os
+import os
+import re
 import csv
 import json
-import pandas as pd
+import heapq
+import time
+import logging
+import multiprocessing
 from datetime import datetime
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILE = "history.csv"
+RECEIVED_SUMMARY_FILE = "received_summary.txt"
+
+# Time series bucket sizes: pandas frequency and bucket label format
+# (weeks start on Monday and are labelled with that day)
+TIME_SERIES_RESOLUTIONS = {
+    "minute": ("min", "%Y-%m-%d %H:%M"),
+    "hour": ("h", "%Y-%m-%d %H:00"),
+    "day": ("D", "%Y-%m-%d"),
+    "week": ("W", "%Y-%m-%d")
+}
+
+# Resolutions maintained as incremental rollup counters
+ROLLUP_RESOLUTIONS = ("hour", "day")
+
+# Time bucket rollups: file counts, and bytes per server as the source and
+# as the target of the received files
+ROLLUP_KINDS = ("sent", "received", "sent_bytes", "received_bytes")
+
+# Date and hour prefix of the timestamps in history.csv and received_summary.txt
+_TIMESTAMP_PREFIX = re.compile(r"(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}))?")
+
+# File lines of the "Files Received:" section of received_summary.txt, as
+# written by the exchange script, and a lenient fallback for other layouts
+_RECEIVED_FILE_LINE = re.compile(r"\s*- ([^ (]+) \(Size: (\d+) bytes, Date: ([^)]*)\)\s*$")
+_RECEIVED_FILE_LINE_LENIENT = re.compile(r"- ([^(]*?)\s*\((?:\s*Size:\s*(\d+) bytes,)?[^)]*?Date:\s*([^)]*?)\s*\)?$")
+
+# Separators between the servers of a multi-target history row
+_TARGET_SEPARATOR = re.compile(r"[;,\s]+")
+
+# Server IPs mapping from the original script, extended by the server_ips argument
+DEFAULT_SERVER_IPS = {
+    "ubuntu-server-1": "192.168.56.101",
+    "ubuntu-server-2": "192.168.56.102",
+    "ubuntu-server-3": "192.168.56.103"
+}
+
+# Number of most recent exchanges kept across all servers
+RECENT_EXCHANGES = 50
+
+# Number of bytes before a history checkpoint used to detect rewritten files
+FINGERPRINT_BYTES = 64
+
+# Field holding the values of history rows with more fields than the header,
+# joined with commas
+HISTORY_EXTRA_FIELD = "extra"
+
+# Parse processes are started by a fork server rather than forked from the
+# caller, which may be a threaded web worker holding locks and connections
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
 
 def parse_exchange_data(base_dir):
     """
@@ -68,23 +74,69 @@ def parse_exchange_data(base_dir):
     Returns:
         dict: Structured data with all server information
     """
+    result, _, _, _ = ingest_exchange_data(base_dir)
+    return result
+
+def ingest_exchange_data(base_dir, previous=None, checkpoints=None, workers=1, executor="process",
+                         servers=None, registry=None, server_ips=None, archives=None):
+    """
+    Parse the exchange data, resuming from per-file checkpoints when possible
+    
+    history.csv is append-only, so only the bytes past the stored offset are
+    parsed and merged into the previous per-server aggregates. A changed
+    inode, a file shorter than the checkpoint or a mismatching fingerprint
+    means the file was rotated or truncated and triggers a full rescan.
+    received_summary.txt is rewritten by every cron run, so it is skipped
+    while unchanged and re-parsed as a whole otherwise.
+    
+    With more than one worker the per-server file reading is fanned out to a
+    pool and only the merge into the result happens in this process.
+    
+    Rows moved to the archive are never re-read: a rescan starts past the
+    archived prefix of history.csv, and the archived counts are added to the
+    totals and aggregates instead.
+    
+    Args:
+        base_dir: Base directory containing exchange_results
+        previous: Optional result of an earlier ingest to extend (modified in place)
+        checkpoints: Optional checkpoints returned together with previous
+        workers: Number of servers to read concurrently
+        executor: 'process' for CPU-bound parsing, 'thread' for slow (e.g. NFS) mounts
+        servers: Optional names of the servers whose files changed; other servers
+                 already in previous are carried over without touching their files
+        registry: Optional server names in id order from an earlier ingest; new
+                  servers are appended so existing ids never change
+        server_ips: Optional IP addresses overriding DEFAULT_SERVER_IPS
+        archives: Optional archive manifests per server (see archive.load_manifests)
+        
+    Returns:
+        tuple: (result, checkpoints, changes, rollup) where checkpoints maps each
+               server to its file checkpoints, changes describes what was re-read
+               and rollup holds the resulting aggregate changes (see new_rollup_delta)
+    """
     result = {
         "servers": {},
         "summary": {
             "total_files_sent": 0,
             "total_files_received": 0,
+            "total_bytes_received": 0,
             "server_ips": {}
         }
     }
+    new_checkpoints = {}
+    changes = {}
     
-    # Server IPs mapping from the original script
-    server_ips = {
-        "ubuntu-server-1": "192.168.56.101",
-        "ubuntu-server-2": "192.168.56.102", 
-        "ubuntu-server-3": "192.168.56.103"
-    }
+    # Checkpoints are only meaningful together with the data they describe
+    if previous is None:
+        checkpoints = None
+    previous_servers = previous["servers"] if previous else {}
+    checkpoints = checkpoints or {}
     
+    archives = archives or {}
+    server_ips = {**DEFAULT_SERVER_IPS, **(server_ips or {})}
     result["summary"]["server_ips"] = server_ips
+    registry = list(registry or [])
+    result["registry"] = registry
     
     # Get all server directories
     try:
@@ -92,137 +144,851 @@ def parse_exchange_data(base_dir):
                      if os.path.isdir(os.path.join(base_dir, d)) and d.startswith('ubuntu-server')]
     except FileNotFoundError:
         # If directory doesn't exist, return empty result
-        return result
+        return result, new_checkpoints, changes, new_rollup_delta(True)
+    
+    # Servers that are known and not reported as changed keep their data
+    unchanged = set()
+    if servers is not None:
+        unchanged = {server for server in server_dirs
+                     if server not in servers and server in previous_servers and server in checkpoints}
+    to_read = [server for server in server_dirs if server not in unchanged]
+    
+    # Only servers that already have data can resume from their checkpoints
+    server_checkpoints = [checkpoints.get(server) if server in previous_servers else None
+                          for server in to_read]
+    server_archives = [_archive_checkpoint(archives.get(server)) for server in to_read]
+    deltas = dict(zip(to_read, _map_servers(read_server_delta, workers, executor,
+                                            [base_dir] * len(to_read), to_read, server_checkpoints,
+                                            server_archives)))
+    
+    # Aggregates are only patched when there is a complete previous result
+    rebuild = not (previous and "time_series" in previous
+                   and "links" in previous.get("connection_matrix", {}))
+    rollup = new_rollup_delta(rebuild)
+    
+    # Archived rows still count in the aggregates built from scratch
+    archived = archived_rollup({server: archives[server] for server in server_dirs if server in archives})
+    if rebuild:
+        merge_rollup(rollup, archived)
+    
+    # History rows that may enter the most recent exchanges, and servers whose
+    # previous entries there are stale
+    recent_rows = []
+    stale_recent = set()
     
     for server in server_dirs:
-        server_data = {
-            "ip": server_ips.get(server, "Unknown"),
-            "sent_files": [],
-            "received_files": [],
-            "history": [],
-            "summary": {
-                "total_sent": 0,
-                "total_received": 0,
-                "last_exchange": None
-            }
-        }
-        
-        server_dir = os.path.join(base_dir, server)
-        
-        # Parse history.csv if it exists
-        history_file = os.path.join(server_dir, "history.csv")
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, 'r') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        server_data["history"].append(row)
-                        
-                        # Update summary based on history
-                        if row["action"] == "sent":
-                            server_data["sent_files"].append({
-                                "timestamp": row["timestamp"],
-                                "target": row["target_servers"],
-                                "filename": row["file"],
-                                "status": row["status"]
-                            })
-                            server_data["summary"]["total_sent"] += 1
-                        
-                        # Track the latest exchange
-                        if (not server_data["summary"]["last_exchange"] or 
-                            row["timestamp"] > server_data["summary"]["last_exchange"]):
-                            server_data["summary"]["last_exchange"] = row["timestamp"]
-            except Exception as e:
-                print(f"Error parsing history for {server}: {str(e)}")
-        
-        # Parse received_summary.txt if it exists
-        summary_file = os.path.join(server_dir, "received_summary.txt")
-        if os.path.exists(summary_file):
-            try:
-                with open(summary_file, 'r') as f:
-                    lines = f.readlines()
-                    
-                    # Extract received files info
-                    in_files_section = False
-                    for line in lines:
-                        line = line.strip()
-                        
-                        if line.startswith("Files Received:"):
-                            in_files_section = True
-                            continue
-                            
-                        if in_files_section and line.startswith("- "):
-                            # Parse the file info line
-                            # Format: "- filename (Size: X bytes, Date: Y)"
-                            parts = line[2:].split('(')
-                            filename = parts[0].strip()
-                            
-                            # Extract source server from filename
-                            source_server = "unknown"
-                            if filename.startswith("from_") and "_" in filename:
-                                source_server = filename.split("_")[1]
-                            
-                            file_info = {
-                                "filename": filename,
-                                "source": source_server,
-                                "date": parts[1].split("Date:")[1].strip().rstrip(")")
-                            }
-                            
-                            server_data["received_files"].append(file_info)
-                            server_data["summary"]["total_received"] += 1
-                        
-                        if in_files_section and line.startswith("Total Files:"):
-                            in_files_section = False
-            except Exception as e:
-                print(f"Error parsing received summary for {server}: {str(e)}")
+        if server in unchanged:
+            server_data = previous_servers[server]
+            delta = {"checkpoints": checkpoints[server]}
+            change = {"history_reset": False, "new_history": 0, "received_changed": False}
+            if rebuild:
+                add_rollup_rows(rollup, server, server_data["sent_files"], server_data["received_files"], 1)
+        else:
+            delta = deltas[server]
+            previous_server = previous_servers.get(server)
+            
+            # Withdraw what is about to be re-read from the aggregates
+            sent_before = 0
+            if previous_server:
+                if delta["history_reset"]:
+                    if not rebuild:
+                        add_rollup_rows(rollup, server, previous_server["sent_files"], [], -1)
+                else:
+                    sent_before = len(previous_server["sent_files"])
+                if delta["received_files"] is not None and not rebuild:
+                    add_rollup_rows(rollup, server, [], previous_server["received_files"], -1)
+            
+            server_data, change = merge_server_delta(
+                previous_server, delta, server_ips.get(server, "Unknown")
+            )
+            
+            # ... and add the rows that are new to the aggregates
+            if rebuild:
+                sent_before = 0
+            add_rollup_rows(
+                rollup, server, server_data["sent_files"][sent_before:],
+                server_data["received_files"] if change["received_changed"] or rebuild else [], 1
+            )
+            
+            if change["history_reset"] or rebuild:
+                stale_recent.add(server)
+                recent_rows.append((server, server_data["history"]))
+            elif change["new_history"]:
+                recent_rows.append((server, server_data["history"][-change["new_history"]:]))
         
         # Add to the result
         result["servers"][server] = server_data
+        new_checkpoints[server] = delta["checkpoints"]
+        changes[server] = change
         
         # Update global summary
         result["summary"]["total_files_sent"] += server_data["summary"]["total_sent"]
         result["summary"]["total_files_received"] += server_data["summary"]["total_received"]
+        result["summary"]["total_bytes_received"] += server_data["summary"]["bytes_received"]
+    
+    # Register servers seen as directories or on either end of a changed link
+    register_servers(registry, server_dirs)
+    register_servers(registry, rollup["links"])
+    for targets in rollup["links"].values():
+        register_servers(registry, targets)
+    
+    # Servers that disappeared no longer count
+    removed = set(previous_servers) - set(result["servers"])
+    if not rebuild:
+        for server in removed:
+            add_rollup_rows(rollup, server, previous_servers[server]["sent_files"],
+                            previous_servers[server]["received_files"], -1)
+            if server in archives:
+                merge_rollup(rollup, archived_rollup({server: archives[server]}), -1)
+    rollup["removed"] = sorted(removed)
+    
+    recent = [] if rebuild else previous.get("recent_exchanges", [])
+    stale_recent |= removed
+    if rebuild or any(entry["source"] in stale_recent for entry in recent):
+        # Dropped entries leave room for older rows of any server
+        recent = []
+        recent_rows = [(server, server_data["history"]) for server, server_data in result["servers"].items()]
+    result["recent_exchanges"] = update_recent_exchanges(recent, recent_rows, stale_recent)
     
     # Add calculated fields
     result["summary"]["total_exchanges"] = len(server_dirs)
     result["summary"]["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    # Generate time series data for visualization
-    result["time_series"] = generate_time_series(result["servers"])
+    if rebuild:
+        # Daily time series for visualization, from the day buckets counted
+        # for the rollup (archived rows included)
+        result["time_series"] = apply_time_series_delta({}, rollup, result["servers"])
+        
+        # Generate connection matrix for visualization
+        result["connection_matrix"] = apply_matrix_delta(
+            generate_connection_matrix(result["servers"], registry), archived, registry)
+    else:
+        # Patch the previous aggregates with the rows added or withdrawn
+        result["time_series"] = apply_time_series_delta(previous["time_series"], rollup, result["servers"])
+        result["connection_matrix"] = apply_matrix_delta(previous["connection_matrix"], rollup, registry)
     
-    # Generate connection matrix for visualization
-    result["connection_matrix"] = generate_connection_matrix(result["servers"])
+    return result, new_checkpoints, changes, rollup
+
+def update_recent_exchanges(recent, new_rows, stale_servers=()):
+    """
+    Merge newly ingested history rows into the most recent exchanges
     
-    return result
+    Args:
+        recent: Previous most recent exchanges, newest first
+        new_rows: (server, rows) pairs of history rows to consider
+        stale_servers: Servers whose previous entries must be dropped
+        
+    Returns:
+        list: Up to RECENT_EXCHANGES history rows tagged with their server
+              ('source'), newest first
+    """
+    candidates = chain(
+        (entry for entry in recent if entry["source"] not in stale_servers),
+        ({**row, "source": server} for server, rows in new_rows for row in rows)
+    )
+    return heapq.nlargest(RECENT_EXCHANGES, candidates, key=lambda entry: entry.get("timestamp") or "")
+
+def new_rollup_delta(rebuild=False):
+    """
+    Create an empty set of aggregate changes
+    
+    Args:
+        rebuild: Whether the changes describe everything rather than a delta
+        
+    Returns:
+        dict: Changes per server and bucket of every ROLLUP_KINDS counter at
+              every ROLLUP_RESOLUTIONS entry, of the file count per
+              (source, target) link, and of the received bytes per link
+    """
+    return {
+        "rebuild": rebuild,
+        **{kind: {resolution: defaultdict(lambda: defaultdict(int)) for resolution in ROLLUP_RESOLUTIONS}
+           for kind in ROLLUP_KINDS},
+        "links": defaultdict(lambda: defaultdict(int)),
+        "link_bytes": defaultdict(lambda: defaultdict(int)),
+        "removed": []
+    }
 
-def generate_connection_matrix(servers_data):
+def build_rollup(servers_data, archives=None):
     """
-    Generate a connection matrix showing the file exchanges between servers
+    Build aggregate changes counting every file from scratch
     
     Args:
         servers_data: Dictionary of server data
+        archives: Optional archive manifests per server, whose rows are counted too
         
     Returns:
-        dict: Connection matrix data
+        dict: Aggregate changes (see new_rollup_delta) flagged as a rebuild
+    """
+    rollup = new_rollup_delta(True)
+    for server, data in servers_data.items():
+        add_rollup_rows(rollup, server, data["sent_files"], data["received_files"], 1)
+    merge_rollup(rollup, archived_rollup({
+        server: manifest for server, manifest in (archives or {}).items() if server in servers_data
+    }))
+    return rollup
+
+def archived_rollup(archives):
+    """
+    Build aggregate changes counting the history rows moved to the archive
+    
+    Args:
+        archives: Archive manifests per server, with their pre-computed rollups
+        
+    Returns:
+        dict: Aggregate changes (see new_rollup_delta)
+    """
+    rollup = new_rollup_delta()
+    for server, manifest in archives.items():
+        counts = manifest.get("rollup", {})
+        for resolution in ROLLUP_RESOLUTIONS:
+            for bucket, count in counts.get(resolution, {}).items():
+                rollup["sent"][resolution][server][bucket] += count
+        for target, count in counts.get("links", {}).items():
+            rollup["links"][server][target] += count
+    return rollup
+
+def merge_rollup(rollup, other, sign=1):
+    """
+    Add (sign=1) or withdraw (sign=-1) one set of aggregate changes to another
+    
+    Args:
+        rollup: Aggregate changes to update (modified in place)
+        other: Aggregate changes to add or withdraw
+        sign: 1 to add the counts, -1 to withdraw them
+    """
+    for kind in ROLLUP_KINDS:
+        for resolution in ROLLUP_RESOLUTIONS:
+            for server, buckets in other[kind][resolution].items():
+                for bucket, count in buckets.items():
+                    rollup[kind][resolution][server][bucket] += sign * count
+    for kind in ("links", "link_bytes"):
+        for source, targets in other[kind].items():
+            for target, count in targets.items():
+                rollup[kind][source][target] += sign * count
+
+def add_rollup_rows(rollup, server, sent_files, received_files, sign):
+    """
+    Add (sign=1) or withdraw (sign=-1) files from a set of aggregate changes
+    
+    The size of a received file counts as bytes received by the server and
+    as bytes sent by its source, on the received file's date.
+    
+    Args:
+        rollup: Result of new_rollup_delta
+        server: Server the files belong to
+        sent_files: Sent file entries of the server
+        received_files: Received file entries of the server
+        sign: 1 to count the files, -1 to uncount them
+    """
+    for file in sent_files:
+        for resolution in ROLLUP_RESOLUTIONS:
+            bucket = bucket_label(file.get("timestamp"), resolution)
+            if bucket:
+                rollup["sent"][resolution][server][bucket] += sign
+        for target in split_targets(file.get("target")):
+            rollup["links"][server][target] += sign
+    
+    for file in received_files:
+        size = file.get("size") or 0
+        source = file.get("source")
+        for resolution in ROLLUP_RESOLUTIONS:
+            bucket = bucket_label(file.get("date"), resolution)
+            if bucket:
+                rollup["received"][resolution][server][bucket] += sign
+                if size:
+                    rollup["received_bytes"][resolution][server][bucket] += sign * size
+                    rollup["sent_bytes"][resolution][source][bucket] += sign * size
+        if size:
+            rollup["link_bytes"][source][server] += sign * size
+
+def bucket_label(timestamp, resolution):
+    """
+    Label the time bucket of a timestamp without parsing it into a datetime
+    
+    Matches the labels of generate_time_series for the 'hour' and 'day'
+    resolutions.
+    
+    Args:
+        timestamp: 'YYYY-MM-DD HH:MM:SS...' or 'YYYY-MM-DD' string
+        resolution: 'hour' or 'day'
+        
+    Returns:
+        str: Bucket label, or None for unparseable timestamps
+    """
+    match = _TIMESTAMP_PREFIX.match(timestamp or "")
+    if not match:
+        return None
+    if resolution == "hour":
+        return f"{match.group(1)} {match.group(2) or '00'}:00"
+    return match.group(1)
+
+def apply_time_series_delta(time_series, rollup, servers):
+    """
+    Patch daily time series with a set of aggregate changes
+    
+    Args:
+        time_series: Previous result of generate_time_series (modified in place)
+        rollup: Aggregate changes from ingest_exchange_data
+        servers: Servers of the new result
+        
+    Returns:
+        dict: Updated time series
+    """
+    for kind in ("sent", "received"):
+        series = time_series.setdefault(kind, {})
+        for server, buckets in rollup[kind]["day"].items():
+            counts = series.setdefault(server, {})
+            for bucket, count in buckets.items():
+                total = counts.get(bucket, 0) + count
+                if total > 0:
+                    counts[bucket] = total
+                else:
+                    counts.pop(bucket, None)
+        
+        for server in list(series):
+            if server not in servers:
+                del series[server]
+        for server in servers:
+            series.setdefault(server, {})
+    
+    return time_series
+
+def apply_matrix_delta(connection_matrix, rollup, registry):
+    """
+    Patch a sparse connection matrix with a set of aggregate changes
+    
+    Args:
+        connection_matrix: Previous result of generate_connection_matrix
+        rollup: Aggregate changes from ingest_exchange_data
+        registry: Server names in id order, a superset of the previous one
+        
+    Returns:
+        dict: Updated connection matrix
+    """
+    ids = {server: index for index, server in enumerate(registry)}
+    counts = Counter({(source, target): count for source, target, count in connection_matrix["links"]})
+    for source, targets in rollup["links"].items():
+        for target, count in targets.items():
+            if count:
+                counts[ids[source], ids[target]] += count
+    
+    return _sparse_matrix(registry, counts)
+
+def split_targets(value):
+    """
+    Split the target_servers field of a history row into server names
+    
+    Args:
+        value: One server name, or several separated by ';', ',' or whitespace
+        
+    Returns:
+        list: Server names (empty for a missing value)
+    """
+    return [target for target in _TARGET_SEPARATOR.split(value or "") if target]
+
+def register_servers(registry, servers):
     """
-    # Get all server names
-    server_names = list(servers_data.keys())
+    Append servers that have no id yet to a server registry
     
-    # Initialize matrix with zeros
-    matrix = {}
-    for source in server_names:
-        matrix[source] = {}
-        for target in server_names:
-            matrix[source][target] = 0
+    Args:
+        registry: Server names in id order (modified in place)
+        servers: Server names to register
+        
+    Returns:
+        list: The registry
+    """
+    known = set(registry)
+    for server in sorted(set(servers) - known):
+        registry.append(server)
+    return registry
+
+def _map_servers(func, workers, executor, *iterables):
+    """
+    Apply func to every server, optionally through a process or thread pool
+    
+    Args:
+        func: Module level function to call (must be picklable for processes)
+        workers: Pool size; 1 or less runs everything in this thread
+        executor: 'process' or 'thread'
+        *iterables: Argument lists, one entry per server
+        
+    Returns:
+        list: Results in the order of the input servers
+    """
+    if workers <= 1 or len(iterables[0]) <= 1:
+        return list(map(func, *iterables))
+    
+    max_workers = min(workers, len(iterables[0]))
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        pool = ProcessPoolExecutor(max_workers=max_workers,
+                                   mp_context=multiprocessing.get_context(POOL_START_METHOD))
+    with pool:
+        return list(pool.map(func, *iterables))
+
+def read_server_delta(base_dir, server, checkpoints=None, archive=None):
+    """
+    Read what changed in a server's log files since the given checkpoints
+    
+    Only touches the filesystem, so it can run in a worker process; the
+    result is merged into the server data by merge_server_delta.
+    
+    Args:
+        base_dir: Base directory containing exchange_results
+        server: Name of the server directory
+        checkpoints: Optional file checkpoints of the previously merged data
+        archive: Optional archive checkpoint of the server (offset and
+                 fingerprint of the archived prefix of history.csv, and the
+                 archived totals)
+        
+    Returns:
+        dict: New history rows, whether the history must be rebuilt, the
+              received files (None when unchanged), the new checkpoints, the
+              archived totals and read statistics (seconds, and
+              rows/bytes/malformed lines per file)
+    """
+    started = time.perf_counter()
+    checkpoints = checkpoints or {}
+    delta = {
+        "history_reset": False,
+        "history_rows": [],
+        "received_files": None,
+        "archived": archive,
+        "checkpoints": {},
+        "stats": {
+            HISTORY_FILE: {"rows": 0, "bytes": 0, "malformed": 0},
+            RECEIVED_SUMMARY_FILE: {"rows": 0, "bytes": 0, "malformed": 0}
+        }
+    }
+    
+    server_dir = os.path.join(base_dir, server)
+    
+    # Parse history.csv if it exists
+    history_file = os.path.join(server_dir, HISTORY_FILE)
+    if os.path.exists(history_file):
+        try:
+            stat = os.stat(history_file)
+            checkpoint = checkpoints.get(HISTORY_FILE)
+            if checkpoint and _history_checkpoint_valid(history_file, stat, checkpoint):
+                offset = checkpoint["offset"]
+                archived = checkpoint.get("archived", 0)
+                unmatched = checkpoint.get("unmatched_archive")
+                history_reset = False
+            elif archive and _archive_valid(history_file, stat, archive):
+                # Rotated or truncated file: rebuild this server's history,
+                # starting past the rows already moved to the archive
+                offset = archived = archive["offset"]
+                unmatched = None
+                history_reset = True
+            else:
+                # New file, or one whose archived prefix is gone or being
+                # rewritten (e.g. copied over in place): read it from the
+                # start, recognizing the archived rows it still holds
+                offset = archived = 0
+                unmatched = {"rows": archive["rows"], "last_exchange": archive["last_exchange"]} \
+                    if archive and archive.get("rows") else None
+                history_reset = True
+            
+            rows = []
+            if stat.st_size > offset:
+                start = offset
+                rows, offset = _read_history_rows(history_file, offset)
+                if unmatched:
+                    rows, archived, unmatched = _skip_archived_rows(history_file, start, rows, unmatched,
+                                                                    archived)
+                delta["stats"][HISTORY_FILE] = {
+                    "rows": len(rows),
+                    "bytes": offset - start,
+                    # Rows with missing or extra fields
+                    "malformed": sum(1 for row in rows if None in row or None in row.values())
+                }
+            
+            delta["history_reset"] = history_reset
+            delta["history_rows"] = rows
+            delta["checkpoints"][HISTORY_FILE] = {
+                "offset": offset,
+                "inode": stat.st_ino,
+                "fingerprint": read_fingerprint(history_file, offset),
+                "archived": archived
+            }
+            if unmatched:
+                delta["checkpoints"][HISTORY_FILE]["unmatched_archive"] = unmatched
+        except Exception as e:
+            logger.error(f"Error parsing history for {server}: {str(e)}")
+    else:
+        delta["history_reset"] = True
+    
+    # Parse received_summary.txt if it exists
+    summary_file = os.path.join(server_dir, RECEIVED_SUMMARY_FILE)
+    if os.path.exists(summary_file):
+        try:
+            stat = os.stat(summary_file)
+            checkpoint = {
+                "inode": stat.st_ino,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns
+            }
+            if checkpoint != checkpoints.get(RECEIVED_SUMMARY_FILE):
+                delta["received_files"], malformed = _read_received_files(summary_file)
+                delta["stats"][RECEIVED_SUMMARY_FILE] = {
+                    "rows": len(delta["received_files"]),
+                    "bytes": stat.st_size,
+                    "malformed": malformed
+                }
+            delta["checkpoints"][RECEIVED_SUMMARY_FILE] = checkpoint
+        except Exception as e:
+            logger.error(f"Error parsing received summary for {server}: {str(e)}")
+    else:
+        delta["received_files"] = []
+    
+    delta["stats"]["seconds"] = time.perf_counter() - started
+    return delta
+
+def merge_server_delta(previous, delta, ip):
+    """
+    Merge a delta from read_server_delta into a server's data
+    
+    Args:
+        previous: Server data from an earlier ingest, or None (modified in place)
+        delta: Result of read_server_delta for the server
+        ip: IP address to report for the server
+        
+    Returns:
+        tuple: (server_data, change) where change records what was updated
+               and the read statistics of the delta
+    """
+    # Archived rows count in the totals without being kept
+    archived = delta.get("archived") or {}
+    server_data = previous or {
+        "ip": ip,
+        "sent_files": [],
+        "received_files": [],
+        "history": [],
+        "summary": {
+            "total_sent": archived.get("sent", 0),
+            "total_received": 0,
+            "bytes_received": 0,
+            "last_exchange": archived.get("last_exchange")
+        }
+    }
+    server_data["ip"] = ip
+    change = {
+        "history_reset": previous is None,
+        "new_history": len(delta["history_rows"]),
+        "received_changed": previous is None,
+        "stats": delta.get("stats")
+    }
+    
+    if delta["history_reset"] and server_data["history"]:
+        _reset_history(server_data, archived)
+        change["history_reset"] = True
+    for row in delta["history_rows"]:
+        _add_history_row(server_data, row)
+    
+    received_files = delta["received_files"]
+    if received_files is not None and (received_files or server_data["received_files"]):
+        server_data["received_files"] = received_files
+        server_data["summary"]["total_received"] = len(received_files)
+        server_data["summary"]["bytes_received"] = sum(file["size"] or 0 for file in received_files)
+        change["received_changed"] = True
+    
+    return server_data, change
+
+def _reset_history(server_data, archived):
+    """Drop all history derived data of a server before a full rescan, keeping the archived totals"""
+    server_data["history"] = []
+    server_data["sent_files"] = []
+    server_data["summary"]["total_sent"] = archived.get("sent", 0)
+    server_data["summary"]["last_exchange"] = archived.get("last_exchange")
+
+def _add_history_row(server_data, row):
+    """Merge a single history.csv row into the server data"""
+    server_data["history"].append(row)
+    
+    # Update summary based on history
+    if row["action"] == "sent":
+        server_data["sent_files"].append(sent_file_entry(row))
+        server_data["summary"]["total_sent"] += 1
+    
+    # Track the latest exchange
+    if (not server_data["summary"]["last_exchange"] or 
+        row["timestamp"] > server_data["summary"]["last_exchange"]):
+        server_data["summary"]["last_exchange"] = row["timestamp"]
+
+def sent_file_entry(row):
+    """Build the sent_files entry of a history.csv row with action 'sent'"""
+    return {
+        "timestamp": row["timestamp"],
+        "target": row["target_servers"],
+        "filename": row["file"],
+        "status": row["status"]
+    }
+
+def _archive_checkpoint(manifest):
+    """Extract what read_server_delta needs from an archive manifest"""
+    if not manifest:
+        return None
+    return {key: manifest[key] for key in ("offset", "fingerprint", "rows", "sent", "last_exchange")}
+
+def _skip_archived_rows(path, start, rows, unmatched, archived):
+    """
+    Drop the leading rows of history.csv that are already in the archive
+    
+    Used when the archived prefix of the file could not be checked: leading
+    rows are taken for archived ones as long as they are not newer than the
+    last archived row, up to the number of archived rows not matched yet.
+    
+    Args:
+        path: Path of the history.csv file
+        start: Byte offset the rows were read from
+        rows: Rows read from start
+        unmatched: Archived rows not matched yet and the last archived timestamp
+        archived: Byte offset past the rows matched by earlier reads
+        
+    Returns:
+        tuple: (remaining rows, byte offset past the matched rows, archived
+                rows still to match or None once a newer row was seen)
+    """
+    skip = 0
+    last_exchange = unmatched["last_exchange"] or ""
+    while skip < min(len(rows), unmatched["rows"]) and (rows[skip].get("timestamp") or "") <= last_exchange:
+        skip += 1
+    
+    if skip:
+        # Find the byte offset past the matched rows, blank lines included
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(max(start, len(header)))
+            matched = 0
+            while matched < skip:
+                if f.readline().strip():
+                    matched += 1
+            archived = f.tell()
+    
+    remaining = unmatched["rows"] - skip
+    if skip < len(rows) or not remaining:
+        unmatched = None
+    else:
+        unmatched = {**unmatched, "rows": remaining}
+    return rows[skip:], archived, unmatched
+
+def _archive_valid(path, stat, archive):
+    """Check whether the archived prefix of a history.csv file is still in place"""
+    if stat.st_size < archive["offset"]:
+        return False
+    return read_fingerprint(path, archive["offset"]) == archive["fingerprint"]
+
+def read_fingerprint(path, offset):
+    """Return the bytes preceding offset as hex, used to detect rewritten files"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - FINGERPRINT_BYTES))
+        return f.read(min(offset, FINGERPRINT_BYTES)).hex()
+
+def _history_checkpoint_valid(path, stat, checkpoint):
+    """Check whether a history.csv checkpoint still describes a prefix of the file"""
+    if stat.st_ino != checkpoint.get("inode") or stat.st_size < checkpoint.get("offset", 0):
+        return False
+    return read_fingerprint(path, checkpoint["offset"]) == checkpoint.get("fingerprint")
+
+def _read_history_rows(path, offset):
+    """
+    Read the complete CSV rows appended to history.csv after offset
+    
+    Args:
+        path: Path of the history.csv file
+        offset: Byte offset of the first unread row (0 to start after the header)
+        
+    Returns:
+        tuple: (rows, offset just past the last complete row); values past the
+               header's fields are joined into HISTORY_EXTRA_FIELD, missing
+               ones are None
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            # The header itself is still being written
+            return [], 0
+        
+        fieldnames = next(csv.reader([header.decode('utf-8')]))
+        start = max(offset, len(header))
+        f.seek(start)
+        chunk = f.read()
+    
+    # Leave a partially written last line for the next run
+    end = chunk.rfind(b'\n') + 1
+    lines = chunk[:end].decode('utf-8').splitlines()
+    rows = list(csv.DictReader(lines, fieldnames=fieldnames, restkey=HISTORY_EXTRA_FIELD))
+    for row in rows:
+        if HISTORY_EXTRA_FIELD in row and isinstance(row[HISTORY_EXTRA_FIELD], list):
+            row[HISTORY_EXTRA_FIELD] = ",".join(row[HISTORY_EXTRA_FIELD])
+    
+    return rows, start + end
+
+def _read_received_files(path):
+    """
+    Parse the list of received files from a received_summary.txt file
+    
+    The file is read line by line in a single pass; each line of the files
+    section is matched as read against the precompiled _RECEIVED_FILE_LINE,
+    the lenient pattern only being tried on the lines that do not match it.
+    
+    Returns:
+        tuple: (received files, number of malformed file lines skipped)
+    """
+    received_files = []
+    malformed = 0
+    match_line = _RECEIVED_FILE_LINE.match
+    match_lenient = _RECEIVED_FILE_LINE_LENIENT.match
+    
+    with open(path, 'r') as f:
+        in_files_section = False
+        for line in f:
+            # Most lines are file lines in the expected format, matched as read
+            match = match_line(line) if in_files_section else None
+            if match is None:
+                line = line.strip()
+                if not in_files_section:
+                    in_files_section = line.startswith("Files Received:")
+                    continue
+                if line.startswith("Total Files:"):
+                    in_files_section = False
+                    continue
+                if not line.startswith("- "):
+                    continue
+                
+                # Format: "- filename (Size: X bytes, Date: Y)"
+                match = match_lenient(line)
+                if match is None:
+                    malformed += 1
+                    continue
+            filename, size, date = match.groups()
+            
+            received_files.append({
+                "filename": filename,
+                # Source server from the "from_<source>_<stamp>.txt" file name
+                "source": filename.split("_")[1] if filename.startswith("from_") else "unknown",
+                "size": int(size) if size is not None else None,
+                "date": date
+            })
+    
+    return received_files, malformed
+
+def generate_connection_matrix(servers_data, registry=None):
+    """
+    Generate a sparse connection matrix of the file exchanges between servers
+    
+    Every target of a multi-target row counts as its own link. Only non-zero
+    links are stored, as [source id, target id, count] triples over the
+    registry ids, so the size follows the number of links rather than N*N.
+    
+    Args:
+        servers_data: Dictionary of server data
+        registry: Optional server names in id order (extended in place with
+                  servers that are not registered yet)
+        
+    Returns:
+        dict: Connection matrix data
+    """
+    registry = register_servers(registry if registry is not None else [], servers_data)
     
-    # Fill in the matrix based on sent files
+    # Count the links by name first, new targets get registered afterwards
+    counts = Counter()
     for source, data in servers_data.items():
         for file in data.get("sent_files", []):
-            target = file.get("target")
-            if target in server_names:
-                matrix[source][target] += 1
+            for target in split_targets(file.get("target")):
+                counts[source, target] += 1
+    register_servers(registry, [target for _, target in counts])
+    
+    ids = {server: index for index, server in enumerate(registry)}
+    return _sparse_matrix(registry, Counter({
+        (ids[source], ids[target]): count for (source, target), count in counts.items()
+    }))
+
+def _sparse_matrix(registry, counts):
+    """Build the connection matrix data from link counts keyed by (source id, target id)"""
+    links = [[source, target, count] for (source, target), count in counts.items() if count > 0]
     
+    # Heaviest links first, so clients can cut the list at any length
+    links.sort(key=lambda link: (-link[2], link[0], link[1]))
     return {
-        "servers": server_names,
-        "matrix": matrix
+        "servers": list(registry),
+        "links": links
     }
+
+def generate_time_series(servers_data, resolution="day"):
+    """
+    Generate time series data for visualization
+    
+    All timestamps are parsed and bucketed in one vectorized pass per
+    direction instead of one strptime call per file.
+    
+    Args:
+        servers_data: Dictionary of server data
+        resolution: Bucket size, one of TIME_SERIES_RESOLUTIONS
+        
+    Returns:
+        dict: Time series data for sent and received files
+    """
+    if resolution not in TIME_SERIES_RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution: {resolution}")
+    
+    servers = list(servers_data)
+    
+    # Sent files carry the exact history timestamp
+    sent = [[file.get("timestamp") for file in servers_data[server]["sent_files"]]
+            for server in servers]
+    
+    # Received files carry the file date from the summary, which may include
+    # fractional seconds and a timezone or only a day
+    received = [[file.get("date") for file in servers_data[server]["received_files"]]
+                for server in servers]
+    
+    return {
+        "sent": _count_by_bucket(servers, sent, resolution),
+        "received": _count_by_bucket(servers, received, resolution)
+    }
+
+def _count_by_bucket(servers, timestamps, resolution):
+    """
+    Count timestamps per server and time bucket
+    
+    Args:
+        servers: Server names
+        timestamps: One list of timestamp strings per server
+        resolution: Bucket size, one of TIME_SERIES_RESOLUTIONS
+        
+    Returns:
+        dict: {server: {bucket label: count}}
+    """
+    frequency, label_format = TIME_SERIES_RESOLUTIONS[resolution]
+    counts = {server: {} for server in servers}
+    
+    lengths = [len(values) for values in timestamps]
+    if not sum(lengths):
+        return counts
+    
+    # Only needed by the finer time series views, not by the ingest itself
+    import numpy as np
+    import pandas as pd
+    
+    raw = pd.Series(list(chain.from_iterable(timestamps)), dtype=object)
+    codes = np.repeat(np.arange(len(servers)), lengths)
+    
+    # Parse the whole column at once, falling back to date-only values
+    parsed = pd.to_datetime(raw.str.slice(0, 19), format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    missing = parsed.isna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(raw[missing].str.slice(0, 10), format="%Y-%m-%d", errors="coerce")
+    
+    if frequency == "W":
+        buckets = parsed.dt.to_period("W-SUN").dt.start_time
+    else:
+        buckets = parsed.dt.floor(frequency)
+    
+    frame = pd.DataFrame({"server": codes, "bucket": buckets}).dropna()
+    for (code, bucket), count in frame.groupby(["server", "bucket"]).size().items():
+        counts[servers[code]][bucket.strftime(label_format)] = int(count)
+    
+    return counts
@@ -0,0 +1,1737 @@
+import calendar
+import gzip
+import hashlib
+import heapq
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+
+import msgpack
+
+from columnar import decode_rows, encode_columns
+from data_parser import ROLLUP_KINDS, ROLLUP_RESOLUTIONS, sent_file_entry, split_targets
+from metrics import PAYLOAD_BYTES, REDIS_SECONDS, SERVER_WRITES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Key holding the version of the live snapshot generation
+CURRENT_VERSION_KEY = 'snapshot:current'
+
+# Key holding the unique id of the live generation; versions restart at 1
+# when Redis loses its data, generation ids never repeat
+CURRENT_GENERATION_KEY = 'snapshot:current:generation'
+
+# File checkpoints describing the live snapshot
+CHECKPOINTS_KEY = 'ingest:checkpoints'
+
+# Content encodings stored next to every JSON payload, best first
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+# Rollup counters maintained alongside the snapshots
+ROLLUP_VERSION_KEY = 'rollup:version'
+ROLLUP_SUMMARY_KEY = 'rollup:summary'
+ROLLUP_SERVERS_KEY = 'rollup:servers'
+ROLLUP_LINKS_KEY = 'rollup:links'
+ROLLUP_LINK_BYTES_KEY = 'rollup:link_bytes'
+
+# Server names mapped to their stable integer ids
+REGISTRY_KEY = 'registry:servers'
+
+# Pub/sub channel announcing every published snapshot
+EVENTS_CHANNEL = 'snapshot:events'
+
+# Changes of the recent snapshots keyed by version, for delta syncs
+CHANGELOG_KEY = 'snapshot:changelog'
+
+# Number of versions kept in the changelog
+CHANGELOG_VERSIONS = 100
+
+# Layout of the stored snapshots: a JSON document without per-server rows
+# plus one msgpack'd columnar payload per server, stored by content digest,
+# with histories indexed and chunked per epoch
+STORAGE_FORMAT = 'columnar-6'
+
+# Keys making up one snapshot generation
+SNAPSHOT_KEYS = ('data', 'data:br', 'data:gzip', 'servers', 'histories', 'meta', 'cache')
+
+# Hours covered by the buckets of each volume resolution, to turn bytes into throughput
+BUCKET_HOURS = {'hour': 1, 'day': 24, 'week': 168}
+
+# Format of the timestamps written by the exchange cron job
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# History row fields with a secondary index: one set of row positions per value
+HISTORY_INDEX_FIELDS = ('status', 'target')
+
+# Rows per columnar chunk of the history read by pages and queries
+HISTORY_CHUNK_ROWS = 1024
+
+# Seconds the result of a history query stays cached for its next pages
+QUERY_CACHE_SECONDS = 60
+
+# Seconds a replaced generation stays readable for requests already using it
+SNAPSHOT_GRACE_SECONDS = 300
+
+# Upper bound on the lifetime of views cached for a generation
+SNAPSHOT_CACHE_SECONDS = 86400
+
+def snapshot_key(version, name):
+    """
+    Build the key of one part of a snapshot generation
+
+    Args:
+        version: Snapshot version
+        name: Part of the snapshot ('data', 'servers', 'histories', 'meta' or 'cache')
+
+    Returns:
+        str: Redis key
+    """
+    return f'snapshot:{version}:{name}'
+
+def payload_field(name, encoding=None):
+    """
+    Build the key suffix or hash field holding an encoded payload variant
+
+    Args:
+        name: Name of the uncompressed payload
+        encoding: Content encoding, or None for the plain JSON
+
+    Returns:
+        str: Key suffix or hash field
+    """
+    return f'{name}:{encoding}' if encoding else name
+
+def encode_payload(data):
+    """
+    Serialize data to JSON once and build the compressed variants
+
+    Args:
+        data: JSON serializable object
+
+    Returns:
+        dict: Payload bytes keyed by content encoding (None for plain JSON)
+    """
+    payload = json.dumps(data).encode('utf-8')
+    variants = {None: payload}
+    for encoding in ENCODINGS:
+        if encoding == 'br':
+            variants[encoding] = brotli.compress(payload, quality=5)
+        else:
+            variants[encoding] = gzip.compress(payload, compresslevel=6)
+    return variants
+
+def content_digest(payload):
+    """
+    Compute the content digest of a stored payload
+
+    Args:
+        payload: Payload bytes
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def document_digest(document):
+    """
+    Compute the content digest of a snapshot document, ignoring its publish time
+
+    Args:
+        document: Result of slim_snapshot
+
+    Returns:
+        str: Hex digest
+    """
+    summary = {**document['summary'], 'last_updated': None}
+    return content_digest(json.dumps({**document, 'summary': summary}, sort_keys=True).encode('utf-8'))
+
+def server_payload_key(server, digest):
+    """
+    Build the key of a server's columnar payload
+
+    Payloads are stored by content, so generations in which a server did
+    not change share its payload.
+
+    Args:
+        server: Server name
+        digest: Content digest of the payload
+
+    Returns:
+        str: Redis key
+    """
+    return f'payload:{server}:{digest}'
+
+def pack_server(server_data):
+    """
+    Serialize one server's data to its columnar msgpack payload
+
+    History and received files are stored as dictionary-encoded columns;
+    sent_files is not stored since it is derived from the history.
+
+    Args:
+        server_data: Server data from ingest_exchange_data
+
+    Returns:
+        bytes: Payload
+    """
+    return msgpack.packb({
+        'ip': server_data['ip'],
+        'summary': server_data['summary'],
+        'history': encode_columns(server_data['history']),
+        'received_files': encode_columns(server_data['received_files'])
+    }, use_bin_type=True)
+
+def unpack_server(payload):
+    """
+    Rebuild one server's data from its columnar payload
+
+    Args:
+        payload: Result of pack_server
+
+    Returns:
+        dict: Server data in the shape produced by ingest_exchange_data
+    """
+    packed = msgpack.unpackb(payload, raw=False)
+    history = decode_rows(packed['history'])
+    return {
+        'ip': packed['ip'],
+        'sent_files': [sent_file_entry(row) for row in history if row.get('action') == 'sent'],
+        'received_files': decode_rows(packed['received_files']),
+        'history': history,
+        'summary': packed['summary']
+    }
+
+def unpack_received_files(payload):
+    """
+    Read the received files out of a server's columnar payload
+
+    The other fields, the history columns included, are skipped without
+    being deserialized.
+
+    Args:
+        payload: Result of pack_server
+
+    Returns:
+        list: Received file rows
+    """
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(payload)
+    for _ in range(unpacker.read_map_header()):
+        if unpacker.unpack() == 'received_files':
+            return decode_rows(unpacker.unpack())
+        unpacker.skip()
+    return []
+
+def slim_snapshot(exchange_data):
+    """
+    Build the snapshot document stored as JSON: everything but per-server rows
+
+    Args:
+        exchange_data: Parsed exchange data
+
+    Returns:
+        dict: Document with each server reduced to its IP and summary
+    """
+    return {
+        **exchange_data,
+        'storage': STORAGE_FORMAT,
+        'servers': {
+            server: {'ip': data['ip'], 'summary': data['summary']}
+            for server, data in exchange_data['servers'].items()
+        }
+    }
+
+def history_key(server, epoch):
+    """
+    Build the key of a server's history sorted set
+
+    The history keys of a server are rebuilt under a new epoch whenever its
+    history is reset, since positions then refer to other rows.
+
+    Args:
+        server: Server name
+        epoch: Version of the snapshot the history was indexed from (see get_history_index)
+
+    Returns:
+        str: Redis key
+    """
+    return f'history:{epoch}:{server}'
+
+def history_index_key(server, epoch, field, value):
+    """
+    Build the key of the set of a server's history positions with a field value
+
+    Args:
+        server: Server name
+        epoch: Epoch of the history (see history_key)
+        field: One of HISTORY_INDEX_FIELDS
+        value: Field value (a single server name for 'target')
+
+    Returns:
+        str: Redis key
+    """
+    return f'history:{epoch}:{server}:{field}:{value}'
+
+def history_files_key(server, epoch):
+    """
+    Build the key of the lexicographic index of a server's history file names
+
+    Members are 'file|position' with score 0, so the positions of a file
+    name are one ZRANGEBYLEX away.
+
+    Args:
+        server: Server name
+        epoch: Epoch of the history (see history_key)
+
+    Returns:
+        str: Redis key
+    """
+    return f'history:{epoch}:{server}:files'
+
+def history_chunks_key(server, epoch):
+    """
+    Build the key of the hash holding a server's history in columnar chunks
+
+    Fields are chunk numbers, values the msgpack'd encode_columns of
+    HISTORY_CHUNK_ROWS rows, so a page only fetches and decodes the chunks
+    holding its rows.
+
+    Args:
+        server: Server name
+        epoch: Epoch of the history (see history_key)
+
+    Returns:
+        str: Redis key
+    """
+    return f'history:{epoch}:{server}:chunks'
+
+def history_indexes_key(server, epoch):
+    """
+    Build the key of the set listing a server's history index keys
+
+    Args:
+        server: Server name
+        epoch: Epoch of the history (see history_key)
+
+    Returns:
+        str: Redis key
+    """
+    return f'history:{epoch}:{server}:indexes'
+
+def history_index_values(row):
+    """
+    List the indexed (field, value) pairs of a history row
+
+    Args:
+        row: History row
+
+    Returns:
+        list: (field, value) pairs, one per target of a multi-target row
+    """
+    values = [('status', row.get('status') or '')]
+    values.extend(('target', target) for target in split_targets(row.get('target_servers')))
+    return values
+
+def timestamp_score(timestamp):
+    """
+    Convert an exchange timestamp to a sorted set score
+
+    Args:
+        timestamp: Timestamp in TIMESTAMP_FORMAT
+
+    Returns:
+        int: Seconds since the epoch (0 if the timestamp cannot be parsed)
+    """
+    try:
+        return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return 0
+
+def rollup_links_key(direction, server):
+    """
+    Build the key of the sorted set holding one server's links
+
+    Args:
+        direction: 'out' for the files a server sent, 'in' for the files sent to it
+        server: Server name
+
+    Returns:
+        str: Redis key
+    """
+    return f'rollup:links:{direction}:{server}'
+
+def get_current_version(client):
+    """
+    Get the version of the live snapshot
+
+    Args:
+        client: Redis client
+
+    Returns:
+        int: Current version, or None if nothing was published yet
+    """
+    version = client.get(CURRENT_VERSION_KEY)
+    return int(version) if version else None
+
+def get_current_generation(client):
+    """
+    Get the version and the generation id of the live snapshot
+
+    Args:
+        client: Redis client (decoding responses)
+
+    Returns:
+        tuple: (version, generation id), (None, None) if nothing was published yet
+    """
+    version, generation = client.mget(CURRENT_VERSION_KEY, CURRENT_GENERATION_KEY)
+    return (int(version), generation) if version else (None, None)
+
+def get_generation(client, version):
+    """
+    Get the unique id of a snapshot generation
+
+    Unlike versions, generation ids are not reused after Redis lost its data,
+    so they can name what is derived from a snapshot outside of Redis.
+
+    Args:
+        client: Redis client (decoding responses)
+        version: Snapshot version
+
+    Returns:
+        str: Generation id, or None if the generation is not available
+    """
+    return client.hget(snapshot_key(version, 'meta'), 'generation')
+
+def load_registry(client):
+    """
+    Load the server registry
+
+    Args:
+        client: Redis client (decoding responses)
+
+    Returns:
+        list: Server names in id order
+    """
+    ids = client.hgetall(REGISTRY_KEY)
+    return sorted(ids, key=lambda server: int(ids[server]))
+
+def load_snapshot(client):
+    """
+    Load the live snapshot together with its file checkpoints
+
+    Args:
+        client: Redis client returning bytes
+
+    Returns:
+        tuple: (version, exchange_data, checkpoints); data and checkpoints
+               are None when nothing was published yet or the snapshot was
+               stored in an older layout
+    """
+    version = get_current_version(client)
+    if version is None:
+        return None, None, None
+
+    with client.pipeline(transaction=False) as pipe:
+        pipe.get(snapshot_key(version, 'data'))
+        pipe.hgetall(snapshot_key(version, 'servers'))
+        pipe.hgetall(CHECKPOINTS_KEY)
+        with REDIS_SECONDS.labels('load_snapshot').time():
+            data, digests, checkpoints = pipe.execute()
+
+    if not data:
+        return version, None, None
+    data = json.loads(data)
+    if data.get('storage') != STORAGE_FORMAT:
+        return version, None, None
+
+    data['servers'] = {
+        server: unpack_server(payload) for server, payload in _load_payloads(client, digests).items()
+    }
+    return version, data, {
+        server.decode('utf-8'): json.loads(checkpoint) for server, checkpoint in checkpoints.items()
+    }
+
+def _load_payloads(client, digests):
+    """
+    Fetch server payloads in one round-trip
+
+    Args:
+        client: Redis client returning bytes
+        digests: Server names mapped to payload digests, as bytes
+
+    Returns:
+        dict: Server names mapped to their payloads, in name order; servers
+              whose payload expired are left out
+    """
+    servers = sorted(server.decode('utf-8') for server in digests)
+    if not servers:
+        return {}
+    keys = [server_payload_key(server, digests[server.encode('utf-8')].decode('utf-8'))
+            for server in servers]
+    return {
+        server: payload for server, payload in zip(servers, client.mget(keys)) if payload is not None
+    }
+
+def publish_snapshot(client, exchange_data, checkpoints, previous_version=None,
+                     changes=None, removed_servers=(), rollup=None):
+    """
+    Publish a new snapshot generation and make it live atomically
+
+    The whole generation, the checkpoints and the pointer swap are sent as a
+    single MULTI/EXEC pipeline, so readers see either the old or the new
+    generation and the cost is one round-trip regardless of server count.
+    The replaced generation expires after SNAPSHOT_GRACE_SECONDS.
+
+    Per-server rows are stored once, as columnar payloads keyed by their
+    content digest; the JSON document only carries the summaries and
+    aggregates. Payloads whose digest did not change are not written again,
+    and when neither the payloads nor the document changed no generation is
+    published at all, only the checkpoints are updated.
+
+    Args:
+        client: Redis client (decoding responses)
+        exchange_data: Parsed exchange data
+        checkpoints: File checkpoints matching exchange_data
+        previous_version: Version the data was built on (None if unknown)
+        changes: Per-server changes reported by ingest_exchange_data
+        removed_servers: Servers present in the previous snapshot but not in this one
+        rollup: Aggregate changes reported by ingest_exchange_data for the rollup counters
+
+    Returns:
+        int: Version of the live snapshot (previous_version if nothing changed)
+    """
+    version = (previous_version or 0) + 1
+
+    document = slim_snapshot(exchange_data)
+    digest = document_digest(document)
+    server_payloads = {
+        server: pack_server(data) for server, data in exchange_data['servers'].items()
+    }
+    digests = {server: content_digest(payload) for server, payload in server_payloads.items()}
+
+    # What the previous generation was made of
+    with client.pipeline(transaction=False) as pipe:
+        pipe.get(ROLLUP_VERSION_KEY)
+        if previous_version:
+            pipe.hmget(snapshot_key(previous_version, 'meta'), 'digest', 'summary')
+            pipe.hgetall(snapshot_key(previous_version, 'histories'))
+        results = pipe.execute()
+    rollup_version = results[0]
+    previous_digest, previous_summary = results[1] if previous_version else (None, None)
+    previous_epochs = {
+        server: int(value.split(':')[0]) for server, value in (results[2] if previous_version else {}).items()
+    }
+
+    # Histories that are reset or new are indexed under a new epoch, the
+    # replaced epochs age out with the previous generation
+    epochs = {
+        server: previous_epochs[server]
+        if server in previous_epochs and not (changes or {}).get(server, {}).get('history_reset')
+        else version
+        for server in exchange_data['servers']
+    }
+    replaced = {
+        server: epoch for server, epoch in previous_epochs.items() if epochs.get(server) != epoch
+    }
+
+    # Generations stored in an older layout have no digests to compare with
+    with client.pipeline(transaction=False) as pipe:
+        if previous_digest:
+            pipe.hgetall(snapshot_key(previous_version, 'servers'))
+        for server, epoch in sorted(replaced.items()):
+            pipe.smembers(history_indexes_key(server, epoch))
+        results = pipe.execute()
+    previous_digests = results.pop(0) if previous_digest else {}
+    stale_indexes = {
+        server: (epoch, index_keys) for (server, epoch), index_keys in zip(sorted(replaced.items()), results)
+    }
+
+    changed = sorted(server for server in digests if previous_digests.get(server) != digests[server])
+    SERVER_WRITES.labels('written').inc(len(changed))
+    SERVER_WRITES.labels('unchanged').inc(len(digests) - len(changed))
+
+    rollup_stale = rollup is not None and rollup['rebuild'] and rollup_version != str(previous_version)
+    if previous_digest == digest and not changed and not removed_servers and not rollup_stale:
+        # Nothing changed: keep the live generation and only follow the files
+        with client.pipeline(transaction=True) as pipe:
+            queue_checkpoints(pipe, checkpoints)
+            with REDIS_SECONDS.labels('publish_snapshot').time():
+                pipe.execute()
+        return previous_version
+
+    with client.pipeline(transaction=True) as pipe:
+        # Start from a clean generation in case a failed publish left keys behind
+        pipe.delete(*[snapshot_key(version, name) for name in SNAPSHOT_KEYS])
+
+        # Store the document pre-serialized and pre-compressed
+        for encoding, payload in encode_payload(document).items():
+            pipe.set(snapshot_key(version, payload_field('data', encoding)), payload)
+            PAYLOAD_BYTES.labels(payload_field('document', encoding)).observe(len(payload))
+
+        # Write the payloads that changed, the previous ones age out with the
+        # previous generation
+        for server in changed:
+            payload = server_payloads[server]
+            pipe.set(server_payload_key(server, digests[server]), payload)
+            PAYLOAD_BYTES.labels('server').observe(len(payload))
+        for server in changed + sorted(removed_servers):
+            if previous_digests.get(server):
+                pipe.expire(server_payload_key(server, previous_digests[server]), SNAPSHOT_GRACE_SECONDS)
+        if digests:
+            pipe.hset(snapshot_key(version, 'servers'), mapping=digests)
+            pipe.hset(snapshot_key(version, 'histories'), mapping={
+                server: f"{epochs[server]}:{len(data['history'])}"
+                for server, data in exchange_data['servers'].items()
+            })
+        last_update = int(time.time())
+        generation = uuid.uuid4().hex
+        pipe.hset(snapshot_key(version, 'meta'), mapping={
+            'last_update': last_update,
+            'generation': generation,
+            'digest': digest,
+            'summary': json.dumps(exchange_data['summary'])
+        })
+
+        registry = exchange_data.get('registry')
+        if registry:
+            pipe.hset(REGISTRY_KEY, mapping={server: index for index, server in enumerate(registry)})
+
+        reindexed = {server for server, epoch in epochs.items() if epoch == version}
+        queue_history_updates(pipe, exchange_data['servers'], changes or {}, epochs, reindexed,
+                              stale_indexes)
+        if rollup is not None:
+            queue_rollup_updates(pipe, rollup, exchange_data, changes, removed_servers)
+            pipe.set(ROLLUP_VERSION_KEY, version)
+
+        queue_checkpoints(pipe, checkpoints)
+
+        # Log what changed for delta syncs, dropping the oldest version
+        previous_summary = json.loads(previous_summary) if previous_summary else None
+        entry = build_change_entry(version, generation, exchange_data, changed, removed_servers, rollup,
+                                   previous_summary)
+        pipe.hset(CHANGELOG_KEY, version, json.dumps(entry))
+        if version > CHANGELOG_VERSIONS:
+            pipe.hdel(CHANGELOG_KEY, version - CHANGELOG_VERSIONS)
+
+        # Swap the pointer, announce the new generation and let the old one age out
+        pipe.set(CURRENT_VERSION_KEY, version)
+        pipe.set(CURRENT_GENERATION_KEY, generation)
+        pipe.publish(EVENTS_CHANNEL, json.dumps({**entry, 'last_update': last_update}))
+        if previous_version:
+            for name in SNAPSHOT_KEYS:
+                pipe.expire(snapshot_key(previous_version, name), SNAPSHOT_GRACE_SECONDS)
+
+        with REDIS_SECONDS.labels('publish_snapshot').time():
+            pipe.execute()
+
+    return version
+
+def queue_checkpoints(pipe, checkpoints):
+    """
+    Queue the replacement of the stored file checkpoints
+
+    Args:
+        pipe: Redis pipeline to queue the commands on
+        checkpoints: File checkpoints per server
+    """
+    pipe.delete(CHECKPOINTS_KEY)
+    if checkpoints:
+        pipe.hset(CHECKPOINTS_KEY, mapping={
+            server: json.dumps(checkpoint) for server, checkpoint in checkpoints.items()
+        })
+
+def build_change_entry(version, generation, exchange_data, changed, removed_servers, rollup,
+                       previous_summary):
+    """
+    Build the changelog entry of a snapshot: what changed since the previous version
+
+    Matrix cells are taken from the link changes of the rollup; an entry
+    built from a rollup rebuild, or without a previous summary, is flagged
+    as full since it cannot be applied on top of the previous version.
+
+    Args:
+        version: Version of the published snapshot
+        generation: Generation id of the published snapshot
+        exchange_data: Parsed exchange data
+        changed: Servers whose payload changed
+        removed_servers: Servers dropped from the snapshot
+        rollup: Aggregate changes reported by ingest_exchange_data (None if unknown)
+        previous_summary: Global summary of the previous version (None if unknown)
+
+    Returns:
+        dict: Changelog entry
+    """
+    servers = exchange_data['servers']
+    summary = exchange_data['summary']
+    matrix = exchange_data.get('connection_matrix') or {'servers': [], 'links': []}
+    full = rollup is None or rollup['rebuild'] or previous_summary is None
+
+    cells = []
+    if not full:
+        ids = {server: index for index, server in enumerate(matrix['servers'])}
+        counts = {(source, target): count for source, target, count in matrix['links']}
+        changed_cells = sorted({
+            (ids[source], ids[target])
+            for source, targets in rollup['links'].items()
+            for target, count in targets.items() if count
+        })
+        cells = [[source, target, counts.get((source, target), 0)] for source, target in changed_cells]
+
+    time_series = exchange_data.get('time_series', {})
+    return {
+        'version': version,
+        'generation': generation,
+        'full': full,
+        'summary': {
+            field: value for field, value in summary.items()
+            if full or previous_summary.get(field) != value
+        },
+        'servers': {
+            server: {'ip': servers[server]['ip'], 'summary': servers[server]['summary']}
+            for server in changed
+        },
+        'removed': sorted(removed_servers),
+        'time_series': {
+            kind: {server: series[server] for server in changed if server in series}
+            for kind, series in time_series.items()
+        },
+        'registry': matrix['servers'],
+        'cells': cells,
+        'recent_exchanges': exchange_data.get('recent_exchanges', [])
+    }
+
+def get_changes_since(client, since_version, since_generation, version=None):
+    """
+    Merge the changelog entries of the snapshots published after a version
+
+    The version the caller has is identified by its number and its
+    generation id: versions restart at 1 when Redis loses its data, so a
+    known number alone may belong to another line of snapshots.
+
+    Args:
+        client: Redis client (decoding responses)
+        since_version: Version the caller already has
+        since_generation: Generation id of that version
+        version: Snapshot version to bring it to (defaults to the live one)
+
+    Returns:
+        dict: Changed global summary fields, servers (IP and summary), time
+              series and matrix cells, removed servers and the recent
+              exchanges; None when the changes cannot be replayed (the version
+              is unknown, of another generation, older than the changelog or
+              followed by a full rebuild)
+    """
+    version = version or get_current_version(client)
+    if version is None or not version - CHANGELOG_VERSIONS < since_version <= version:
+        return None
+
+    # The entry of the caller's version is read to check its generation
+    entries = client.hmget(CHANGELOG_KEY, list(range(since_version, version + 1)))
+    if not all(entries):
+        return None
+    entries = [json.loads(entry) for entry in entries]
+    since_entry, entries = entries[0], entries[1:]
+    if since_entry.get('generation') != since_generation:
+        return None
+    if any(entry['full'] for entry in entries):
+        return None
+
+    delta = {
+        'version': version,
+        'since_version': since_version,
+        'summary': {},
+        'servers': {},
+        'removed': [],
+        'time_series': {},
+        'connection_matrix': {'servers': [], 'links': []},
+        'recent_exchanges': []
+    }
+    removed = set()
+    cells = {}
+    for entry in entries:
+        delta['summary'].update(entry['summary'])
+        delta['servers'].update(entry['servers'])
+        removed.difference_update(entry['servers'])
+        removed.update(entry['removed'])
+        for server in entry['removed']:
+            delta['servers'].pop(server, None)
+        for kind, series in entry['time_series'].items():
+            delta['time_series'].setdefault(kind, {}).update(series)
+        cells.update(((source, target), count) for source, target, count in entry['cells'])
+
+    # With nothing published since, the registry and recent exchanges are the caller's
+    last = entries[-1] if entries else since_entry
+    for series in delta['time_series'].values():
+        for server in removed:
+            series.pop(server, None)
+    delta['removed'] = sorted(removed)
+    delta['connection_matrix'] = {
+        'servers': last['registry'],
+        'links': [[source, target, count] for (source, target), count in sorted(cells.items())]
+    }
+    delta['recent_exchanges'] = last['recent_exchanges']
+    return delta
+
+def listen_snapshot_events(client, timeout=15):
+    """
+    Subscribe to snapshot events
+
+    Events are the changelog entries of the published versions (see
+    build_change_entry) with their publish time as last_update. The
+    subscription is active when this returns, so a version read afterwards
+    cannot miss an event.
+
+    Args:
+        client: Redis client (decoding responses)
+        timeout: Seconds to wait for an event before yielding None
+
+    Returns:
+        Generator yielding event dicts, or None when nothing arrived within
+        timeout (so callers can send keep-alives)
+    """
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(EVENTS_CHANNEL)
+    return _iter_events(pubsub, timeout)
+
+def _iter_events(pubsub, timeout):
+    """Yield the events received on a subscription until closed"""
+    try:
+        while True:
+            message = pubsub.get_message(timeout=timeout)
+            if message is None:
+                yield None
+            elif message['type'] == 'message':
+                yield json.loads(message['data'])
+    finally:
+        pubsub.close()
+
+def rollup_key(kind, resolution):
+    """
+    Build the key of a time bucket rollup hash
+
+    Args:
+        kind: One of ROLLUP_KINDS
+        resolution: One of ROLLUP_RESOLUTIONS
+
+    Returns:
+        str: Redis key
+    """
+    return f'rollup:{kind}:{resolution}'
+
+def rollups_current(client, version):
+    """
+    Check whether the rollup counters were last updated with a snapshot
+
+    Args:
+        client: Redis client
+        version: Snapshot version
+
+    Returns:
+        bool: True if the counters can be patched with a delta on top of version
+    """
+    rollup_version = client.get(ROLLUP_VERSION_KEY)
+    return version is not None and rollup_version is not None and int(rollup_version) == version
+
+def queue_rollup_updates(pipe, rollup, exchange_data, changes=None, removed_servers=()):
+    """
+    Queue the rollup counter updates for a set of aggregate changes
+
+    Bucket counters are adjusted with HINCRBY and link counters with ZINCRBY
+    (file counts globally and per source and target server, byte volumes
+    globally), so the cost is proportional
+    to the rows added or withdrawn; per-server summaries are rewritten for the
+    changed servers only, and the IP addresses of every server, as they can
+    change with the configuration alone.
+
+    Args:
+        pipe: Redis pipeline to queue the commands on
+        rollup: Aggregate changes from ingest_exchange_data
+        exchange_data: Parsed exchange data
+        changes: Per-server changes reported by ingest_exchange_data (None if unknown)
+        removed_servers: Servers dropped from the snapshot
+    """
+    servers = exchange_data['servers']
+    if rollup['rebuild']:
+        pipe.delete(ROLLUP_SUMMARY_KEY, ROLLUP_SERVERS_KEY, ROLLUP_LINKS_KEY, ROLLUP_LINK_BYTES_KEY,
+                    *[rollup_key(kind, resolution)
+                      for kind in ROLLUP_KINDS for resolution in ROLLUP_RESOLUTIONS],
+                    *[rollup_links_key(direction, server)
+                      for direction in ('out', 'in')
+                      for server in set(exchange_data.get('registry', [])) | set(rollup['links'])])
+        changed = list(servers)
+    elif changes is None:
+        changed = list(servers)
+    else:
+        changed = [server for server, change in changes.items()
+                   if change['history_reset'] or change['new_history'] or change['received_changed']]
+
+    for kind in ROLLUP_KINDS:
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = rollup_key(kind, resolution)
+            for server, buckets in rollup[kind][resolution].items():
+                for bucket, count in buckets.items():
+                    if count:
+                        pipe.hincrby(key, f'{server}|{bucket}', count)
+
+    link_keys = set()
+    for source, targets in rollup['links'].items():
+        for target, count in targets.items():
+            if count:
+                pipe.zincrby(ROLLUP_LINKS_KEY, count, f'{source}|{target}')
+                pipe.zincrby(rollup_links_key('out', source), count, target)
+                pipe.zincrby(rollup_links_key('in', target), count, source)
+                link_keys.update((rollup_links_key('out', source), rollup_links_key('in', target)))
+    for source, targets in rollup['link_bytes'].items():
+        for target, size in targets.items():
+            if size:
+                pipe.zincrby(ROLLUP_LINK_BYTES_KEY, size, f'{source}|{target}')
+
+    # Links whose files were all withdrawn disappear
+    for key in sorted(link_keys | {ROLLUP_LINKS_KEY, ROLLUP_LINK_BYTES_KEY}):
+        pipe.zremrangebyscore(key, '-inf', 0)
+
+    server_fields = {f'{server}|ip': server_data['ip'] for server, server_data in servers.items()}
+    for server in changed:
+        summary = servers[server]['summary']
+        server_fields[f'{server}|total_sent'] = summary['total_sent']
+        server_fields[f'{server}|total_received'] = summary['total_received']
+        server_fields[f'{server}|bytes_received'] = summary['bytes_received']
+        server_fields[f'{server}|last_exchange'] = summary['last_exchange'] or ''
+    if server_fields:
+        pipe.hset(ROLLUP_SERVERS_KEY, mapping=server_fields)
+    for server in removed_servers:
+        pipe.hdel(ROLLUP_SERVERS_KEY, *[f'{server}|{field}' for field in
+                                        ('ip', 'total_sent', 'total_received', 'bytes_received',
+                                         'last_exchange')])
+
+    summary = exchange_data['summary']
+    pipe.hset(ROLLUP_SUMMARY_KEY, mapping={
+        'total_files_sent': summary['total_files_sent'],
+        'total_files_received': summary['total_files_received'],
+        'total_bytes_received': summary['total_bytes_received'],
+        'total_exchanges': summary['total_exchanges'],
+        'last_updated': summary['last_updated']
+    })
+
+def get_rollup_summary(client):
+    """
+    Read the global and per-server summary from the rollup counters
+
+    Args:
+        client: Redis client (decoding responses)
+
+    Returns:
+        dict: {'summary': {...}, 'servers': {server: {'ip': ..., 'summary': {...}}}}
+    """
+    with client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(ROLLUP_SUMMARY_KEY)
+        pipe.hgetall(ROLLUP_SERVERS_KEY)
+        summary, server_fields = pipe.execute()
+
+    servers = {}
+    for field, value in server_fields.items():
+        server, name = field.rsplit('|', 1)
+        entry = servers.setdefault(server, {'ip': None, 'summary': {}})
+        if name == 'ip':
+            entry['ip'] = value
+        elif name == 'last_exchange':
+            entry['summary'][name] = value or None
+        else:
+            entry['summary'][name] = int(value)
+
+    return {
+        'summary': {
+            name: value if name == 'last_updated' else int(value)
+            for name, value in summary.items()
+        },
+        'servers': servers
+    }
+
+def get_rollup_time_series(client, resolution):
+    """
+    Read sent/received counts per server and bucket from the rollup counters
+
+    Args:
+        client: Redis client (decoding responses)
+        resolution: One of ROLLUP_RESOLUTIONS, or 'week' (summed from days)
+
+    Returns:
+        dict: {'sent': {server: {bucket: count}}, 'received': {...}}
+    """
+    source_resolution = 'day' if resolution == 'week' else resolution
+    with client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(rollup_key('sent', source_resolution))
+        pipe.hgetall(rollup_key('received', source_resolution))
+        pipe.hkeys(ROLLUP_SERVERS_KEY)
+        sent, received, server_fields = pipe.execute()
+
+    servers = {field.rsplit('|', 1)[0] for field in server_fields}
+    time_series = {}
+    for kind, counters in (('sent', sent), ('received', received)):
+        series = {server: {} for server in servers}
+        for field, count in counters.items():
+            server, bucket = field.split('|', 1)
+            count = int(count)
+            if count <= 0 or server not in series:
+                continue
+            if resolution == 'week':
+                day = datetime.strptime(bucket, '%Y-%m-%d')
+                bucket = (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+            series[server][bucket] = series[server].get(bucket, 0) + count
+        time_series[kind] = series
+
+    return time_series
+
+def get_rollup_volume(client, resolution, server=None, limit=None):
+    """
+    Read the byte volumes and throughput per server and link from the rollup counters
+
+    Volumes come from the sizes listed in received_summary.txt: a received
+    file counts as bytes received by its server and bytes sent by its source.
+
+    Args:
+        client: Redis client (decoding responses)
+        resolution: One of ROLLUP_RESOLUTIONS, or 'week' (summed from days)
+        server: Optional server name to restrict the volumes to
+        limit: Optional maximum number of links, heaviest first
+
+    Returns:
+        dict: {'servers': {server: {'bytes_sent': ..., 'bytes_received': ...}},
+               'links': [(source, target, bytes)],
+               'throughput': {'sent': {server: {bucket: bytes per hour}}, 'received': {...}}}
+    """
+    source_resolution = 'day' if resolution == 'week' else resolution
+    # The whole set is filtered when restricted to one server
+    end = -1 if limit is None or server else limit - 1
+    with client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(rollup_key('sent_bytes', source_resolution))
+        pipe.hgetall(rollup_key('received_bytes', source_resolution))
+        pipe.zrevrange(ROLLUP_LINK_BYTES_KEY, 0, end, withscores=True)
+        sent, received, link_bytes = pipe.execute()
+
+    servers = {}
+    throughput = {}
+    for kind, counters in (('sent', sent), ('received', received)):
+        series = {}
+        for field, size in counters.items():
+            name, bucket = field.split('|', 1)
+            size = int(size)
+            if size <= 0 or (server and name != server):
+                continue
+            if resolution == 'week':
+                day = datetime.strptime(bucket, '%Y-%m-%d')
+                bucket = (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+            buckets = series.setdefault(name, {})
+            buckets[bucket] = buckets.get(bucket, 0) + size
+            totals = servers.setdefault(name, {'bytes_sent': 0, 'bytes_received': 0})
+            totals[f'bytes_{kind}'] += size
+        throughput[kind] = {
+            name: {bucket: size / BUCKET_HOURS[resolution] for bucket, size in sorted(buckets.items())}
+            for name, buckets in series.items()
+        }
+
+    links = []
+    for member, size in link_bytes:
+        source, target = member.split('|', 1)
+        if server and server not in (source, target):
+            continue
+        links.append((source, target, int(size)))
+    if limit is not None:
+        links = links[:limit]
+
+    return {'servers': servers, 'links': links, 'throughput': throughput}
+
+def get_top_links(client, limit):
+    """
+    Read the links that carried the most files
+
+    Args:
+        client: Redis client (decoding responses)
+        limit: Maximum number of links to return
+
+    Returns:
+        list: (source, target, count) tuples, heaviest first
+    """
+    links = []
+    for member, count in client.zrevrange(ROLLUP_LINKS_KEY, 0, limit - 1, withscores=True):
+        source, target = member.split('|', 1)
+        links.append((source, target, int(count)))
+    return links
+
+def get_server_links(client, server, limit=None):
+    """
+    Read one server's row (files it sent) and column (files sent to it)
+
+    Args:
+        client: Redis client (decoding responses)
+        server: Server name
+        limit: Optional maximum number of links per direction, heaviest first
+
+    Returns:
+        dict: {'outgoing': {target: count}, 'incoming': {source: count}}
+    """
+    end = -1 if limit is None else limit - 1
+    with client.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(rollup_links_key('out', server), 0, end, withscores=True)
+        pipe.zrevrange(rollup_links_key('in', server), 0, end, withscores=True)
+        outgoing, incoming = pipe.execute()
+
+    return {
+        'outgoing': {target: int(count) for target, count in outgoing},
+        'incoming': {source: int(count) for source, count in incoming}
+    }
+
+def queue_history_updates(pipe, servers, changes, epochs, reindexed=(), stale_indexes=None):
+    """
+    Queue the history sorted set and secondary index updates for newly ingested rows
+
+    The sorted sets are a time index over the columnar history: members are
+    row positions in the stored history and scores the exchange timestamps.
+    The rows themselves are stored in chunks (see history_chunks_key); the
+    chunks holding new rows are rewritten, the others left as they are.
+    The secondary indexes hold the same positions per status and target
+    value, plus a lexicographic index of file names, so that queries can
+    intersect them with the time index (see query_history).
+
+    Rows are appended to the keys of the server's epoch; a history indexed
+    under a new epoch is written in full, and the keys of the epoch it
+    replaces expire after SNAPSHOT_GRACE_SECONDS, like the generations still
+    reading them.
+
+    Args:
+        pipe: Redis pipeline to queue the commands on
+        servers: Per-server data of the new snapshot
+        changes: Per-server changes reported by ingest_exchange_data
+        epochs: History epoch of every server of the new snapshot
+        reindexed: Servers whose history is indexed under a new epoch
+        stale_indexes: Servers whose history epoch was replaced or dropped,
+                       mapped to (epoch, index keys), read before the transaction
+    """
+    for server, (epoch, index_keys) in (stale_indexes or {}).items():
+        for key in (history_key(server, epoch), history_files_key(server, epoch),
+                    history_chunks_key(server, epoch), history_indexes_key(server, epoch), *index_keys):
+            pipe.expire(key, SNAPSHOT_GRACE_SECONDS)
+
+    for server in sorted(set(changes) | set(reindexed)):
+        history = servers[server]['history']
+        epoch = epochs[server]
+        start = 0 if server in reindexed else len(history) - changes[server]['new_history']
+
+        members = {}
+        files = {}
+        indexes = {}
+        for seq in range(start, len(history)):
+            row = history[seq]
+            members[seq] = timestamp_score(row.get('timestamp'))
+            files[f"{row.get('file') or ''}|{seq}"] = 0
+            for field, value in history_index_values(row):
+                indexes.setdefault(history_index_key(server, epoch, field, value), []).append(seq)
+        if members:
+            pipe.zadd(history_key(server, epoch), members)
+            pipe.zadd(history_files_key(server, epoch), files)
+            pipe.hset(history_chunks_key(server, epoch), mapping={
+                chunk: msgpack.packb(encode_columns(
+                    history[chunk * HISTORY_CHUNK_ROWS:(chunk + 1) * HISTORY_CHUNK_ROWS]), use_bin_type=True)
+                for chunk in range(start // HISTORY_CHUNK_ROWS, (len(history) - 1) // HISTORY_CHUNK_ROWS + 1)
+            })
+        for key, positions in indexes.items():
+            pipe.sadd(key, *positions)
+        if indexes:
+            pipe.sadd(history_indexes_key(server, epoch), *indexes)
+
+def get_history_page(client, server, start=None, end=None, limit=100, cursor=None, reverse=False,
+                     chunks=None, archive=None, version=None):
+    """
+    Read one page of a server's history in timestamp order
+
+    Pages continue from a (score, skip) cursor and only the history chunks
+    holding the page's rows are read, so each page costs O(log n + page
+    size) however deep into the history it is.
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        start: Optional minimum timestamp score (inclusive)
+        end: Optional maximum timestamp score (inclusive)
+        limit: Maximum number of rows to return
+        cursor: Optional cursor returned for the previous page
+        reverse: Return the most recent rows first
+        chunks: Optional dict of decoded history chunks, kept between the
+                pages of one iteration to avoid reloading them
+        archive: Optional archived history of the server (see
+                 archive.open_history), merged into the pages
+        version: Snapshot version to read the rows from (defaults to the live one)
+
+    Returns:
+        tuple: (rows, cursor for the next page or None)
+    """
+    version = version or get_current_version(client)
+    index = get_history_index(client, server, version) if version is not None else None
+
+    low = '-inf' if start is None else start
+    high = '+inf' if end is None else end
+    skip = 0
+    if cursor:
+        # Resume at the last score seen, skipping the rows already returned
+        score, skip = cursor
+        if reverse:
+            high = score
+        else:
+            low = score
+
+    if archive is None:
+        entries = _live_entries(client, server, index, None, low, high, limit + 1, reverse,
+                                chunks, version, skip)
+        page = entries[:limit]
+        rows = [row for _, row in page]
+        scores = [score for score, _ in page]
+        more = len(entries) > limit
+    else:
+        rows, scores, more = _merge_archived_page(client, server, index, archive, low, high, skip,
+                                                  limit, reverse, chunks, version)
+
+    return rows, _next_cursor(scores, more, cursor)
+
+def _next_cursor(scores, more, cursor):
+    """
+    Build the cursor of the page after one ending with the given scores
+
+    Returns:
+        tuple: (last score, rows with that score returned so far), or None
+               on the last page
+    """
+    if not more:
+        return None
+    last_score = scores[-1]
+    same_score = sum(1 for score in scores if score == last_score)
+    if cursor and cursor[0] == last_score:
+        same_score += cursor[1]
+    return (int(last_score), same_score)
+
+def _merge_archived_page(client, server, index, archive, low, high, skip, limit, reverse, chunks,
+                         version):
+    """
+    Read one page of the history and the archived rows merged in timestamp order
+
+    Both sources are read from the cursor score and the rows already returned
+    are skipped in the merged order, archived rows first among equal scores.
+    The archive is only read for the part of the range the live rows do not
+    fill, so pages within the retention window never touch it.
+
+    Returns:
+        tuple: (rows, their scores, whether more rows follow)
+    """
+    fetch = skip + limit + 1
+    live = _live_entries(client, server, index, None, low, high, fetch, reverse, chunks, version)
+    archived = _archived_entries(archive, low, high, live, fetch, reverse)
+    return _merge_page([archived, live], skip, limit, reverse)
+
+def _live_entries(client, server, index, key, low, high, fetch, reverse, chunks=None, version=None,
+                  skip=0):
+    """
+    Read the first rows of a sorted set of history positions within a score range
+
+    Positions past the history length of the version being read belong to
+    rows appended by later snapshots and are left out.
+
+    Args:
+        index: (epoch, length) of the server's history (see get_history_index), or None
+        key: Sorted set of positions to read (defaults to the time index of the epoch)
+        chunks: Optional dict of decoded history chunks to reuse (see _history_rows)
+
+    Returns:
+        list: Up to fetch (score, row) pairs in timestamp order, after the first skip ones
+    """
+    if index is None:
+        return []
+    epoch, length = index
+    key = key or history_key(server, epoch)
+
+    count = skip + fetch
+    while True:
+        if reverse:
+            members = client.zrevrangebyscore(key, high, low, start=0, num=count, withscores=True)
+        else:
+            members = client.zrangebyscore(key, low, high, start=0, num=count, withscores=True)
+        entries = [(score, int(member)) for member, score in members if int(member) < length]
+        if len(entries) >= skip + fetch or len(members) < count:
+            break
+        count += skip + fetch - len(entries)
+
+    entries = entries[skip:skip + fetch]
+    if not entries:
+        return []
+    rows = _history_rows(client, server, epoch, [position for _, position in entries], version, chunks)
+    return list(zip([score for score, _ in entries], rows))
+
+def _history_rows(client, server, epoch, positions, version, chunks=None):
+    """
+    Decode history rows by position, fetching only the chunks holding them
+
+    Args:
+        chunks: Optional dict of decoded chunks by number; the chunks needed
+                are added to it and the others dropped, so that it holds at
+                most one page's worth when reused across pages
+
+    Returns:
+        list: Rows in the order of positions (empty if the history is gone)
+    """
+    chunks = {} if chunks is None else chunks
+    grouped = {}
+    for position in positions:
+        chunk, offset = divmod(position, HISTORY_CHUNK_ROWS)
+        grouped.setdefault(chunk, []).append((position, offset))
+    for chunk in list(chunks):
+        if chunk not in grouped:
+            del chunks[chunk]
+
+    missing = [chunk for chunk in grouped if chunk not in chunks]
+    if missing:
+        payloads = client.hmget(history_chunks_key(server, epoch), missing)
+        if not all(payloads):
+            # Histories indexed before they were chunked
+            history = get_history_columns(client, server, version)
+            return decode_rows(history, positions) if history else []
+        chunks.update((chunk, msgpack.unpackb(payload, raw=False)) for chunk, payload in zip(missing, payloads))
+
+    rows = {}
+    for chunk, members in grouped.items():
+        rows.update(zip([position for position, _ in members],
+                        decode_rows(chunks[chunk], [offset for _, offset in members])))
+    return [rows[position] for position in positions]
+
+def _archived_entries(archive, low, high, live, fetch, reverse, predicate=None, status=None,
+                      target=None):
+    """
+    Iterate over the archived rows that can make it into a page with the live rows
+
+    Archived rows past the last live row fetched cannot, so when the live rows
+    fill the page the archive is only read up to that row, if at all. Segments
+    without rows of the status or target filtered on are not read.
+
+    Returns:
+        Iterator of (score, row) pairs in timestamp order
+    """
+    if archive is None:
+        return iter(())
+
+    start = None if low == '-inf' else low
+    end = None if high == '+inf' else high
+    if len(live) == fetch:
+        if reverse:
+            start = live[-1][0]
+        else:
+            end = live[-1][0]
+
+    if (start is not None and archive.last < start) or (end is not None and archive.first > end):
+        return iter(())
+    entries = archive.iter_rows(start, end, reverse, status, target)
+    if predicate is None:
+        return entries
+    return (entry for entry in entries if predicate(entry[1]))
+
+def _merge_page(sources, skip, limit, reverse):
+    """
+    Merge (score, row) sources into one page, earlier sources first among equal scores
+
+    Returns:
+        tuple: (rows, their scores, whether more rows follow)
+    """
+    merged = heapq.merge(*sources, key=lambda entry: entry[0], reverse=reverse)
+    entries = list(islice(merged, skip, skip + limit + 1))
+    page = entries[:limit]
+    return [row for _, row in page], [score for score, _ in page], len(entries) > limit
+
+def query_history(client, servers, status=None, target=None, file=None, start=None, end=None,
+                  limit=100, cursor=None, reverse=False, archives=None):
+    """
+    Read one page of the history rows of several servers matching filters
+
+    For each server the time index is intersected (ZINTERSTORE) with the
+    index sets of the filters, so the cost follows the number of matches
+    rather than the history size; the intersection is cached with the
+    snapshot version for the following pages. Rows of the servers are merged
+    in timestamp order and paged with the same cursors as get_history_page.
+
+    Args:
+        client: Redis client returning bytes
+        servers: Names of the servers whose rows to query (the sources)
+        status: Optional status the rows must have
+        target: Optional server that must be one of the row's targets
+        file: Optional file name the rows must have
+        start: Optional minimum timestamp score (inclusive)
+        end: Optional maximum timestamp score (inclusive)
+        limit: Maximum number of rows to return
+        cursor: Optional cursor returned for the previous page
+        reverse: Return the most recent rows first
+        archives: Optional archived histories per server (see
+                  archive.open_history); archived rows are not indexed, the
+                  segments within the range that hold rows of the status and
+                  target filtered on are scanned
+
+    Returns:
+        tuple: (rows tagged with their server as 'source', cursor for the next page or None)
+    """
+    version = get_current_version(client)
+    if version is None:
+        return [], None
+
+    low = '-inf' if start is None else start
+    high = '+inf' if end is None else end
+    skip = 0
+    if cursor:
+        score, skip = cursor
+        if reverse:
+            high = score
+        else:
+            low = score
+
+    def matches(row):
+        return ((status is None or row.get('status') == status)
+                and (target is None or target in split_targets(row.get('target_servers')))
+                and (file is None or row.get('file') == file))
+
+    fetch = skip + limit + 1
+    sources = []
+    for server in sorted(servers):
+        index = get_history_index(client, server, version)
+        key = _query_key(client, version, server, index[0], status, target, file) if index else None
+        live = _live_entries(client, server, index, key, low, high, fetch, reverse, version=version)
+        archived = _archived_entries((archives or {}).get(server), low, high, live, fetch, reverse, matches,
+                                     status, target)
+        sources.extend((_tag_source(archived, server), _tag_source(live, server)))
+
+    rows, scores, more = _merge_page(sources, skip, limit, reverse)
+    return rows, _next_cursor(scores, more, cursor)
+
+def _tag_source(entries, server):
+    """Add the server a history row comes from to (score, row) pairs"""
+    for score, row in entries:
+        yield score, {**row, 'source': server}
+
+def _query_key(client, version, server, epoch, status, target, file):
+    """
+    Get the sorted set of a server's history positions matching filters
+
+    Returns:
+        str: The time index itself without filters, otherwise the key of the
+             cached intersection, built if needed
+    """
+    filters = [history_index_key(server, epoch, field, value)
+               for field, value in (('status', status), ('target', target)) if value is not None]
+    if not filters and file is None:
+        return history_key(server, epoch)
+
+    key = f'query:{version}:{server}:{json.dumps([status, target, file])}'
+    # Redis drops empty sorted sets, so an empty intersection is cached as a marker
+    empty_key = f'{key}:empty'
+    with client.pipeline(transaction=False) as pipe:
+        pipe.expire(key, QUERY_CACHE_SECONDS)
+        pipe.expire(empty_key, QUERY_CACHE_SECONDS)
+        if any(pipe.execute()):
+            return key
+
+    if file is not None:
+        # Collect the positions of the file name into a temporary set; the
+        # range also holds longer names continuing with '|', told apart by
+        # the name before the last separator
+        members = client.zrangebylex(history_files_key(server, epoch), f'[{file}|', f'[{file}|\xff')
+        file_name = file.encode()
+        positions = [seq for prefix, seq in (member.rsplit(b'|', 1) for member in members) if prefix == file_name]
+        if not positions:
+            client.set(empty_key, 1, ex=QUERY_CACHE_SECONDS)
+            return key
+        files_key = f'{key}:files'
+        filters.append(files_key)
+        with client.pipeline(transaction=True) as pipe:
+            pipe.delete(files_key)
+            pipe.sadd(files_key, *positions)
+            pipe.expire(files_key, QUERY_CACHE_SECONDS)
+            pipe.execute()
+
+    # Sets count as score 1; weight 0 keeps the timestamps of the time index
+    with client.pipeline(transaction=True) as pipe:
+        pipe.zinterstore(key, {history_key(server, epoch): 1, **{name: 0 for name in filters}})
+        pipe.expire(key, QUERY_CACHE_SECONDS)
+        matched = pipe.execute()[0]
+    if not matched:
+        client.set(empty_key, 1, ex=QUERY_CACHE_SECONDS)
+    return key
+
+def get_history_index(client, server, version):
+    """
+    Get where the history of a server in a snapshot is indexed
+
+    Args:
+        client: Redis client
+        server: Server name
+        version: Snapshot version
+
+    Returns:
+        tuple: (epoch of the history keys, number of rows in the version),
+               or None if the server is not in the snapshot
+    """
+    value = client.hget(snapshot_key(version, 'histories'), server)
+    if not value:
+        return None
+    epoch, length = (value.decode('utf-8') if isinstance(value, bytes) else value).split(':')
+    return int(epoch), int(length)
+
+def get_history_columns(client, server, version=None):
+    """
+    Get the encoded history columns of a server, out of its whole payload
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        dict: Result of encode_columns for the history, or None if not available
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+    payload = get_packed_server(client, server, version)
+    return msgpack.unpackb(payload, raw=False)['history'] if payload else None
+
+def iter_history(client, server, start=None, end=None, page_size=1000, version=None, archive=None):
+    """
+    Iterate over a server's history in timestamp order, one page at a time
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        start: Optional minimum timestamp score (inclusive)
+        end: Optional maximum timestamp score (inclusive)
+        page_size: Rows fetched per round-trip
+        version: Snapshot version to read the rows from (defaults to the live one)
+        archive: Optional archived history of the server, read where the range needs it
+
+    Returns:
+        Generator yielding history rows
+    """
+    version = version or get_current_version(client)
+    if version is None and archive is None:
+        return
+
+    chunks = {}
+    cursor = None
+    while True:
+        rows, cursor = get_history_page(client, server, start, end, page_size, cursor,
+                                        chunks=chunks, archive=archive, version=version)
+        yield from rows
+        if not cursor:
+            break
+
+def get_server_names(client, version=None):
+    """
+    Get the names of the servers in a snapshot
+
+    Args:
+        client: Redis client
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        list: Sorted server names
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return []
+    return sorted(client.hkeys(snapshot_key(version, 'servers')))
+
+def get_packed_server(client, server, version):
+    """
+    Get the columnar payload of one server in a snapshot
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        version: Snapshot version
+
+    Returns:
+        bytes: Result of pack_server, or None if not available
+    """
+    digest = client.hget(snapshot_key(version, 'servers'), server)
+    return client.get(server_payload_key(server, digest.decode('utf-8'))) if digest else None
+
+def get_server_data(client, server, version=None):
+    """
+    Get the data of one server from a snapshot
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        dict: Server data, or None if not available
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+    payload = get_packed_server(client, server, version)
+    return unpack_server(payload) if payload else None
+
+def get_received_files(client, server, version=None):
+    """
+    Get the received files of one server from a snapshot (see unpack_received_files)
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        list: Received file rows, or None if not available
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+    payload = get_packed_server(client, server, version)
+    return unpack_received_files(payload) if payload else None
+
+def get_snapshot_data(client, version=None):
+    """
+    Get the complete exchange data of a snapshot, per-server rows included
+
+    Args:
+        client: Redis client returning bytes
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        dict: Exchange data, or None if not available
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+
+    with client.pipeline(transaction=False) as pipe:
+        pipe.get(snapshot_key(version, 'data'))
+        pipe.hgetall(snapshot_key(version, 'servers'))
+        data, digests = pipe.execute()
+
+    if not data:
+        return None
+    data = json.loads(data)
+    data.pop('storage', None)
+    data['servers'] = {
+        server: unpack_server(payload) for server, payload in _load_payloads(client, digests).items()
+    }
+    return data
+
+def get_snapshot_json(client, version=None):
+    """
+    Get the serialized exchange data of a snapshot
+
+    Args:
+        client: Redis client
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        str: JSON document, or None if not available
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+    return client.get(snapshot_key(version, 'data'))
+
+def get_snapshot_payload(client, version, encoding=None):
+    """
+    Get the stored bytes of a snapshot's exchange data
+
+    Args:
+        client: Redis client returning bytes
+        version: Snapshot version
+        encoding: Content encoding from ENCODINGS, or None for plain JSON
+
+    Returns:
+        bytes: Stored payload, or None if not available
+    """
+    return client.get(snapshot_key(version, payload_field('data', encoding)))
+
+def get_server_payload(client, server, version, encoding=None):
+    """
+    Get the JSON bytes of one server's data in a snapshot
+
+    The JSON and its compressed variants are built from the columnar payload
+    on first use and kept in the generation's view cache.
+
+    Args:
+        client: Redis client returning bytes
+        server: Server name
+        version: Snapshot version
+        encoding: Content encoding from ENCODINGS, or None for plain JSON
+
+    Returns:
+        bytes: JSON payload, or None if not available
+    """
+    view = payload_field(f'server:{server}', encoding)
+    payload = get_cached_view(client, version, view)
+    if payload is not None:
+        return payload
+
+    data = get_server_data(client, server, version)
+    if data is None:
+        return None
+
+    variants = encode_payload(data)
+    for variant_encoding, variant in variants.items():
+        set_cached_view(client, version, payload_field(f'server:{server}', variant_encoding), variant)
+    return variants[encoding]
+
+def get_last_update(client, version=None):
+    """
+    Get the publish time of a snapshot
+
+    Args:
+        client: Redis client
+        version: Snapshot version (defaults to the live one)
+
+    Returns:
+        int: Unix timestamp, or None if nothing was published yet
+    """
+    version = version or get_current_version(client)
+    if version is None:
+        return None
+    last_update = client.hget(snapshot_key(version, 'meta'), 'last_update')
+    return int(last_update) if last_update else None
+
+def get_cached_view(client, version, name):
+    """
+    Get a view derived from a snapshot that was cached earlier
+
+    Args:
+        client: Redis client
+        version: Snapshot version the view was built from
+        name: Name of the view (including its parameters)
+
+    Returns:
+        str: Cached view, or None if it was not cached yet
+    """
+    return client.hget(snapshot_key(version, 'cache'), name)
+
+def set_cached_view(client, version, name, value):
+    """
+    Cache a view derived from a snapshot until the generation expires
+
+    Args:
+        client: Redis client
+        version: Snapshot version the view was built from
+        name: Name of the view (including its parameters)
+        value: Rendered view
+    """
+    key = snapshot_key(version, 'cache')
+    with client.pipeline(transaction=False) as pipe:
+        pipe.hset(key, name, value)
+        pipe.ttl(key)
+        _, ttl = pipe.execute()
+
+    # Bound the lifetime without extending the grace period of a replaced generation
+    if ttl == -1:
+        client.expire(key, SNAPSHOT_CACHE_SECONDS)
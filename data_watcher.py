@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import threading
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from data_parser import HISTORY_FILE, RECEIVED_SUMMARY_FILE
+
+logger = logging.getLogger(__name__)
+
+# Log files whose changes trigger a re-ingest of their server
+WATCHED_FILES = (HISTORY_FILE, RECEIVED_SUMMARY_FILE)
+
+class ExchangeWatcher(threading.Thread):
+    """
+    Watch the exchange_results tree with inotify and report changed servers
+
+    Change events are coalesced per server: the callback runs once the tree
+    has been quiet for `debounce` seconds, or at the latest `max_delay`
+    seconds after the first pending event, with the set of servers whose
+    history.csv or received_summary.txt changed.
+    """
+
+    def __init__(self, base_dir, callback, debounce=5.0, max_delay=60.0):
+        """
+        Args:
+            base_dir: Directory containing the ubuntu-server-* directories
+            callback: Function called with a set of changed server names
+            debounce: Seconds without events before the callback runs
+            max_delay: Maximum seconds a change waits for the callback
+        """
+        super().__init__(name='exchange-watcher', daemon=True)
+        self.base_dir = base_dir
+        self.callback = callback
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.stop_event = threading.Event()
+        self.inotify = None
+        self.base_watch = None
+        self.watches = {}
+
+    @staticmethod
+    def available():
+        """Return whether inotify support (inotify_simple) is installed"""
+        return INotify is not None
+
+    def stop(self):
+        """Ask the watcher thread to exit"""
+        self.stop_event.set()
+
+    def run(self):
+        """Watch for changes until stopped"""
+        self.inotify = INotify()
+
+        # The results directory may only appear once the first logs are collected
+        while self.base_watch is None:
+            try:
+                self.base_watch = self.inotify.add_watch(
+                    self.base_dir, flags.CREATE | flags.MOVED_TO | flags.ONLYDIR)
+            except FileNotFoundError:
+                if self.stop_event.wait(self.debounce):
+                    return
+
+        for name in os.listdir(self.base_dir):
+            self._watch_server(name)
+
+        pending = set()
+        first_event = last_event = None
+
+        while not self.stop_event.is_set():
+            timeout = self.debounce if pending else 1.0
+            for event in self.inotify.read(timeout=int(timeout * 1000)):
+                server = self._handle_event(event)
+                if server:
+                    pending.add(server)
+                    last_event = time.monotonic()
+                    first_event = first_event or last_event
+
+            if not pending:
+                continue
+
+            now = time.monotonic()
+            if now - last_event >= self.debounce or now - first_event >= self.max_delay:
+                servers, pending = pending, set()
+                first_event = last_event = None
+                try:
+                    self.callback(servers)
+                except Exception as e:
+                    logger.error(f"Error handling changes for {sorted(servers)}: {str(e)}")
+
+        self.inotify.close()
+
+    def _watch_server(self, name):
+        """Start watching a server directory; returns whether it was one"""
+        path = os.path.join(self.base_dir, name)
+        if not name.startswith('ubuntu-server') or not os.path.isdir(path):
+            return False
+        try:
+            watch = self.inotify.add_watch(
+                path, flags.CLOSE_WRITE | flags.MODIFY | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+            self.watches[watch] = name
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _handle_event(self, event):
+        """
+        Translate an inotify event into the name of a changed server
+
+        Returns:
+            str: Server whose log files changed, or None
+        """
+        if event.mask & flags.IGNORED:
+            self.watches.pop(event.wd, None)
+            return None
+
+        if event.wd == self.base_watch:
+            # A new server directory: its files count as changed
+            return event.name if self._watch_server(event.name) else None
+
+        server = self.watches.get(event.wd)
+        return server if event.name in WATCHED_FILES else None
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import data_store
+from data_exporter import DataExporter
+
+# Seconds a finished job's status stays queryable
+JOB_TTL_SECONDS = 86400
+
+# Seconds an export may run before it is given up: another job may start
+# exporting the same generation, and its temporary file is left to eviction
+JOB_TIMEOUT_SECONDS = 3600
+
+class ExcelExportJobs:
+    """
+    Background Excel export jobs with workbooks cached per snapshot generation
+
+    Job state lives in Redis so any web worker can report it; the workbooks
+    are written to export_dir, named after the generation id of the snapshot
+    they contain, which unlike the version is never reused.
+    """
+
+    def __init__(self, client, binary_client, export_dir, workers=1, max_bytes=None, max_age=None):
+        """
+        Args:
+            client: Redis client (decoding responses)
+            binary_client: Redis client returning bytes, to read the snapshot rows
+            export_dir: Directory the workbooks are written to
+            workers: Number of exports that may run at once
+            max_bytes: Optional total size the cached workbooks may use
+            max_age: Optional seconds after which a cached workbook is removed
+        """
+        self.client = client
+        self.binary_client = binary_client
+        self.export_dir = export_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='excel-export')
+
+    def artifact_path(self, generation):
+        """Return the path of the cached workbook of a snapshot generation"""
+        return os.path.join(self.export_dir, f'exchange_data_{generation}.xlsx')
+
+    def submit(self, version):
+        """
+        Get a job exporting a snapshot version, starting one if needed
+
+        A generation with a cached workbook completes immediately, and
+        concurrent submissions for the same generation share a single job.
+
+        Args:
+            version: Snapshot version to export
+
+        Returns:
+            dict: Job status
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'version': version,
+            'generation': data_store.get_generation(self.client, version) or f'v{version}',
+            'status': 'queued',
+            'created': int(time.time())
+        }
+
+        if os.path.exists(self.artifact_path(job['generation'])):
+            job['status'] = 'done'
+            self._save(job)
+            return job
+
+        # Coalesce onto a job already exporting this generation
+        running_key = f'export:excel:running:{job["generation"]}'
+        if not self.client.set(running_key, job_id, nx=True, ex=JOB_TIMEOUT_SECONDS):
+            existing = self.get(self.client.get(running_key) or '')
+            if existing:
+                return existing
+            self.client.set(running_key, job_id, ex=JOB_TIMEOUT_SECONDS)
+
+        self._save(job)
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """
+        Get the status of a job
+
+        Args:
+            job_id: Job identifier returned by submit
+
+        Returns:
+            dict: Job status, or None if the job is unknown or expired
+        """
+        job = self.client.get(f'export:job:{job_id}')
+        return json.loads(job) if job else None
+
+    def _save(self, job):
+        """Store the status of a job"""
+        self.client.set(f'export:job:{job["job_id"]}', json.dumps(job), ex=JOB_TTL_SECONDS)
+
+    def _run(self, job):
+        """Write the workbook of a job and record the outcome"""
+        version = job['version']
+        job['status'] = 'running'
+        self._save(job)
+
+        try:
+            data = data_store.get_snapshot_data(self.binary_client, version)
+            if not data:
+                raise ValueError(f'Snapshot version {version} is no longer available')
+
+            # Write under a temporary name so downloads never see a partial file
+            path = self.artifact_path(job['generation'])
+            temp_path = f'{path}.{job["job_id"]}.tmp'
+            try:
+                DataExporter.export_excel(data, temp_path)
+                os.replace(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            job['status'] = 'done'
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            self.client.delete(f'export:excel:running:{job["generation"]}')
+
+        self._save(job)
+        self.evict(keep=self.artifact_path(job['generation']))
+
+    def evict(self, keep=None):
+        """
+        Remove cached workbooks that are too old or exceed the size budget
+
+        Temporary files of exports that outlived JOB_TIMEOUT_SECONDS are
+        removed too, their process having stopped before finishing them.
+
+        Args:
+            keep: Optional path that must not be removed
+        """
+        now = time.time()
+        try:
+            entries = []
+            for name in os.listdir(self.export_dir):
+                path = os.path.join(self.export_dir, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith('.tmp') and now - stat.st_mtime > JOB_TIMEOUT_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith('.xlsx'):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            return
+
+        # Oldest first
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+
+        for mtime, size, path in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if path == keep or not (too_old or too_big):
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
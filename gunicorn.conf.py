@@ -0,0 +1,38 @@
+import os
+import multiprocessing
+
+# Address the web workers listen on
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Worker processes and threads per process; threads keep event streams from
+# occupying whole processes, and at most SSE_MAX_STREAMS threads of a process
+# serve event streams (see app.py)
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_class = 'gthread'
+
+# Event streams stay open; keep-alive comments are sent well within this timeout
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+
+# The app is created in each worker so every worker runs its own leader
+# election thread (threads do not survive a fork from the master)
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    """Clear the metric files left by a previous master (PROMETHEUS_MULTIPROC_DIR mode)"""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith('.db'):
+                os.remove(os.path.join(directory, name))
+
+def child_exit(server, worker):
+    """Drop the live metrics of an exited worker (PROMETHEUS_MULTIPROC_DIR mode)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,326 @@
+"""
+Standalone ingest worker: parse the exchange logs and publish them to Redis
+
+Runs the same database update as the web app, without Flask, so ingestion
+can be scheduled or scaled separately from the web processes.
+
+Usage:
+    python ingest.py --once     # one full reconcile, then exit
+    python ingest.py --watch    # scheduled reconciles, log collection and
+                                # the filesystem watcher until stopped
+
+Watching workers and web processes with INGEST_ENABLED elect a single leader
+through Redis, and every update goes through the single-flight refresh jobs,
+so any mix of them never ingests twice at the same time.
+"""
+import os
+import time
+import signal
+import logging
+import threading
+from datetime import datetime
+
+import redis
+
+import archive
+import data_store
+import metrics
+from data_parser import DEFAULT_SERVER_IPS, build_rollup, ingest_exchange_data
+from data_watcher import ExchangeWatcher
+from leader import LeaderElection
+from refresh_jobs import RefreshJobs
+
+logger = logging.getLogger(__name__)
+
+# Update interval (default: 6 hours)
+UPDATE_INTERVAL = int(os.environ.get('UPDATE_INTERVAL', 21600))
+
+# Seconds between checks for refreshes requested by processes that do not ingest
+REQUEST_POLL_INTERVAL = float(os.environ.get('REQUEST_POLL_INTERVAL', 1))
+
+# Filesystem watcher: enable flag and debounce timings in seconds
+WATCH_ENABLED = os.environ.get('WATCH_ENABLED', 'True').lower() == 'true'
+WATCH_DEBOUNCE = float(os.environ.get('WATCH_DEBOUNCE', 5))
+WATCH_MAX_DELAY = float(os.environ.get('WATCH_MAX_DELAY', 60))
+
+# SFTP log collection from the VMs: enable flag, interval in seconds, SSH user,
+# directory of the '<server>_id_ed25519' keys and concurrent sessions
+COLLECT_ENABLED = os.environ.get('COLLECT_ENABLED', 'False').lower() == 'true'
+COLLECT_INTERVAL = int(os.environ.get('COLLECT_INTERVAL', 300))
+SSH_USER = os.environ.get('SSH_USER', 'vagrant')
+SSH_KEYS_PATH = os.environ.get('SSH_KEYS_PATH', '/app/ssh_keys_for_host')
+COLLECT_CONNECTIONS = int(os.environ.get('COLLECT_CONNECTIONS', 10))
+
+# Lease electing the process that runs the background ingestion
+LEADER_KEY = 'leader:ingest'
+LEADER_LEASE = float(os.environ.get('LEADER_LEASE', 30))
+
+# Seconds the refresh lock is held without renewal before a crashed refresh is given up
+REFRESH_LOCK_TIMEOUT = int(os.environ.get('REFRESH_LOCK_TIMEOUT', 600))
+
+# Directory the VM logs are collected into
+EXCHANGE_DIR = os.environ.get('EXCHANGE_DIR', '/app/exchange_results')
+
+# History retention: days kept in full detail in Redis (0 keeps everything) and
+# the directory older rows are archived to
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '/app/archive')
+
+# Ingest mode: 'incremental' resumes from stored file checkpoints, 'full' re-parses everything
+INGEST_MODE = os.environ.get('INGEST_MODE', 'incremental')
+
+# Server IP addresses in addition to the built-in ones, as 'name=ip' pairs separated by commas
+SERVER_IPS = dict(
+    pair.strip().split('=', 1) for pair in os.environ.get('SERVER_IPS', '').split(',') if '=' in pair
+)
+
+# Parallel parsing: number of servers read at once and the pool type ('process' or 'thread')
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 1))
+PARSE_EXECUTOR = os.environ.get('PARSE_EXECUTOR', 'process')
+
+class IngestWorker:
+    """
+    Database updates and the background services that trigger them
+
+    update() parses the exchange logs and publishes a snapshot; it is only
+    run through refresh_jobs. start() and stop() run the periodic reconcile,
+    the log collector and the filesystem watcher, and are meant to be called
+    by a LeaderElection so that one process at a time runs them.
+    """
+
+    def __init__(self, client, binary_client, exchange_dir=EXCHANGE_DIR, archive_dir=ARCHIVE_DIR,
+                 retention_days=RETENTION_DAYS, mode=INGEST_MODE, server_ips=None,
+                 workers=PARSE_WORKERS, executor=PARSE_EXECUTOR):
+        """
+        Args:
+            client: Redis client (decoding responses)
+            binary_client: Redis client returning bytes
+            exchange_dir: Directory the VM logs are collected into
+            archive_dir: Directory history rows are archived to
+            retention_days: Days of history kept in Redis (0 keeps everything)
+            mode: 'incremental' or 'full'
+            server_ips: Optional IP addresses overriding DEFAULT_SERVER_IPS
+            workers: Number of servers parsed at once
+            executor: 'process' or 'thread'
+        """
+        self.client = client
+        self.binary_client = binary_client
+        self.exchange_dir = exchange_dir
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.mode = mode
+        self.server_ips = SERVER_IPS if server_ips is None else server_ips
+        self.workers = workers
+        self.executor = executor
+        self.services = {}
+        # Scheduler, watcher and API triggers coalesce onto one refresh at a time
+        self.refresh_jobs = RefreshJobs(client, self.update, REFRESH_LOCK_TIMEOUT)
+
+    def update(self, servers=None):
+        """
+        Parse the exchange data and update Redis database
+
+        Only called through refresh_jobs, which guarantees a single update runs
+        at a time across all processes.
+
+        Args:
+            servers: Optional names of the servers whose files changed; when
+                     omitted every server is checked (full reconcile)
+
+        Returns:
+            int: Published snapshot version, or None if the update failed
+        """
+        started = time.perf_counter()
+        try:
+            logger.info(f"Starting database update at {datetime.now()}"
+                        + (f" for {', '.join(sorted(servers))}" if servers else ""))
+
+            # Load the previous data and file checkpoints to resume from
+            version, previous, checkpoints = data_store.load_snapshot(self.binary_client)
+            previous_servers = set(previous['servers']) if previous else set()
+            if self.mode != 'incremental':
+                previous, checkpoints = None, None
+
+            # Parse data from exchange_results directory, skipping the archived rows
+            archives = archive.load_manifests(self.archive_dir)
+            exchange_data, checkpoints, changes, rollup = ingest_exchange_data(
+                self.exchange_dir, previous, checkpoints, workers=self.workers, executor=self.executor,
+                servers=servers, registry=data_store.load_registry(self.client),
+                server_ips=self.server_ips, archives=archives
+            )
+            new_rows = sum(change["new_history"] for change in changes.values())
+            logger.info(f"Ingested {new_rows} new history rows from {len(changes)} servers")
+            metrics.record_parse_stats(changes)
+
+            # Move the rows that left the retention window to the archive
+            if self.retention_days > 0:
+                compacted = archive.compact_history(
+                    self.exchange_dir, self.archive_dir, exchange_data, checkpoints, changes,
+                    archive.history_cutoff(self.retention_days), archives
+                )
+                for server, count in compacted.items():
+                    metrics.ARCHIVED_ROWS.labels(server).inc(count)
+                if compacted:
+                    logger.info(f"Archived {sum(compacted.values())} history rows from {len(compacted)} servers")
+
+            # Counters that did not follow the previous snapshot are rebuilt from scratch
+            if not rollup["rebuild"] and not data_store.rollups_current(self.client, version):
+                rollup = build_rollup(exchange_data['servers'], archives)
+
+            # Publish the new snapshot generation in a single transaction
+            removed_servers = previous_servers - set(exchange_data['servers'])
+            published = data_store.publish_snapshot(self.client, exchange_data, checkpoints, version,
+                                                    changes, removed_servers, rollup)
+            if published == version:
+                logger.info(f"No changes, snapshot version {version} kept")
+            else:
+                logger.info(f"Published snapshot version {published}")
+            version = published
+
+            logger.info(f"Database update completed at {datetime.now()}")
+            metrics.INGEST_SECONDS.observe(time.perf_counter() - started)
+            metrics.update_resident_memory()
+            return version
+        except Exception as e:
+            logger.error(f"Error updating database: {str(e)}")
+            return None
+
+    def collect_logs(self):
+        """Fetch the VM logs over SFTP and refresh the servers whose files changed"""
+        collector = self.services.get('collector')
+        if collector is None:
+            return
+
+        changed = collector.collect()
+        if changed:
+            logger.info(f"Collected {sum(changed.values())} bytes of logs from {len(changed)} servers")
+            # With a watcher running the new bytes are picked up from the filesystem
+            if 'watcher' not in self.services:
+                self.refresh_jobs.submit(set(changed))
+
+    def start(self):
+        """
+        Start the periodic reconcile, the log collector, the filesystem watcher
+        and the refreshes requested by other processes in this process
+        """
+        # The SFTP and scheduler libraries are only loaded by the process running them
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from data_collector import LogCollector
+
+        # Pull the logs from the VMs, first right away
+        if COLLECT_ENABLED and LogCollector.available():
+            self.services['collector'] = LogCollector(
+                self.exchange_dir, {**DEFAULT_SERVER_IPS, **self.server_ips}, SSH_USER, SSH_KEYS_PATH,
+                max_connections=COLLECT_CONNECTIONS
+            )
+        elif COLLECT_ENABLED:
+            logger.warning("asyncssh is not installed, logs must be copied to the exchange directory")
+
+        # Initialize scheduler for periodic full reconciles
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(self.refresh_jobs.submit, 'interval', seconds=UPDATE_INTERVAL)
+        # Run the refreshes requested by the web processes
+        scheduler.add_job(self.refresh_jobs.take_requests, 'interval', seconds=REQUEST_POLL_INTERVAL,
+                          max_instances=1)
+        if 'collector' in self.services:
+            scheduler.add_job(self.collect_logs, 'interval', seconds=COLLECT_INTERVAL,
+                              next_run_time=datetime.now(), max_instances=1)
+        scheduler.start()
+        self.services['scheduler'] = scheduler
+
+        # Re-ingest servers as soon as their log files change
+        if WATCH_ENABLED and ExchangeWatcher.available():
+            watcher = ExchangeWatcher(self.exchange_dir, self.refresh_jobs.submit, WATCH_DEBOUNCE,
+                                      WATCH_MAX_DELAY)
+            watcher.start()
+            self.services['watcher'] = watcher
+        elif WATCH_ENABLED:
+            logger.warning("inotify_simple is not installed, relying on the interval update only")
+
+        # Initial data load
+        if data_store.get_current_version(self.client) is None:
+            self.refresh_jobs.submit()
+
+    def stop(self):
+        """Stop the background ingestion started by start"""
+        scheduler = self.services.pop('scheduler', None)
+        if scheduler:
+            scheduler.shutdown(wait=False)
+        watcher = self.services.pop('watcher', None)
+        if watcher:
+            watcher.stop()
+        collector = self.services.pop('collector', None)
+        if collector:
+            collector.close()
+
+    def elect(self):
+        """
+        Start campaigning for the ingestion lease in a background thread
+
+        Returns:
+            LeaderElection: The running election; stop() it to step down
+        """
+        election = LeaderElection(self.client, LEADER_KEY, self.start, self.stop, LEADER_LEASE)
+        election.start()
+        return election
+
+def redis_clients():
+    """
+    Connect to the Redis server configured by REDIS_HOST and REDIS_PORT
+
+    Returns:
+        tuple: (client decoding responses, client returning bytes)
+    """
+    host = os.environ.get('REDIS_HOST', 'localhost')
+    port = int(os.environ.get('REDIS_PORT', 6379))
+    return (redis.Redis(host=host, port=port, decode_responses=True),
+            redis.Redis(host=host, port=port))
+
+def main(argv=None):
+    """Run the ingest worker from the command line; returns the exit status"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parse the exchange logs and publish them to Redis")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--once", action="store_true", help="Run one full reconcile and exit")
+    mode.add_argument("--watch", action="store_true",
+                      help="Keep ingesting on schedule and on file changes until stopped")
+    parser.add_argument("--servers", nargs="+", help="With --once: only check these servers")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get('METRICS_PORT', 0)),
+                        help="Serve the Prometheus metrics on this port (default: off)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    client, binary_client = redis_clients()
+    worker = IngestWorker(client, binary_client)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    seconds, resident = metrics.record_startup('ingest')
+    logger.info(f"Ingest worker ready in {seconds:.2f} s using {resident / 2 ** 20:.1f} MiB")
+
+    if args.once:
+        job = worker.refresh_jobs.wait(worker.refresh_jobs.submit(args.servers)['job_id'])
+        if job is None:
+            logger.error("The refresh status expired before it finished")
+            return 1
+        logger.info(f"Refresh {job['job_id']} {job['status']}"
+                    + (f", snapshot version {job['version']}" if job.get('version') is not None else ""))
+        return 0 if job['status'] == 'done' else 1
+
+    # Stop on Ctrl+C or on the SIGTERM sent by container runtimes
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    election = worker.elect()
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        election.stop()
+        election.join()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
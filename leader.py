@@ -0,0 +1,73 @@
+import logging
+import threading
+
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+class LeaderElection(threading.Thread):
+    """
+    Elect one process to run the background ingestion, using a Redis lease
+
+    Every process runs an election thread that tries to take the lease; the
+    holder renews it every lease/3 seconds. If the leader dies or loses its
+    connection, the lease expires and another process takes over within
+    about `lease` seconds.
+    """
+
+    def __init__(self, client, name, on_elected, on_deposed, lease=30.0):
+        """
+        Args:
+            client: Redis client
+            name: Key of the lease
+            on_elected: Function called when this process becomes the leader
+            on_deposed: Function called when this process stops being the leader
+            lease: Seconds the lease lasts without renewal
+        """
+        super().__init__(name='leader-election', daemon=True)
+        self.lock = client.lock(name, timeout=lease, thread_local=False)
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.lease = lease
+        self.stop_event = threading.Event()
+        self.leader = False
+
+    def stop(self):
+        """Ask the election thread to exit, giving up the lease if held"""
+        self.stop_event.set()
+
+    def run(self):
+        """Campaign for, then keep renewing, the lease until stopped"""
+        while not self.stop_event.is_set():
+            try:
+                if self.leader:
+                    self.lock.reacquire()
+                elif self.lock.acquire(blocking=False):
+                    self.leader = True
+                    logger.info("Elected as ingestion leader")
+                    self.on_elected()
+            except LockError:
+                self._depose("Lost the ingestion lease")
+            except Exception as e:
+                logger.error(f"Leader election error: {str(e)}")
+                self._depose("Stepping down after a leader election error")
+
+            self.stop_event.wait(self.lease / 3)
+
+        if self.leader:
+            self._depose("Stepping down as ingestion leader")
+            try:
+                self.lock.release()
+            except Exception:
+                pass
+
+    def _depose(self, reason):
+        """Stop acting as the leader"""
+        if not self.leader:
+            return
+        self.leader = False
+        logger.warning(reason)
+        try:
+            self.on_deposed()
+        except Exception as e:
+            logger.error(f"Error stopping the background services: {str(e)}")
@@ -0,0 +1,152 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, start_http_server)
+from prometheus_client import multiprocess
+
+from data_parser import HISTORY_FILE, RECEIVED_SUMMARY_FILE
+
+# Buckets for payload and response sizes in bytes (1 KiB to 256 MiB)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+# Ingest: per-server reads, as reported by read_server_delta
+PARSE_SECONDS = Histogram(
+    'exchange_parse_seconds', 'Time spent reading one server\'s log files', ['server'])
+PARSE_ROWS = Counter(
+    'exchange_parsed_rows_total', 'Rows parsed from the log files', ['server', 'file'])
+PARSE_ROWS_PER_SECOND = Gauge(
+    'exchange_parse_rows_per_second', 'Rows parsed per second in the last read of a server',
+    ['server'], multiprocess_mode='livemostrecent')
+BYTES_READ = Counter(
+    'exchange_bytes_read_total', 'Bytes read from the log files', ['server', 'file'])
+MALFORMED_LINES = Counter(
+    'exchange_malformed_lines_total', 'Log lines with missing or unparseable fields',
+    ['server', 'file'])
+INGEST_SECONDS = Histogram(
+    'exchange_ingest_seconds', 'Duration of a whole database update, parse to publish')
+ARCHIVED_ROWS = Counter(
+    'exchange_archived_rows_total', 'History rows moved out of the retention window to the archive',
+    ['server'])
+
+# Redis round-trips and the sizes of what is stored
+REDIS_SECONDS = Histogram(
+    'redis_operation_seconds', 'Latency of the Redis round-trips of database updates', ['operation'])
+PAYLOAD_BYTES = Histogram(
+    'snapshot_payload_bytes', 'Size of the payloads written with each snapshot', ['payload'],
+    buckets=SIZE_BUCKETS)
+SERVER_WRITES = Counter(
+    'snapshot_server_writes_total', 'Server payloads of each update, written or left as they were',
+    ['outcome'])
+
+# HTTP requests, labelled with the route pattern rather than the URL
+REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'Time to produce a response (streams: until the first byte)',
+    ['endpoint', 'method', 'status'])
+RESPONSE_BYTES = Histogram(
+    'http_response_bytes', 'Size of non-streamed response bodies', ['endpoint'],
+    buckets=SIZE_BUCKETS)
+
+# Exports by format
+EXPORT_SECONDS = Histogram(
+    'export_seconds', 'Time to produce an export', ['format'])
+
+# Process startup and memory, labelled 'web' or 'ingest'; with several
+# workers, one sample per live worker (exited ones are dropped by the
+# child_exit hook of gunicorn.conf.py)
+STARTUP_SECONDS = Gauge(
+    'exchange_process_startup_seconds', 'Seconds from the process start until it was ready to work',
+    ['process'], multiprocess_mode='liveall')
+RESIDENT_BYTES = Gauge(
+    'exchange_process_resident_bytes', 'Resident memory of the process, updated on scrapes and ingests',
+    ['process'], multiprocess_mode='liveall')
+
+# Label of this process, set by record_startup
+_process = None
+
+def process_uptime():
+    """Return the seconds since this process started, or None without /proc"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the parenthesized command name start at the state (field 3)
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 0.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def resident_memory():
+    """Return the resident memory of this process in bytes, or None without /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def record_startup(process):
+    """
+    Record how long this process took to become ready and its memory at that point
+
+    Args:
+        process: 'web' or 'ingest'
+
+    Returns:
+        tuple: (seconds since the process started, resident bytes), 0 where unknown
+    """
+    global _process
+    _process = process
+    seconds = process_uptime() or 0.0
+    STARTUP_SECONDS.labels(process).set(seconds)
+    update_resident_memory()
+    return seconds, resident_memory() or 0
+
+def update_resident_memory():
+    """Refresh the resident memory gauge of a process that called record_startup"""
+    resident = resident_memory()
+    if _process and resident is not None:
+        RESIDENT_BYTES.labels(_process).set(resident)
+
+def serve(port):
+    """Serve the metrics of a process without a web app (the ingest worker) on a port"""
+    start_http_server(port)
+
+def record_parse_stats(changes):
+    """
+    Record the read statistics reported by ingest_exchange_data
+
+    Args:
+        changes: Per-server changes, as returned by ingest_exchange_data
+    """
+    for server, change in changes.items():
+        stats = change.get('stats')
+        if not stats:
+            continue
+
+        rows = 0
+        for file in (HISTORY_FILE, RECEIVED_SUMMARY_FILE):
+            file_stats = stats[file]
+            PARSE_ROWS.labels(server, file).inc(file_stats['rows'])
+            BYTES_READ.labels(server, file).inc(file_stats['bytes'])
+            MALFORMED_LINES.labels(server, file).inc(file_stats['malformed'])
+            rows += file_stats['rows']
+
+        PARSE_SECONDS.labels(server).observe(stats['seconds'])
+        if stats['seconds'] > 0:
+            PARSE_ROWS_PER_SECOND.labels(server).set(rows / stats['seconds'])
+
+def render():
+    """
+    Render the metrics in the Prometheus text format
+
+    With PROMETHEUS_MULTIPROC_DIR set (multi-worker gunicorn), the metrics of
+    all worker processes are aggregated.
+
+    Returns:
+        tuple: (body, content type)
+    """
+    update_resident_memory()
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,310 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.exceptions import LockNotOwnedError, WatchError
+
+logger = logging.getLogger(__name__)
+
+# Seconds a finished refresh's status stays queryable
+JOB_TTL_SECONDS = 86400
+
+# Seconds between the heartbeats of the process owning the queued refresh,
+# and after which a missing heartbeat means the owner is gone
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 20
+
+# Redis keys coordinating the refreshes of all processes
+LOCK_KEY = 'refresh:lock'
+QUEUED_KEY = 'refresh:queued'
+HEARTBEAT_KEY = 'refresh:queued:heartbeat'
+PENDING_KEY = 'refresh:pending'
+REQUESTED_KEY = 'refresh:requested'
+
+# Pending entry requesting a full reconcile instead of a set of servers
+ALL_SERVERS = '*'
+
+class RefreshJobs:
+    """
+    Single-flight database refreshes coordinated through Redis
+
+    At most one refresh runs at a time across all processes, guarded by a
+    Redis lock, and at most one more waits behind it: triggers arriving
+    while a refresh is queued are merged into it (servers are unioned, and
+    any full reconcile request makes it a full reconcile). Readers are never
+    blocked, they keep serving the live snapshot until the refresh publishes
+    the next one.
+
+    The queued job can only be run by the process that queued it, which
+    keeps a heartbeat alive while it waits for the lock; a queued job whose
+    heartbeat lapsed is marked failed and replaced by the next request, and
+    a refresh finding requests left behind by such a job queues a new one.
+
+    Processes that do not run refreshes (web processes with ingestion
+    disabled) only record their requests with request(); the process that
+    runs them picks them up with take_requests() and keeps the job id the
+    requesting clients were given.
+    """
+
+    def __init__(self, client, refresh, lock_timeout=600):
+        """
+        Args:
+            client: Redis client (decoding responses)
+            refresh: Function taking the changed server names (None for all)
+                     and returning the published snapshot version, or None
+                     if the refresh failed
+            lock_timeout: Seconds the lock is held without being renewed, after
+                          which a crashed refresh no longer blocks the others
+        """
+        self.client = client
+        self.refresh = refresh
+        self.lock_timeout = lock_timeout
+        # One thread runs a refresh while another waits with the queued job
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='refresh')
+
+    def submit(self, servers=None):
+        """
+        Request a refresh, joining the queued one if there is any
+
+        Args:
+            servers: Optional names of the servers whose files changed; when
+                     omitted every server is checked (full reconcile)
+
+        Returns:
+            dict: Status of the job that will include the request
+        """
+        self._add_pending(servers)
+
+        while True:
+            queued_id = self.client.get(QUEUED_KEY)
+            if queued_id:
+                if self.client.exists(HEARTBEAT_KEY):
+                    return self.get(queued_id) or {'job_id': queued_id, 'status': 'queued'}
+                # The process that queued the job is gone, nothing will run it
+                self._abandon(queued_id)
+                continue
+
+            # A job requested by another process becomes this one
+            requested_id = self.client.get(REQUESTED_KEY)
+            job = self._new_job(requested_id)
+            self._save(job)
+            # Beat before queuing, so the job is never seen without a heartbeat
+            self._heartbeat(job['job_id'])
+            if self.client.set(QUEUED_KEY, job['job_id'], nx=True, ex=JOB_TTL_SECONDS):
+                if requested_id:
+                    self._claim_request(requested_id)
+                self.executor.submit(self._run, dict(job))
+                return job
+
+    def request(self, servers=None):
+        """
+        Request a refresh without running it in this process
+
+        The request joins the queued job if there is any, otherwise the job
+        stays requested until a process running refreshes takes it with
+        take_requests().
+
+        Args:
+            servers: Optional names of the servers whose files changed; when
+                     omitted every server is checked (full reconcile)
+
+        Returns:
+            dict: Status of the job that will include the request
+        """
+        self._add_pending(servers)
+
+        while True:
+            queued_id = self.client.get(QUEUED_KEY)
+            if queued_id and self.client.exists(HEARTBEAT_KEY):
+                return self.get(queued_id) or {'job_id': queued_id, 'status': 'queued'}
+
+            requested_id = self.client.get(REQUESTED_KEY)
+            if requested_id:
+                return self.get(requested_id) or {'job_id': requested_id, 'status': 'queued'}
+
+            job = self._new_job()
+            self._save(job)
+            if self.client.set(REQUESTED_KEY, job['job_id'], nx=True, ex=JOB_TTL_SECONDS):
+                return job
+
+    def take_requests(self):
+        """
+        Queue the job requested by other processes, to be run by this one
+
+        Returns:
+            dict: Status of the job, or None if nothing was requested
+        """
+        if not self.client.exists(REQUESTED_KEY):
+            return None
+        return self.submit(())
+
+    def get(self, job_id):
+        """
+        Get the status of a refresh
+
+        Args:
+            job_id: Job identifier returned by submit
+
+        Returns:
+            dict: Job status, or None if the job is unknown or expired
+        """
+        job = self.client.get(f'refresh:job:{job_id}')
+        return json.loads(job) if job else None
+
+    def wait(self, job_id, interval=0.5):
+        """
+        Wait until a refresh finished, whichever process runs it
+
+        Args:
+            job_id: Job identifier returned by submit
+            interval: Seconds between status checks
+
+        Returns:
+            dict: Final job status, or None if the job is unknown or expired;
+                  a job abandoned by the process that queued it is failed
+        """
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in ('done', 'failed'):
+                return job
+            if (job['status'] == 'queued' and not self.client.exists(HEARTBEAT_KEY)
+                    and self.client.get(REQUESTED_KEY) != job_id):
+                self._abandon(job_id)
+            time.sleep(interval)
+
+    def running(self):
+        """Return whether a refresh currently holds the lock"""
+        return bool(self.client.exists(LOCK_KEY))
+
+    def _add_pending(self, servers):
+        """Record the servers a request covers (None for all)"""
+        if servers is None:
+            self.client.sadd(PENDING_KEY, ALL_SERVERS)
+        elif servers:
+            self.client.sadd(PENDING_KEY, *servers)
+
+    def _new_job(self, job_id=None):
+        """Status of a newly queued job"""
+        return {
+            'job_id': job_id or uuid.uuid4().hex,
+            'status': 'queued',
+            'created': int(time.time())
+        }
+
+    def _claim_request(self, job_id):
+        """Drop the requested job once it is queued, unless another one was requested since"""
+        with self.client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(REQUESTED_KEY)
+                if pipe.get(REQUESTED_KEY) == job_id:
+                    pipe.multi()
+                    pipe.delete(REQUESTED_KEY)
+                    pipe.execute()
+            except WatchError:
+                pass
+
+    def _save(self, job):
+        """Store the status of a job"""
+        self.client.set(f'refresh:job:{job["job_id"]}', json.dumps(job), ex=JOB_TTL_SECONDS)
+
+    def _abandon(self, job_id):
+        """Mark a queued job whose owner stopped as failed and drop it from the queue"""
+        with self.client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(QUEUED_KEY, HEARTBEAT_KEY)
+                if pipe.exists(HEARTBEAT_KEY):
+                    # A new job is being queued
+                    return
+                queued_id = pipe.get(QUEUED_KEY)
+                job = self.get(job_id)
+                pipe.multi()
+                if queued_id == job_id:
+                    pipe.delete(QUEUED_KEY)
+                if job and job['status'] == 'queued':
+                    job['status'] = 'failed'
+                    job['error'] = 'The process that queued the refresh stopped'
+                    job['finished'] = int(time.time())
+                    pipe.set(f'refresh:job:{job_id}', json.dumps(job), ex=JOB_TTL_SECONDS)
+                pipe.execute()
+            except WatchError:
+                return
+        logger.warning(f"Refresh {job_id} was abandoned by its process, queuing a new one")
+
+    def _heartbeat(self, job_id):
+        """Tell the other processes that the owner of the queued job is alive"""
+        self.client.set(HEARTBEAT_KEY, job_id, ex=HEARTBEAT_TIMEOUT)
+
+    def _run(self, job):
+        """Wait for the lock, then run the refresh with every request merged into the job"""
+        lock = self.client.lock(LOCK_KEY, timeout=self.lock_timeout, thread_local=False)
+        while not lock.acquire(blocking_timeout=HEARTBEAT_INTERVAL):
+            if self.client.get(QUEUED_KEY) != job['job_id']:
+                # Taken for abandoned and replaced by another process
+                return
+            self._heartbeat(job['job_id'])
+        try:
+            # Stop accepting requests into this job and take what it covers,
+            # including requests merged into an abandoned job
+            job['status'] = 'running'
+            job['started'] = int(time.time())
+            with self.client.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        pipe.watch(QUEUED_KEY)
+                        queued_id = pipe.get(QUEUED_KEY)
+                        pipe.multi()
+                        if queued_id == job['job_id']:
+                            pipe.delete(QUEUED_KEY, HEARTBEAT_KEY)
+                        pipe.set(f'refresh:job:{job["job_id"]}', json.dumps(job), ex=JOB_TTL_SECONDS)
+                        pipe.smembers(PENDING_KEY)
+                        pipe.delete(PENDING_KEY)
+                        pending = pipe.execute()[-2]
+                        break
+                    except WatchError:
+                        continue
+
+            if not pending:
+                # Everything requested was covered by the previous refresh
+                job['status'] = 'done'
+                return
+
+            servers = None if ALL_SERVERS in pending else sorted(pending)
+            job['servers'] = servers
+            self._save(job)
+
+            version = self._refresh_holding(lock, servers)
+            job['status'] = 'done' if version is not None else 'failed'
+            job['version'] = version
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            job['finished'] = int(time.time())
+            self._save(job)
+            try:
+                lock.release()
+            except LockNotOwnedError:
+                logger.warning(f"Refresh {job['job_id']} outlived its lock, another refresh may have overlapped it")
+
+        # Requests queued into a job whose process stopped are picked up here
+        if self.client.scard(PENDING_KEY) and not self.client.exists(HEARTBEAT_KEY):
+            self.submit(())
+
+    def _refresh_holding(self, lock, servers):
+        """Run the refresh, renewing the lock until it returns"""
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.lock_timeout / 3):
+                lock.reacquire()
+
+        renewer = threading.Thread(target=renew, name='refresh-lock', daemon=True)
+        renewer.start()
+        try:
+            return self.refresh(servers)
+        finally:
+            done.set()
+            renewer.join()
@@ -0,0 +1,207 @@
+import os
+import asyncio
+import threading
+
+import pytest
+
+asyncssh = pytest.importorskip('asyncssh')
+
+from data_collector import REMOTE_LOG_DIR, LogCollector
+from data_parser import FINGERPRINT_BYTES, HISTORY_FILE, RECEIVED_SUMMARY_FILE
+
+HEADER = b'timestamp,file,direction,target_servers,status\n'
+
+class FakeFleet:
+    """
+    In-process SFTP servers standing in for the VMs
+
+    Each server listens on its own loopback address, on a port shared by all
+    of them, and serves a directory of its own as its home directory. The
+    connections open at once and the bytes read are counted per server.
+    """
+
+    def __init__(self, root, key_dir, servers):
+        self.root = root
+        self.servers = servers
+        self.hosts = {server: f'127.0.0.{index + 1}' for index, server in enumerate(servers)}
+        self.connections = {server: 0 for server in servers}
+        self.bytes_read = {server: 0 for server in servers}
+        self.open = 0
+        self.peak = 0
+        self.listeners = []
+        self.port = None
+
+        client_key = asyncssh.generate_private_key('ssh-ed25519')
+        for server in servers:
+            client_key.write_private_key(os.path.join(key_dir, f'{server}_id_ed25519'))
+            os.makedirs(self.remote_path(server, ''), exist_ok=True)
+        self.client_keys = asyncssh.import_authorized_keys(
+            client_key.export_public_key().decode('ascii'))
+        self.host_key = asyncssh.generate_private_key('ssh-ed25519')
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._run(self._listen())
+
+    def remote_path(self, server, name):
+        """Path of a file in the log directory of a server"""
+        return os.path.join(self.root, server, REMOTE_LOG_DIR, name)
+
+    def write(self, server, name, content, mode='wb'):
+        """Write (or append to) a remote file"""
+        with open(self.remote_path(server, name), mode) as f:
+            f.write(content)
+
+    def read(self, server, name):
+        """Read a remote file"""
+        with open(self.remote_path(server, name), 'rb') as f:
+            return f.read()
+
+    def close(self):
+        self._run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(10)
+
+    async def _listen(self):
+        for server in self.servers:
+            listener = await asyncssh.listen(
+                self.hosts[server], self.port or 0,
+                server_host_keys=[self.host_key],
+                authorized_client_keys=self.client_keys,
+                server_factory=lambda server=server: self._ssh_server(server),
+                sftp_factory=lambda channel, server=server: self._sftp_server(server, channel))
+            self.port = self.port or listener.get_port()
+            self.listeners.append(listener)
+
+    async def _close(self):
+        for listener in self.listeners:
+            listener.close()
+            await listener.wait_closed()
+
+    def _ssh_server(self, server):
+        fleet = self
+
+        class Server(asyncssh.SSHServer):
+            def connection_made(self, connection):
+                fleet.connections[server] += 1
+                fleet.open += 1
+                fleet.peak = max(fleet.peak, fleet.open)
+
+            def connection_lost(self, exc):
+                fleet.open -= 1
+
+        return Server()
+
+    def _sftp_server(self, server, channel):
+        fleet = self
+
+        class Server(asyncssh.SFTPServer):
+            def read(self, file_obj, offset, size):
+                data = super().read(file_obj, offset, size)
+                fleet.bytes_read[server] += len(data)
+                return data
+
+        return Server(channel, chroot=os.path.join(self.root, server))
+
+def history(rows, start=0, status=b'success'):
+    """Build history.csv rows"""
+    return b''.join(
+        b'2024-05-01 %02d:%02d:00,file_%d.txt,sent,ubuntu-server-2,%s\n' % (i // 60 % 24, i % 60, i, status)
+        for i in range(start, start + rows)
+    )
+
+@pytest.fixture
+def fleet(tmp_path):
+    key_dir = tmp_path / 'keys'
+    key_dir.mkdir()
+    fleet = FakeFleet(str(tmp_path / 'remote'), str(key_dir), ['ubuntu-server-1', 'ubuntu-server-2'])
+    yield fleet
+    fleet.close()
+
+def make_collector(tmp_path, fleet, max_connections=10):
+    return LogCollector(str(tmp_path / 'exchange'), fleet.hosts, username='vagrant',
+                        key_dir=str(tmp_path / 'keys'), port=fleet.port, max_connections=max_connections)
+
+def local_file(tmp_path, server, name):
+    with open(tmp_path / 'exchange' / server / name, 'rb') as f:
+        return f.read()
+
+def test_appended_rows_are_fetched_alone(tmp_path, fleet):
+    server = 'ubuntu-server-1'
+    fleet.write(server, HISTORY_FILE, HEADER + history(200))
+    fleet.write(server, RECEIVED_SUMMARY_FILE, b'Total files received: 3\n')
+    collector = make_collector(tmp_path, fleet)
+    try:
+        first = collector.collect([server])
+        assert first[server] == len(fleet.read(server, HISTORY_FILE)) + len(fleet.read(server, RECEIVED_SUMMARY_FILE))
+
+        appended = history(5, start=200)
+        fleet.write(server, HISTORY_FILE, appended, 'ab')
+        read_before = fleet.bytes_read[server]
+        assert collector.collect([server]) == {server: len(appended)}
+
+        # Only the tail checked against the local copy and the new rows are read
+        assert fleet.bytes_read[server] - read_before == FINGERPRINT_BYTES + len(appended)
+        assert local_file(tmp_path, server, HISTORY_FILE) == fleet.read(server, HISTORY_FILE)
+
+        # Nothing changed: nothing is read
+        read_before = fleet.bytes_read[server]
+        assert collector.collect([server]) == {}
+        assert fleet.bytes_read[server] == read_before
+    finally:
+        collector.close()
+
+def test_tail_mismatch_fetches_whole_file(tmp_path, fleet):
+    server = 'ubuntu-server-1'
+    fleet.write(server, HISTORY_FILE, HEADER + history(200))
+    collector = make_collector(tmp_path, fleet)
+    try:
+        collector.collect([server])
+
+        # Rewritten with different rows and grown: the local copy is not a prefix any more
+        rewritten = HEADER + history(199, status=b'failed') + history(10, start=199)
+        fleet.write(server, HISTORY_FILE, rewritten)
+        assert collector.collect([server]) == {server: len(rewritten)}
+        assert local_file(tmp_path, server, HISTORY_FILE) == rewritten
+        assert not os.path.exists(tmp_path / 'exchange' / server / f'.{HISTORY_FILE}.part')
+    finally:
+        collector.close()
+
+def test_sessions_are_reused(tmp_path, fleet):
+    for server in fleet.servers:
+        fleet.write(server, HISTORY_FILE, HEADER + history(20))
+    collector = make_collector(tmp_path, fleet)
+    try:
+        assert set(collector.collect()) == set(fleet.servers)
+        for server in fleet.servers:
+            fleet.write(server, HISTORY_FILE, history(1, start=20), 'ab')
+        assert set(collector.collect()) == set(fleet.servers)
+        assert fleet.connections == {server: 1 for server in fleet.servers}
+    finally:
+        collector.close()
+
+def test_connections_are_capped(tmp_path):
+    key_dir = tmp_path / 'keys'
+    key_dir.mkdir()
+    servers = [f'ubuntu-server-{index}' for index in range(1, 6)]
+    fleet = FakeFleet(str(tmp_path / 'remote'), str(key_dir), servers)
+    collector = make_collector(tmp_path, fleet, max_connections=2)
+    try:
+        for server in servers:
+            fleet.write(server, HISTORY_FILE, HEADER + history(50))
+        assert set(collector.collect()) == set(servers)
+        assert fleet.peak == 2
+        assert len(collector.sessions) <= 2
+        for server in servers:
+            assert local_file(tmp_path, server, HISTORY_FILE) == fleet.read(server, HISTORY_FILE)
+
+        # Sessions closed to make room are opened again on the next collection
+        for server in servers:
+            fleet.write(server, HISTORY_FILE, history(1, start=50), 'ab')
+        assert set(collector.collect()) == set(servers)
+        assert fleet.peak <= 2
+    finally:
+        collector.close()
+        fleet.close()
@@ -0,0 +1,282 @@
+import os
+import shutil
+
+import fakeredis
+
+import archive
+import data_store
+from benchmarks.fleet import append_runs, generate_fleet
+from data_parser import HISTORY_EXTRA_FIELD, HISTORY_FILE
+from ingest import IngestWorker
+
+def clients():
+    """Decoding and binary clients sharing one fake Redis server"""
+    server = fakeredis.FakeServer()
+    return (fakeredis.FakeRedis(server=server, decode_responses=True),
+            fakeredis.FakeRedis(server=server))
+
+def make_worker(tmp_path, client, binary, retention_days=0):
+    """Ingest worker reading tmp_path/exchange into the fake Redis server"""
+    return IngestWorker(client, binary, exchange_dir=str(tmp_path / 'exchange'),
+                        archive_dir=str(tmp_path / 'archive'), retention_days=retention_days,
+                        server_ips={}, workers=1)
+
+def update(worker):
+    """Run one database update, failing the test if it failed"""
+    version = worker.update()
+    assert version is not None
+    return version
+
+def stored(client, binary):
+    """What a snapshot serves, without the time it was built and by server name"""
+    data = data_store.get_snapshot_data(binary)
+    data['summary'].pop('last_updated')
+    # Registry positions depend on the order servers were first seen
+    registry = data.pop('registry')
+    matrix = data.pop('connection_matrix')
+    data['links'] = {(registry[source], registry[target]): count for source, target, count in matrix['links']}
+    return data, data_store.get_rollup_summary(client)
+
+def from_scratch(tmp_path):
+    """What a full ingest of the exchange directory into an empty Redis serves"""
+    client, binary = clients()
+    update(make_worker(tmp_path, client, binary))
+    return stored(client, binary)
+
+def rewrite(path, lines):
+    """Replace the content of a file"""
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+def test_ragged_history_rows_are_stored(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=2, rows=20)
+    path = os.path.join(base_dir, 'ubuntu-server-1', HISTORY_FILE)
+    with open(path) as f:
+        lines = f.readlines()
+
+    # The first row has two fields too many, a later one a field too few
+    lines[1] = lines[1].rstrip('\n') + ',note,42\n'
+    lines[5] = lines[5].rstrip('\n').rsplit(',', 1)[0] + '\n'
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    version = update(worker)
+    history = data_store.get_server_data(binary, 'ubuntu-server-1', version)['history']
+    assert len(history) == len(lines) - 1
+    assert history[0][HISTORY_EXTRA_FIELD] == 'note,42'
+    assert history[1][HISTORY_EXTRA_FIELD] is None
+    assert history[4]['status'] is None
+
+    # Rows appended later with extra fields are kept too
+    with open(path, 'a') as f:
+        f.write(lines[2].rstrip('\n') + ',late\n')
+    version = update(worker)
+    assert data_store.get_server_data(binary, 'ubuntu-server-1', version)['history'][-1][HISTORY_EXTRA_FIELD] == 'late'
+
+def test_history_pages_read_only_their_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, 'HISTORY_CHUNK_ROWS', 16)
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=2, rows=100)
+    server = 'ubuntu-server-1'
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    update(worker)
+
+    # Rows appended later land in the partial last chunk and the ones after it
+    path = os.path.join(base_dir, server, HISTORY_FILE)
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'a') as f:
+        f.writelines(line.replace('2024-05-', '2024-06-') for line in lines[1:40])
+    version = update(worker)
+    expected = sorted(data_store.get_server_data(binary, server, version)['history'],
+                      key=lambda row: row['timestamp'])
+
+    # Without the whole payload to fall back on, pages only have the chunks
+    monkeypatch.setattr(data_store, 'get_history_columns', None)
+    chunks = {}
+    rows, cursor = [], None
+    while True:
+        page, cursor = data_store.get_history_page(binary, server, limit=10, cursor=cursor, chunks=chunks)
+        rows.extend(page)
+        assert len(chunks) <= 2
+        if not cursor:
+            break
+    assert [row['timestamp'] for row in rows] == [row['timestamp'] for row in expected]
+    assert sorted(map(str, rows)) == sorted(map(str, expected))
+
+def test_changes_since_another_generation_are_not_replayed(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=30)
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    update(worker)
+    append_runs(base_dir, 2)
+    update(worker)
+    generation = data_store.get_generation(client, 1)
+
+    delta = data_store.get_changes_since(client, 1, generation)
+    assert delta['version'] == 2 and delta['servers']
+    assert data_store.get_changes_since(client, 2, data_store.get_generation(client, 2))['servers'] == {}
+
+    # Redis loses its data: versions start over with new generation ids
+    client.flushall()
+    update(worker)
+    append_runs(base_dir, 2)
+    assert update(worker) == 2
+    assert data_store.get_changes_since(client, 1, generation) is None
+    assert data_store.get_changes_since(client, 1, data_store.get_generation(client, 1)) is not None
+
+def test_file_queries_match_whole_names_and_cache_empty_results(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=2, rows=20)
+    path = os.path.join(base_dir, 'ubuntu-server-1', HISTORY_FILE)
+    with open(path) as f:
+        lines = f.readlines()
+
+    # One file name is another one followed by the separator of the file index
+    for number, name in ((1, 'report'), (2, 'report|3'), (3, 'report|')):
+        fields = lines[number].split(',')
+        fields[4] = name
+        lines[number] = ','.join(fields)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+    client, binary = clients()
+    update(make_worker(tmp_path, client, binary))
+    for name in ('report', 'report|3', 'report|'):
+        rows, _ = data_store.query_history(binary, ['ubuntu-server-1'], file=name)
+        assert [row['file'] for row in rows] == [name]
+
+    # Queries matching nothing are answered from the cache too
+    assert data_store.query_history(binary, ['ubuntu-server-1'], file='missing') == ([], None)
+    assert data_store.query_history(binary, ['ubuntu-server-1'], status='missing') == ([], None)
+    assert len(client.keys('query:*:empty')) == 2
+    client.delete(*client.keys('history:*'))
+    assert data_store.query_history(binary, ['ubuntu-server-1'], status='missing') == ([], None)
+
+def test_rollup_server_ips_are_written_on_every_publish(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=20)
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    update(worker)
+    ip = client.hget(data_store.ROLLUP_SERVERS_KEY, 'ubuntu-server-3|ip')
+    client.hdel(data_store.ROLLUP_SERVERS_KEY, 'ubuntu-server-3|ip')
+
+    # Only another server's file changes
+    path = os.path.join(base_dir, 'ubuntu-server-1', HISTORY_FILE)
+    with open(path) as f:
+        last = f.readlines()[-1]
+    with open(path, 'a') as f:
+        f.write(last.replace('2024-05-', '2024-06-'))
+    update(worker)
+    assert client.hget(data_store.ROLLUP_SERVERS_KEY, 'ubuntu-server-3|ip') == ip
+
+def test_truncated_rewritten_and_rotated_histories_match_a_full_ingest(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=50)
+    server = 'ubuntu-server-1'
+    path = os.path.join(base_dir, server, HISTORY_FILE)
+    with open(path) as f:
+        lines = f.readlines()
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    version = update(worker)
+    generation = data_store.get_generation(client, version)
+
+    # Truncated: the rows left replace the stored ones
+    rewrite(path, lines[:11])
+    update(worker)
+    assert len(data_store.get_server_data(binary, server)['history']) == 10
+    assert stored(client, binary) == from_scratch(tmp_path)
+    assert list(data_store.get_changes_since(client, version, generation)['servers']) == [server]
+
+    # Rewritten with the same size but other rows
+    rewrite(path, [lines[0]] + [line.replace(',success', ',failure') for line in lines[1:11]])
+    update(worker)
+    assert {row['status'] for row in data_store.get_server_data(binary, server)['history']} == {'failure'}
+    assert stored(client, binary) == from_scratch(tmp_path)
+
+    # Rotated: the old file is moved away and a new one started
+    os.rename(path, f'{path}.1')
+    rewrite(path, [lines[0]] + [line.replace('2024-05-', '2024-06-') for line in lines[1:6]])
+    update(worker)
+    assert len(data_store.get_server_data(binary, server)['history']) == 5
+    assert stored(client, binary) == from_scratch(tmp_path)
+
+def test_deleted_server_is_dropped_everywhere(tmp_path):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=30)
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    version = update(worker)
+    generation = data_store.get_generation(client, version)
+
+    shutil.rmtree(os.path.join(base_dir, 'ubuntu-server-2'))
+    update(worker)
+    assert data_store.get_server_names(client) == ['ubuntu-server-1', 'ubuntu-server-3']
+    assert not [field for field in client.hkeys(data_store.ROLLUP_SERVERS_KEY)
+                if field.startswith('ubuntu-server-2|')]
+    assert stored(client, binary) == from_scratch(tmp_path)
+    delta = data_store.get_changes_since(client, version, generation)
+    assert delta['removed'] == ['ubuntu-server-2'] and delta['servers'] == {}
+
+def test_archive_cutover_keeps_every_row_readable(tmp_path, monkeypatch):
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=50)
+    server = 'ubuntu-server-1'
+    client, binary = clients()
+    worker = make_worker(tmp_path, client, binary)
+    update(worker)
+    before, rollup = stored(client, binary)
+    history = list(data_store.iter_history(binary, server))
+
+    # Retention turned on: the rows before the cutoff move to the archive
+    monkeypatch.setattr(archive, 'history_cutoff', lambda days: '2024-05-01 04:00:00')
+    worker.retention_days = 1
+    update(worker)
+    archived = archive.load_manifest(str(tmp_path / 'archive'), server)['rows']
+    assert 0 < archived < len(history)
+    assert len(data_store.get_server_data(binary, server)['history']) == len(history) - archived
+
+    after, rollup_after = stored(client, binary)
+    assert rollup_after == rollup
+    assert after['summary'] == before['summary']
+    assert ({name: server_data['summary'] for name, server_data in after['servers'].items()}
+            == {name: server_data['summary'] for name, server_data in before['servers'].items()})
+    reader = archive.open_history(str(tmp_path / 'archive'), server)
+    rows = list(data_store.iter_history(binary, server, archive=reader))
+    assert [row['timestamp'] for row in rows] == [row['timestamp'] for row in history]
+    assert sorted(map(str, rows)) == sorted(map(str, history))
+
+def test_expired_changelog_serves_the_full_document(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(data_store, 'CHANGELOG_VERSIONS', 2)
+    base_dir = str(tmp_path / 'exchange')
+    generate_fleet(base_dir, servers=3, rows=30)
+    client, binary = clients()
+    monkeypatch.setattr(app, 'redis_client', client)
+    monkeypatch.setattr(app, 'redis_binary', binary)
+    worker = make_worker(tmp_path, client, binary)
+    update(worker)
+    generation = data_store.get_generation(client, 1)
+    for _ in range(3):
+        append_runs(base_dir, 1)
+        update(worker)
+
+    assert data_store.get_changes_since(client, 1, generation) is None
+    response = app.app.test_client().get(f'/api/data?since_version=1&since_generation={generation}')
+    document = response.get_json()
+    assert response.headers['X-Snapshot-Version'] == '4'
+    assert not document.get('delta')
+    assert sorted(document['servers']) == data_store.get_server_names(client)
+
+    # A version still in the changelog gets a delta
+    generation = data_store.get_generation(client, 3)
+    response = app.app.test_client().get(f'/api/data?since_version=3&since_generation={generation}')
+    assert response.get_json()['delta'] is True
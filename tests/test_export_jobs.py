@@ -0,0 +1,21 @@
+import os
+import time
+
+import fakeredis
+
+from export_jobs import JOB_TIMEOUT_SECONDS, ExcelExportJobs
+
+def test_evict_removes_temporary_files_of_stopped_exports(tmp_path):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    jobs = ExcelExportJobs(client, fakeredis.FakeRedis(), str(tmp_path))
+    stale = tmp_path / 'exchange_data_old.xlsx.1.tmp'
+    running = tmp_path / 'exchange_data_new.xlsx.2.tmp'
+    workbook = tmp_path / 'exchange_data_old.xlsx'
+    for path in (stale, running, workbook):
+        path.write_bytes(b'x')
+    old = time.time() - JOB_TIMEOUT_SECONDS - 1
+    os.utime(stale, (old, old))
+    os.utime(workbook, (old, old))
+
+    jobs.evict()
+    assert sorted(os.listdir(tmp_path)) == ['exchange_data_new.xlsx.2.tmp', 'exchange_data_old.xlsx']
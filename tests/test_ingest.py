@@ -0,0 +1,77 @@
+import os
+
+import archive
+from benchmarks.fleet import generate_fleet
+from data_parser import HISTORY_FILE, ingest_exchange_data
+
+# Rows of the synthetic fleet before this timestamp are archived
+CUTOFF = '2024-05-02 00:00:00'
+
+def ingest(base_dir, archive_dir, previous=None, checkpoints=None):
+    """Run one incremental ingest with retention, as IngestWorker.update does"""
+    archives = archive.load_manifests(archive_dir)
+    data, checkpoints, changes, _ = ingest_exchange_data(base_dir, previous, checkpoints, workers=1,
+                                                         archives=archives)
+    archive.compact_history(base_dir, archive_dir, data, checkpoints, changes, CUTOFF, archives)
+    return data, checkpoints
+
+def sent_rows(path):
+    """Count the 'sent' rows of a history.csv file"""
+    with open(path) as f:
+        return sum(1 for line in f if line.split(',')[2:3] == ['sent'])
+
+def rewrite_in_place(path, content):
+    """Overwrite a file keeping its inode, as an scp copy onto an existing file does"""
+    with open(path, 'r+b') as f:
+        f.truncate(0)
+        f.write(content)
+
+def test_rewrite_in_place_keeps_archived_rows_counted_once(tmp_path):
+    base_dir, archive_dir = str(tmp_path / 'exchange'), str(tmp_path / 'archive')
+    generate_fleet(base_dir, servers=3, rows=300)
+    server = 'ubuntu-server-1'
+    path = os.path.join(base_dir, server, HISTORY_FILE)
+    with open(path, 'rb') as f:
+        content = f.read()
+    expected = sent_rows(path)
+
+    data, checkpoints = ingest(base_dir, archive_dir)
+    manifest = archive.load_manifest(archive_dir, server)
+    assert manifest['rows'] and data['servers'][server]['summary']['total_sent'] == expected
+
+    # Ingest catches the copy half way through the archived rows, then once complete
+    rewrite_in_place(path, content[:manifest['offset'] // 2])
+    data, checkpoints = ingest(base_dir, archive_dir, data, checkpoints)
+    assert data['servers'][server]['summary']['total_sent'] == manifest['sent']
+    assert data['servers'][server]['history'] == []
+
+    rewrite_in_place(path, content)
+    data, checkpoints = ingest(base_dir, archive_dir, data, checkpoints)
+    server_data = data['servers'][server]
+    assert server_data['summary']['total_sent'] == expected
+    assert len(server_data['history']) + manifest['rows'] == content.count(b'\n') - 1
+    assert archive.load_manifest(archive_dir, server)['rows'] == manifest['rows']
+
+    # A following ingest leaves everything as it is
+    data, checkpoints = ingest(base_dir, archive_dir, data, checkpoints)
+    assert data['servers'][server]['summary']['total_sent'] == expected
+
+def test_rotated_file_keeps_archived_totals(tmp_path):
+    base_dir, archive_dir = str(tmp_path / 'exchange'), str(tmp_path / 'archive')
+    generate_fleet(base_dir, servers=3, rows=300)
+    server = 'ubuntu-server-1'
+    path = os.path.join(base_dir, server, HISTORY_FILE)
+
+    data, checkpoints = ingest(base_dir, archive_dir)
+    manifest = archive.load_manifest(archive_dir, server)
+
+    # A new file with only newer rows: the archived rows still count
+    with open(path) as f:
+        lines = f.readlines()
+    os.remove(path)
+    with open(path, 'w') as f:
+        f.writelines([lines[0]] + lines[-10:])
+    data, checkpoints = ingest(base_dir, archive_dir, data, checkpoints)
+    server_data = data['servers'][server]
+    assert len(server_data['history']) == 10
+    assert server_data['summary']['total_sent'] == manifest['sent'] + sent_rows(path)
@@ -0,0 +1,33 @@
+import threading
+
+import fakeredis
+
+from refresh_jobs import ALL_SERVERS, PENDING_KEY, RefreshJobs
+
+def test_requests_run_only_where_refreshes_run():
+    server = fakeredis.FakeServer()
+    calls = []
+    ran = threading.Event()
+
+    def refresh(servers):
+        calls.append(servers)
+        ran.set()
+        return 1
+
+    def not_here(servers):
+        raise AssertionError("The requesting process ran the refresh")
+
+    web = RefreshJobs(fakeredis.FakeRedis(server=server, decode_responses=True), not_here)
+    ingest = RefreshJobs(fakeredis.FakeRedis(server=server, decode_responses=True), refresh)
+
+    # Requests are merged into one job that nothing runs yet
+    job = web.request(['ubuntu-server-1'])
+    assert job['status'] == 'queued'
+    assert web.request()['job_id'] == job['job_id']
+    assert web.client.smembers(PENDING_KEY) == {'ubuntu-server-1', ALL_SERVERS}
+
+    # The ingest process takes the job over under the id the clients poll
+    assert ingest.take_requests()['job_id'] == job['job_id']
+    assert ingest.wait(job['job_id'])['status'] == 'done'
+    assert ran.is_set() and calls == [None]
+    assert ingest.take_requests() is None